@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    AEMET OpenData client shared by the AEMET harvesters.
+
+    Every resource of AEMET OpenData is fetched in two stages: the request to the API (with the api_key) returns
+    a link to the data ("datos"), that is then downloaded. Both stages run in the event loop, through one
+    connection pool, so that many municipalities can be fetched in parallel.
+
+    The API has a quota of requests per key: the requests to it go through a token bucket (rate requests per
+    second, up to burst at once), limited by the Remaining-request-count header of every response. When the
+    remaining requests reach reserve, or the API answers 429, the bucket is paused for pause seconds (the quota
+    is renewed meanwhile) and the requests resume on their own; a request that got 429 is retried up to retries
+    times. The links to the data are not counted in the quota.
+
+    Usage:
+        async with AEMETClient(key) as aemet:
+            data = await aemet.get(url)
+            content = loads(data.text)
+"""
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+from asyncio import sleep, TimeoutError as ToE
+from json import loads
+from time import monotonic
+import logging
+
+default_burst = 40             # requests to the API at once
+default_charset = 'ISO-8859-15'
+default_limit = 10             # amount of parallel requests to AEMET
+default_pause = 60             # seconds the requests are paused when the quota is exhausted
+default_rate = 0.8             # requests per second to the API
+default_request_timeout = 60   # seconds
+default_reserve = 5            # remaining requests of the quota that are not used
+default_retries = 3            # times a request is retried after a 429
+default_ttl_dns_cache = 300    # seconds the address of AEMET is cached
+
+http_ok = [200, 201, 204]
+http_too_many = 429
+
+logger = logging.getLogger('root')
+
+
+class AEMETError(Exception):
+    pass
+
+
+class AEMETData:
+    __slots__ = ('headers', 'content', 'charset')
+
+    def __init__(self, headers, content, charset=None):
+        self.headers = headers    # headers of the data
+        self.content = content    # bytes
+        self.charset = charset or default_charset
+
+    @property
+    def text(self):
+        return self.content.decode(self.charset, errors='replace')
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.paused_until = 0.0
+
+    def refill(self):
+        now = monotonic()
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    async def acquire(self):
+        while True:
+            now = monotonic()
+            if now < self.paused_until:
+                await sleep(self.paused_until - now)
+                continue
+
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+
+            await sleep((1 - self.tokens) / self.rate)
+
+    # No token until seconds from now, the bucket is refilled from then
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, monotonic() + seconds)
+        self.tokens = 0
+        self.updated = self.paused_until
+
+    def limit(self, tokens):
+        self.refill()
+        self.tokens = min(self.tokens, max(0, tokens))
+
+    @property
+    def paused(self):
+        return monotonic() < self.paused_until
+
+
+class AEMETClient:
+    def __init__(self, key, limit=default_limit, rate=default_rate, burst=default_burst, reserve=default_reserve,
+                 pause=default_pause, retries=default_retries, request_timeout=default_request_timeout):
+        self.key = key
+        self.limit = limit
+        self.bucket = TokenBucket(rate, burst)
+        self.reserve = reserve
+        self.pause = pause
+        self.retries = retries
+        self.request_timeout = request_timeout
+        self.session = None
+        self.remaining = None
+        self.counters = {
+            'requests': 0,
+            'downloads': 0,
+            'pauses': 0,
+            'retries': 0
+        }
+
+    async def open(self):
+        connector = TCPConnector(limit=self.limit, ttl_dns_cache=default_ttl_dns_cache)
+        self.session = ClientSession(connector=connector, timeout=ClientTimeout(total=self.request_timeout))
+        return self
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    # Returns the data (AEMETData) of a resource of the API, raises AEMETError if it could not be fetched
+    async def get(self, url):
+        link = await self.get_link(url)
+
+        try:
+            async with self.session.get(link, ssl=False) as response:
+                content = await response.read()
+                status = response.status
+                headers = response.headers
+                charset = response.charset
+        except ToE:
+            raise AEMETError('timeout problem')
+        except ClientError:
+            raise AEMETError('connection problem')
+
+        self.counters['downloads'] += 1
+
+        if status not in http_ok:
+            raise AEMETError('return code ' + str(status))
+
+        return AEMETData(headers, content, charset)
+
+    # First stage: the link to the data, within the quota
+    async def get_link(self, url):
+        attempt = 0
+
+        while True:
+            await self.bucket.acquire()
+            self.counters['requests'] += 1
+
+            try:
+                async with self.session.get(url, headers={'api_key': self.key}, ssl=False) as response:
+                    body = await response.read()
+                    status = response.status
+                    self.quota(response.headers.get('Remaining-request-count'))
+            except ToE:
+                raise AEMETError('timeout problem')
+            except ClientError:
+                raise AEMETError('connection problem')
+
+            if status in http_ok:
+                try:
+                    body = loads(body.decode('utf-8', errors='replace'))
+                    status = int(body.get('estado', status))
+                except (AttributeError, ValueError):
+                    raise AEMETError('invalid response')
+
+            if status != http_too_many:
+                break
+
+            self.throttle('the quota is exhausted')
+            if attempt >= self.retries:
+                raise AEMETError('quota problem')
+            attempt += 1
+            self.counters['retries'] += 1
+
+        if status not in http_ok:
+            raise AEMETError('return code ' + str(status))
+
+        if 'datos' not in body:
+            raise AEMETError('response without data')
+
+        return body['datos']
+
+    # Remaining-request-count of a response of the API
+    def quota(self, remaining):
+        try:
+            remaining = int(remaining)
+        except (TypeError, ValueError):
+            return
+
+        self.remaining = remaining
+        self.bucket.limit(remaining - self.reserve)
+
+        if remaining <= self.reserve:
+            self.throttle('{} requests remaining'.format(remaining))
+
+    def throttle(self, reason):
+        if self.bucket.paused:
+            return
+
+        self.counters['pauses'] += 1
+        self.bucket.pause(self.pause)
+        logger.info('AEMET: %s, requests paused for %s seconds', reason, self.pause)
+
+    def log_metrics(self):
+        logger.info('AEMET requests: %s, downloads: %s, remaining quota: %s, pauses: %s, retries: %s',
+                    self.counters['requests'], self.counters['downloads'], self.remaining, self.counters['pauses'],
+                    self.counters['retries'])
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Runs the cycles of a harvester working as a service inside one event loop, so that the HTTP sessions
+    (connection pools, DNS cache) and the background tasks of the harvester live as long as the service.
+
+    Cycles start on a fixed schedule (start + n * interval), so the duration of the cycles does not make the
+    schedule drift. A cycle still running after its deadline (by default, the interval minus a tolerance) is
+    cancelled. A cycle that ends after the start of the next one (by more than the tolerance) is an overrun: the
+    cycles that should have started meanwhile are skipped and logged.
+
+    Usage:
+        async with OrionClient(...) as client:
+            await run_periodically(harvest, interval)
+"""
+
+from asyncio import CancelledError, get_event_loop, sleep, wait_for, TimeoutError as ToE
+import logging
+
+default_tolerance = 1.0    # seconds a cycle may end after the start of the next one, not skipping it
+
+logger = logging.getLogger('root')
+
+
+class Cadence:
+    def __init__(self, interval, deadline=None, name='Cycle'):
+        self.interval = interval
+        self.tolerance = min(default_tolerance, interval / 10)
+        self.deadline = deadline if deadline and deadline > 0 else interval - self.tolerance
+        self.name = name
+        self.counters = {
+            'cycles': 0,
+            'cancelled': 0,
+            'failed': 0,
+            'overruns': 0,
+            'skipped': 0
+        }
+
+    # Runs cycle() (a coroutine function) once, within the deadline. Returns False if it did not complete
+    async def run_once(self, cycle, number=0):
+        self.counters['cycles'] += 1
+        try:
+            await wait_for(cycle(), self.deadline)
+        except CancelledError:
+            raise
+        except ToE:
+            self.counters['cancelled'] += 1
+            logger.error('%s %s cancelled after the deadline of %s seconds', self.name, number, self.deadline)
+            return False
+        except Exception:
+            self.counters['failed'] += 1
+            logger.exception('%s %s failed', self.name, number)
+            return False
+
+        return True
+
+    async def run(self, cycle, offset=0.0):
+        loop = get_event_loop()
+        start = loop.time() + offset
+        number = 0
+
+        while True:
+            delay = start + number * self.interval - loop.time()
+            if delay > 0:
+                await sleep(delay)
+
+            began = loop.time()
+            await self.run_once(cycle, number)
+            ended = loop.time()
+            logger.debug('%s %s took %.1f seconds', self.name, number, ended - began)
+
+            # a cycle ending just after the start of the next one (e.g. cancelled at its deadline) runs it late
+            following = max(number + 1, int((ended - self.tolerance - start) // self.interval) + 1)
+            if following > number + 1:
+                self.counters['overruns'] += 1
+                self.counters['skipped'] += following - number - 1
+                logger.error('%s %s overrun: it took %.1f seconds, the interval is %s seconds, %s cycles skipped',
+                             self.name, number, ended - began, self.interval, following - number - 1)
+
+            number = following
+
+
+# offset: seconds before the first cycle, to stagger the cycles of several harvesters
+async def run_periodically(cycle, interval, deadline=None, name='Cycle', offset=0.0):
+    await Cadence(interval, deadline, name).run(cycle, offset)
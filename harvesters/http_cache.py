@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Cache of the responses of the sources of the harvesters (IPMA, AEMET), so that a payload is downloaded and
+    processed (prepared and posted to Orion) only when it changed since it was processed the last time.
+
+    For every resource (key, usually its URL) the cache keeps the validators of the last response (ETag,
+    Last-Modified), the time it is fresh until (Cache-Control max-age or Expires) and the SHA-256 of its content:
+      - while the resource is fresh, it is not requested at all;
+      - otherwise it is requested with If-None-Match / If-Modified-Since, a 304 means it did not change;
+      - a response with the same content as before did not change either (sources without validators, or the
+        data links of AEMET, that are different on every request).
+
+    An entry also records the scope it was processed in (e.g. the stations harvested or the day a forecast is
+    relative to): the entries of another scope are ignored. The changes are only committed once the payload was
+    posted, so a payload that did not reach Orion is processed again in the next cycle.
+
+    Entries are kept in memory and, if a folder is given, in one JSON file each, so that they survive a restart.
+
+    Usage:
+        cache = HTTPCache(folder)
+        if not cache.fresh(url, scope):
+            response = get(url, headers=cache.validators(url, scope))
+            if response.status_code == 304:
+                cache.not_modified(url, response.headers)
+            elif cache.modified(url, scope, response.headers, response.content):
+                ...
+        cache.commit(posted)
+"""
+
+from email.utils import parsedate_to_datetime
+from hashlib import sha1, sha256
+from json import dumps, loads
+from os import makedirs, path as os_path, replace
+from time import time
+import logging
+
+CACHE_VERSION = 1
+
+logger = logging.getLogger('root')
+
+
+# Seconds a response is fresh for, according to its Cache-Control or Expires headers
+def freshness(headers):
+    cache_control = [item.strip().lower() for item in headers.get('Cache-Control', '').split(',')]
+
+    if 'no-cache' in cache_control or 'no-store' in cache_control:
+        return 0
+
+    for item in cache_control:
+        if item.startswith('max-age='):
+            try:
+                return max(0, int(item[8:]) - int(headers.get('Age', 0)))
+            except ValueError:
+                return 0
+
+    if 'Expires' in headers:
+        try:
+            expires = parsedate_to_datetime(headers['Expires']).timestamp()
+            date = parsedate_to_datetime(headers['Date']).timestamp() if 'Date' in headers else time()
+        except (TypeError, ValueError):
+            return 0
+        return max(0, expires - date)
+
+    return 0
+
+
+def scope_hash(scope):
+    return sha1(repr(scope).encode('utf-8')).hexdigest()
+
+
+class HTTPCache:
+    def __init__(self, folder=None):
+        self.folder = folder
+        self.entries = dict()
+        self.pending = dict()
+        self.counters = {
+            'fresh': 0,
+            'not_modified': 0,
+            'unchanged': 0,
+            'modified': 0
+        }
+
+        if folder:
+            makedirs(folder, exist_ok=True)
+
+    def entry_file(self, key):
+        return os_path.join(self.folder, sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, key, scope=None):
+        if key not in self.entries and self.folder:
+            try:
+                with open(self.entry_file(key), 'r', encoding='utf8') as f:
+                    entry = loads(f.read())
+            except (OSError, ValueError):
+                entry = None
+
+            if isinstance(entry, dict) and entry.get('version') == CACHE_VERSION and entry.get('key') == key:
+                self.entries[key] = entry
+
+        entry = self.entries.get(key)
+        if entry is None or (scope is not None and entry['scope'] != scope_hash(scope)):
+            return None
+
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+
+        if self.folder:
+            file = self.entry_file(key)
+            try:
+                with open(file + '.tmp', 'w', encoding='utf8') as f:
+                    f.write(dumps(entry))
+                replace(file + '.tmp', file)
+            except OSError as e:
+                logger.error('HTTP cache: %s not saved due to the %s', file, e)
+
+    # True if the resource does not need to be requested
+    def fresh(self, key, scope=None):
+        entry = self.get(key, scope)
+        if entry is not None and entry['expires'] > time():
+            self.counters['fresh'] += 1
+            return True
+
+        return False
+
+    # Headers of the conditional request
+    def validators(self, key, scope=None):
+        result = dict()
+
+        entry = self.get(key, scope)
+        if entry is not None:
+            if entry['etag']:
+                result['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                result['If-Modified-Since'] = entry['last_modified']
+
+        return result
+
+    # The source answered 304: the entry stays, it is fresh again
+    def not_modified(self, key, headers):
+        self.counters['not_modified'] += 1
+
+        entry = self.get(key)
+        if entry is not None:
+            entry = dict(entry, expires=time() + freshness(headers))
+            entry['etag'] = headers.get('ETag', entry['etag'])
+            self.put(key, entry)
+
+    # Returns True if the content changed, the new entry is kept until commit
+    def modified(self, key, scope, headers, content):
+        entry = {
+            'version': CACHE_VERSION,
+            'key': key,
+            'scope': scope_hash(scope),
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'expires': time() + freshness(headers),
+            'sha256': sha256(content).hexdigest()
+        }
+
+        previous = self.get(key, scope)
+        if previous is not None and previous['sha256'] == entry['sha256']:
+            self.counters['unchanged'] += 1
+            self.put(key, entry)
+            return False
+
+        self.counters['modified'] += 1
+        self.pending[key] = entry
+        return True
+
+    # Saves the entries of the payloads processed (posted), or drops them so that they are processed again
+    def commit(self, processed=True):
+        if processed:
+            for key, entry in self.pending.items():
+                self.put(key, entry)
+
+        self.pending = dict()
+
+    def log_metrics(self):
+        logger.info('Source: %s fresh, %s not modified, %s unchanged, %s modified', self.counters['fresh'],
+                    self.counters['not_modified'], self.counters['unchanged'], self.counters['modified'])
@@ -0,0 +1,586 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Orion Context Broker client shared by the async harvesters.
+
+    Entities are posted to /v2/op/update in batches of at most limit_entities, with at most limit_targets
+    batches in flight. All the requests go through one connection pool, with keep-alive, so connections to
+    Orion are reused between batches (and between cycles, if the client is kept open).
+
+    The batch size and the amount of parallel requests are adapted at runtime (additive increase,
+    multiplicative decrease), within [min_entities, limit_entities] and [min_targets, limit_targets]:
+      - a batch slower than latency_target halves the batch size,
+      - a batch failed due to a broker problem (connection, timeout, 429, 5xx) halves both,
+      - batches accepted in time add increase_entities to the batch size and 1 to the parallel requests
+        per round trip (each batch adds its share).
+    Only one decrease is applied per round trip: batches sent before the last decrease cannot decrease
+    the values again. The current values are logged (log_metrics) and available in metrics().
+
+    Failed batches:
+      - broker problems (connection, timeout, 429, 5xx) are retried up to retries times, after a random
+        delay (full jitter) that doubles on every attempt. So is a 404, that usually means a wrong endpoint,
+        service or path rather than a wrong entity: its entities are kept (spooled), not dropped,
+      - batches rejected by Orion (400, 413, 422) are split in two halves that are posted again, until
+        the entities rejected are isolated. The error returned by Orion for them is logged and, if a
+        dead_letter file is given, they are appended to it (one JSON line per entity).
+
+    Orion unavailable:
+      - after breaker_threshold consecutive broker problems, the circuit opens: batches are not sent to
+        Orion, except one every breaker_timeout seconds to check whether it is back,
+      - if a spool (see spool.py) is given, the batches that could not be posted (retries exhausted or circuit
+        open) are appended to it. While the spool is not empty, new batches are appended behind them, so that
+        Orion receives the entities in order. The spool is replayed after every post and, while the client is
+        open, every replay_interval seconds.
+
+    Several clients (e.g. one per harvester, see supervisor.py) can share one connection pool (connector) and
+    a budget: a semaphore that limits the requests in flight to Orion of all of them.
+
+    Entities with the same id and type are coalesced before splitting: their attributes are merged (the
+    last value wins, as it would when APPEND applies them one after the other), so that one entity is never
+    sent twice, nor in two batches in flight at the same time. The input list is never modified.
+
+    Usage:
+        async with OrionClient(orion, service, path, limit_entities, limit_targets) as client:
+            results = await client.post(entities)
+        report(results)
+"""
+
+from aiohttp import ClientSession, ClientConnectorError, ClientError, ClientTimeout, TCPConnector
+from asyncio import FIRST_COMPLETED, CancelledError, Lock, ensure_future, sleep, wait, TimeoutError as ToE
+from datetime import datetime, timezone
+from json import dumps, loads
+from random import uniform
+from time import monotonic
+import logging
+
+default_action = 'APPEND'
+default_backoff = 0.5                  # seconds before the first retry of a batch (at most)
+default_backoff_max = 30               # seconds before a retry of a batch (at most)
+default_breaker_threshold = 5          # consecutive broker problems that open the circuit
+default_breaker_timeout = 30           # seconds between the checks of Orion while the circuit is open
+default_increase_entities = 5          # entities added to the batch size after a batch accepted in time
+default_keepalive = 60                 # seconds an idle connection to Orion is kept open
+default_latency_target = 2.0           # seconds, slower batches decrease the batch size
+default_limit_entities = 50            # max amount of entities per 1 request to Orion
+default_limit_targets = 50             # max amount of parallel request to Orion
+default_min_entities = 5               # min amount of entities per 1 request to Orion
+default_min_targets = 1                # min amount of parallel request to Orion
+default_replay_interval = 10           # seconds between the replays of the spool
+default_request_timeout = 60           # seconds to complete one request to Orion
+default_retries = 3                    # retries of a batch failed due to a broker problem
+default_ttl_dns_cache = 300            # seconds the address of Orion is cached
+
+http_not_found = [404]
+http_ok = [200, 201, 204]
+http_overload = [429, 500, 502, 503, 504]
+http_rejected = [400, 413, 422]
+http_too_large = [413]
+
+logger = logging.getLogger('root')
+
+
+class BatchResult:
+    __slots__ = ('entities', 'status', 'error', 'description', 'elapsed', 'attempts', 'spooled')
+
+    def __init__(self, entities, status=None, error=None, elapsed=0.0, description=None):
+        self.entities = entities          # entities of the batch
+        self.status = status              # HTTP status, None if no response was received
+        self.error = error                # None if the batch was accepted
+        self.description = description    # error returned by Orion
+        self.elapsed = elapsed            # seconds
+        self.attempts = 1                 # requests sent
+        self.spooled = False              # appended to the spool, to be replayed
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    # Broker problem (or Orion misconfigured), worth a retry
+    @property
+    def transient(self):
+        return not self.ok and (self.status is None or self.status in http_overload or self.status in http_not_found)
+
+    # Some of the entities were rejected
+    @property
+    def rejected(self):
+        return not self.ok and self.status in http_rejected
+
+    def __repr__(self):
+        return 'BatchResult({} entities, status={}, error={}, spooled={})'.format(len(self.entities), self.status,
+                                                                                  self.error, self.spooled)
+
+
+# Merges the entities with the same id and type, keeping the order of their first appearance
+def coalesce(entities):
+    result = dict()
+
+    for entity in entities:
+        if entity is None:
+            continue
+
+        key = (entity.get('id'), entity.get('type'))
+        if key in result:
+            result[key] = {**result[key], **entity}
+        else:
+            result[key] = entity
+
+    return list(result.values())
+
+
+# Orion returns {"error": ..., "description": ...}
+def parse_error(body):
+    try:
+        content = loads(body.decode('utf-8', 'replace'))
+    except (ValueError, TypeError):
+        content = None
+
+    if isinstance(content, dict) and 'error' in content:
+        if 'description' in content:
+            return '{}: {}'.format(content['error'], content['description'])
+        return str(content['error'])
+
+    return body[:200].decode('utf-8', 'replace').strip() or None
+
+
+# Groups the consecutive spooled batches with the same action, returning [(action, entities)]
+def group_records(records):
+    result = list()
+
+    for record in records:
+        if len(result) > 0 and result[-1][0] == record['action']:
+            result[-1][1].extend(record['entities'])
+        else:
+            result.append((record['action'], list(record['entities'])))
+
+    return result
+
+
+# Closed while Orion answers. Open after threshold consecutive failures: then one request is allowed every
+# timeout seconds, until one of them succeeds
+class CircuitBreaker:
+    def __init__(self, threshold=default_breaker_threshold, timeout=default_breaker_timeout):
+        self.threshold = threshold
+        self.timeout = timeout
+        self.failures = 0
+        self.opened = 0.0
+
+    @property
+    def closed(self):
+        return self.failures < self.threshold
+
+    def allow(self):
+        if self.closed:
+            return True
+
+        if monotonic() >= self.opened + self.timeout:
+            self.opened = monotonic()
+            return True
+
+        return False
+
+    def success(self):
+        if not self.closed:
+            logger.info('Orion is available again, circuit closed')
+        self.failures = 0
+
+    def failure(self):
+        self.failures += 1
+        if self.failures == self.threshold:
+            logger.error('Orion is not available, circuit open')
+        if self.failures >= self.threshold:
+            self.opened = monotonic()
+
+
+# Connection pool to Orion, it can be shared by several clients
+def create_connector(limit, keepalive=default_keepalive):
+    return TCPConnector(limit=limit, keepalive_timeout=keepalive, ttl_dns_cache=default_ttl_dns_cache)
+
+
+# Value adapted by additive increase / multiplicative decrease within [minimum, maximum]
+class AIMD:
+    def __init__(self, minimum, maximum, increase=1, decrease=0.5, adaptive=True):
+        self.minimum = max(1, min(minimum, maximum))
+        self.maximum = maximum
+        self.step = increase
+        self.factor = decrease
+        self.adaptive = adaptive
+        self.level = float(maximum)
+        self.epoch = 0                 # amount of decreases
+
+    @property
+    def value(self):
+        return int(self.level)
+
+    # share: part of the round trip the batch stands for, so that the value
+    # grows by step once per round trip
+    def increase(self, share=1.0):
+        if self.adaptive:
+            self.level = min(float(self.maximum), self.level + self.step * share)
+
+    # epoch: value of self.epoch when the batch was sent
+    def decrease(self, epoch):
+        if self.adaptive and epoch == self.epoch:
+            self.level = float(max(self.minimum, int(self.level * self.factor)))
+            self.epoch += 1
+
+
+class OrionClient:
+    def __init__(self, orion, service=None, path=None,
+                 limit_entities=default_limit_entities,
+                 limit_targets=default_limit_targets,
+                 keepalive=default_keepalive,
+                 request_timeout=default_request_timeout,
+                 adaptive=True,
+                 min_entities=default_min_entities,
+                 min_targets=default_min_targets,
+                 latency_target=default_latency_target,
+                 retries=default_retries,
+                 dead_letter=None,
+                 spool=None,
+                 breaker_threshold=default_breaker_threshold,
+                 breaker_timeout=default_breaker_timeout,
+                 replay_interval=default_replay_interval,
+                 connector=None,
+                 budget=None):
+        self.url = orion.rstrip('/') + '/v2/op/update'
+        self.limit_entities = limit_entities
+        self.limit_targets = limit_targets
+        self.keepalive = keepalive
+        self.request_timeout = request_timeout
+        self.latency_target = latency_target
+        self.retries = retries
+        self.dead_letter = dead_letter
+        self.spool = spool
+        self.connector = connector
+        self.budget = budget
+        self.replay_interval = replay_interval
+        self.replay_lock = None
+        self.replay_task = None
+        self.session = None
+
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_timeout)
+
+        self.batch_size = AIMD(min_entities, limit_entities, default_increase_entities, adaptive=adaptive)
+        self.targets = AIMD(min_targets, limit_targets, adaptive=adaptive)
+
+        self.counters = {
+            'batches': 0,
+            'batches_failed': 0,
+            'dead_letters': 0,
+            'entities': 0,
+            'replayed': 0,
+            'retries': 0,
+            'seconds': 0.0,
+            'splits': 0,
+            'spooled': 0
+        }
+
+        self.headers = {
+            'Content-Type': 'application/json'
+        }
+        if service:
+            self.headers['FIWARE-SERVICE'] = service
+        if path:
+            self.headers['FIWARE-SERVICEPATH'] = path
+
+    # The session must be created inside the running event loop
+    async def open(self):
+        if self.session is None or self.session.closed:
+            if self.connector is not None:
+                connector, owner = self.connector, False
+            else:
+                connector, owner = create_connector(self.limit_targets, self.keepalive), True
+            self.session = ClientSession(connector=connector,
+                                         connector_owner=owner,
+                                         headers=self.headers,
+                                         timeout=ClientTimeout(total=self.request_timeout))
+
+        if self.spool is not None and self.replay_task is None:
+            self.replay_lock = Lock()
+            self.replay_task = ensure_future(self.replay_forever())
+
+        return self
+
+    async def close(self):
+        if self.replay_task is not None:
+            self.replay_task.cancel()
+            try:
+                await self.replay_task
+            except CancelledError:
+                pass
+            self.replay_task = None
+
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    # Returns the BatchResults, in the order of the entities: one per batch, or one per part of a batch
+    # that was split. Batches are cut when they are sent, with the batch size of that moment
+    async def post(self, entities, action=default_action):
+        await self.open()
+
+        entities = coalesce(entities)
+
+        if self.spool is not None and self.spool.pending():
+            results = self.append_spool(entities, action)
+            await self.replay()
+            return results
+
+        return await self.post_entities(entities, action)
+
+    async def post_entities(self, entities, action, spool=True):
+        position = 0
+        results = dict()
+        tasks = dict()
+
+        try:
+            while position < len(entities) or len(tasks) > 0:
+                while position < len(entities) and len(tasks) < self.targets.value:
+                    batch = entities[position:position + self.batch_size.value]
+                    task = ensure_future(self.post_batch(batch, action, spool))
+                    tasks[task] = position
+                    position += len(batch)
+
+                done, _ = await wait(tasks, return_when=FIRST_COMPLETED)
+                for task in done:
+                    results[tasks.pop(task)] = task.result()
+        finally:
+            # cancelled (e.g. deadline of the cycle): the batches in flight are cancelled too
+            for task in tasks:
+                task.cancel()
+
+        return [result for offset in sorted(results) for result in results[offset]]
+
+    # Posts a batch, retrying broker problems and splitting it if rejected. Returns a list of BatchResults
+    async def post_batch(self, batch, action=default_action, spool=True):
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                result = BatchResult(batch, error='circuit open')
+                break
+
+            result = await self.post_adapt(batch, action)
+            if result.transient:
+                self.breaker.failure()
+            else:
+                self.breaker.success()
+
+            if not result.transient or attempt >= self.retries:
+                break
+            await sleep(uniform(0, min(default_backoff_max, default_backoff * 2 ** attempt)))
+            attempt += 1
+            self.counters['retries'] += 1
+
+        result.attempts = attempt + 1
+
+        if result.rejected:
+            if len(batch) > 1:
+                self.counters['splits'] += 1
+                half = len(batch) // 2
+                return await self.post_batch(batch[:half], action, spool) + \
+                    await self.post_batch(batch[half:], action, spool)
+            self.reject(result)
+
+        if result.transient and spool and self.spool is not None:
+            self.spool.append(batch, action)
+            self.counters['spooled'] += len(batch)
+            result.spooled = True
+
+        return [result]
+
+    # Appends the entities to the spool, behind the batches waiting there
+    def append_spool(self, entities, action):
+        results = list()
+
+        for position in range(0, len(entities), self.batch_size.value):
+            batch = entities[position:position + self.batch_size.value]
+            self.spool.append(batch, action)
+            self.counters['spooled'] += len(batch)
+            result = BatchResult(batch, error='spool not replayed yet')
+            result.spooled = True
+            results.append(result)
+
+        return results
+
+    # Posts the spooled batches, in order, until the spool is empty or Orion fails
+    async def replay(self):
+        if self.spool is None:
+            return list()
+
+        results = list()
+        async with self.replay_lock:
+            while self.spool.pending():
+                records, position = self.spool.read(self.batch_size.maximum * self.targets.maximum)
+                if len(records) == 0:
+                    # nothing left but invalid batches
+                    self.spool.commit(position)
+                    break
+
+                replayed = list()
+                for action, entities in group_records(records):
+                    replayed.extend(await self.post_entities(coalesce(entities), action, False))
+                results.extend(replayed)
+
+                if any(result.transient for result in replayed):
+                    break
+
+                self.spool.commit(position)
+                self.counters['replayed'] += sum(len(result.entities) for result in replayed)
+
+        if len(results) > 0:
+            logger.info('Spool: %s entities replayed, %s bytes pending',
+                        sum(len(result.entities) for result in results if not result.transient),
+                        self.spool.pending_size())
+
+        return results
+
+    async def replay_forever(self):
+        while True:
+            await sleep(self.replay_interval)
+            if self.spool.pending():
+                try:
+                    await self.replay()
+                except CancelledError:
+                    raise
+                except Exception:
+                    # the task keeps replaying, otherwise the spool would only grow
+                    logger.exception('Replaying the spool failed')
+
+    # Posts a batch, adapting the limits to the result
+    async def post_adapt(self, batch, action):
+        size_epoch, targets_epoch = self.batch_size.epoch, self.targets.epoch
+        result = await self.post_one(batch, action)
+        self.adapt(result, size_epoch, targets_epoch)
+
+        return result
+
+    # Entity rejected by Orion, alone in its batch
+    def reject(self, result):
+        entity = result.entities[0]
+        self.counters['dead_letters'] += 1
+        logger.error('Entity %s rejected by Orion: %s %s', entity.get('id'), result.status, result.description)
+
+        if self.dead_letter:
+            record = {
+                'time': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'url': self.url,
+                'status': result.status,
+                'error': result.description,
+                'entity': entity
+            }
+            try:
+                with open(self.dead_letter, 'a', encoding='utf8') as f:
+                    f.write(dumps(record) + '\n')
+            except OSError as e:
+                logger.error('Writing to the dead letter file failed due to the %s', e)
+
+    def adapt(self, result, size_epoch, targets_epoch):
+        self.counters['batches'] += 1
+        self.counters['entities'] += len(result.entities)
+        self.counters['seconds'] += result.elapsed
+
+        if result.ok:
+            if result.elapsed > self.latency_target:
+                self.batch_size.decrease(size_epoch)
+            else:
+                share = 1.0 / self.targets.value
+                self.batch_size.increase(share)
+                self.targets.increase(share)
+            return
+
+        self.counters['batches_failed'] += 1
+
+        if result.status is None or result.status in http_overload:
+            self.batch_size.decrease(size_epoch)
+            self.targets.decrease(targets_epoch)
+        elif result.status in http_too_large:
+            self.batch_size.decrease(size_epoch)
+
+    def metrics(self):
+        result = dict(self.counters)
+        result['batch_size'] = self.batch_size.value
+        result['parallel_requests'] = self.targets.value
+        result['batch_size_decreases'] = self.batch_size.epoch
+        result['parallel_requests_decreases'] = self.targets.epoch
+        result['circuit_open'] = not self.breaker.closed
+        result['spool_pending_bytes'] = self.spool.pending_size() if self.spool is not None else 0
+
+        return result
+
+    def log_metrics(self):
+        metrics = self.metrics()
+        logger.info('Orion batch size: %s (%s..%s), parallel requests: %s (%s..%s), batches: %s, failed: %s, '
+                    'retries: %s, rejected entities: %s, spooled: %s, replayed: %s, spool pending: %s bytes',
+                    metrics['batch_size'], self.batch_size.minimum, self.batch_size.maximum,
+                    metrics['parallel_requests'], self.targets.minimum, self.targets.maximum,
+                    metrics['batches'], metrics['batches_failed'], metrics['retries'], metrics['dead_letters'],
+                    metrics['spooled'], metrics['replayed'], metrics['spool_pending_bytes'])
+
+    async def post_one(self, batch, action=default_action):
+        payload = dumps({
+            'actionType': action,
+            'entities': batch
+        })
+
+        if self.budget is None:
+            return await self.request(batch, payload)
+
+        async with self.budget:
+            return await self.request(batch, payload)
+
+    async def request(self, batch, payload):
+        start = monotonic()
+        try:
+            async with self.session.post(self.url, data=payload) as response:
+                status = response.status
+                body = await response.read()
+        except ClientConnectorError:
+            return BatchResult(batch, error='connection problem', elapsed=monotonic() - start)
+        except ToE:
+            return BatchResult(batch, error='timeout problem', elapsed=monotonic() - start)
+        except ClientError as e:
+            return BatchResult(batch, error='client error ' + type(e).__name__, elapsed=monotonic() - start)
+
+        elapsed = monotonic() - start
+        if status not in http_ok:
+            return BatchResult(batch, status, 'response code ' + str(status), elapsed, parse_error(body))
+
+        return BatchResult(batch, status, elapsed=elapsed)
+
+
+# Logs every distinct error once, returns the amount of batches that failed (and were not spooled)
+def report(results):
+    errors = set()
+    failed = 0
+    spooled = 0
+
+    for result in results:
+        if result.spooled:
+            spooled += 1
+        elif not result.ok:
+            errors.add(result.error)
+            failed += 1
+
+    for error in sorted(errors):
+        logger.error('Posting data to Orion failed due to the %s', error)
+
+    if failed > 0:
+        logger.error('Batches failed: %s of %s', failed, len(results))
+
+    if spooled > 0:
+        logger.info('Batches spooled, to be posted when Orion is available: %s of %s', spooled, len(results))
+
+    return failed
+
+
+# True if every batch was posted or spooled: only the entities rejected by Orion are missing, posting the same
+# entities again would not help
+def delivered(results):
+    return all(result.ok or result.spooled or result.rejected for result in results)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Rotating schedule of the items (e.g. municipalities) a harvester fetches, for sources that cannot be
+    fetched entirely in every cycle (request quota).
+
+    The items are split in tiers (e.g. the capitals, then the rest of the municipalities), each one with its
+    own amount of shards: every cycle fetches one shard of every tier, so a tier of n shards is fetched entirely
+    every n cycles. A harvester working as a service every timeout seconds covers a tier within window seconds
+    with ceil(window / timeout) shards. Shards interleave the sorted items, so that they have the same size.
+
+    The items that failed in a cycle (e.g. not fetched or not posted) are carried into the next one, on top of
+    its shard (up to the size of a shard), so that a failure does not wait for a whole rotation nor hold the rest
+    of the items back.
+
+    The position of every tier and the items carried are saved in a JSON file after every cycle, so that a
+    restart resumes the rotation instead of starting it over:
+        {"version": 1, "tiers": {"<name>": {"position": 3, "shards": 36}}, "carried": ["<item>"]}
+
+    Usage:
+        rotation = Rotation(file)
+        rotation.add('capitals', capitals, shards_for(3600, timeout))
+        rotation.add('municipalities', others, shards_for(21600, timeout))
+        items = rotation.current()
+        ...
+        rotation.advance(failed)
+"""
+
+from json import dumps, loads
+from math import ceil
+from os import replace
+import logging
+
+ROTATION_VERSION = 1
+
+logger = logging.getLogger('root')
+
+
+# Amount of shards to cover a tier in window seconds, one shard every interval seconds
+def shards_for(window, interval):
+    if window <= 0 or interval <= 0:
+        return 1
+
+    return max(1, ceil(window / interval))
+
+
+class Tier:
+    __slots__ = ('name', 'items', 'shards', 'position')
+
+    def __init__(self, name, items, shards, position=0):
+        self.name = name
+        self.items = sorted(items)
+        self.shards = max(1, min(shards, len(self.items)))
+        self.position = position % self.shards
+
+    def current(self):
+        return self.items[self.position::self.shards]
+
+
+class Rotation:
+    def __init__(self, file=None):
+        self.file = file
+        self.tiers = list()
+        self.saved = self.read()
+        self.carried = list(self.saved.get('carried', list()))
+
+    def read(self):
+        if not self.file:
+            return dict()
+
+        try:
+            with open(self.file, 'r', encoding='utf8') as f:
+                state = loads(f.read())
+        except (OSError, ValueError):
+            return dict()
+
+        if not isinstance(state, dict) or state.get('version') != ROTATION_VERSION:
+            return dict()
+
+        return state
+
+    def write(self):
+        if not self.file:
+            return
+
+        state = {
+            'version': ROTATION_VERSION,
+            'tiers': {tier.name: {'position': tier.position, 'shards': tier.shards} for tier in self.tiers},
+            'carried': self.carried
+        }
+
+        try:
+            with open(self.file + '.tmp', 'w', encoding='utf8') as f:
+                f.write(dumps(state))
+            replace(self.file + '.tmp', self.file)
+        except OSError as e:
+            logger.error('Rotation: %s not saved due to the %s', self.file, e)
+
+    # Adds a tier, resuming its position if it was saved
+    def add(self, name, items, shards):
+        if len(items) == 0:
+            return
+
+        position = self.saved.get('tiers', dict()).get(name, dict()).get('position', 0)
+        self.tiers.append(Tier(name, items, shards, position))
+
+    # Items of the current cycle, the ones carried from the previous cycle first
+    def current(self):
+        result = list()
+
+        for tier in self.tiers:
+            result += tier.current()
+
+        known = set(item for tier in self.tiers for item in tier.items)
+        carried = [item for item in self.carried if item in known and item not in result]
+
+        return carried + result
+
+    # Moves every tier to its next shard once the cycle is over, carrying the items that failed into the next one.
+    # At most a shard of items is carried, so that a cycle costs twice its requests at most (e.g. source down):
+    # the new failures go first, in the order they happened, then the ones that were carried and failed again
+    def advance(self, failed=()):
+        limit = sum(len(tier.current()) for tier in self.tiers)
+
+        for tier in self.tiers:
+            tier.position = (tier.position + 1) % tier.shards
+
+        failed = list(dict.fromkeys(failed))
+        carried = set(self.carried)
+        failed = [item for item in failed if item not in carried] + [item for item in failed if item in carried]
+
+        self.carried = failed[:limit]
+        self.write()
+
+    def log_status(self):
+        for tier in self.tiers:
+            logger.info('Rotation %s: %s items, shard %s of %s', tier.name, len(tier.items), tier.position + 1,
+                        tier.shards)
+
+        if len(self.carried) > 0:
+            logger.info('Rotation: %s items carried from the previous cycle', len(self.carried))
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Append-only spool of the batches that could not be posted to the Orion Context Broker, so that they are
+    replayed (in order) once it is available again, instead of being lost.
+
+    The spool is a folder of segments (00000001.ndjson, 00000002.ndjson, ...), each line being one batch:
+        {"action": "APPEND", "entities": [...]}
+    A segment is closed when it reaches segment_size bytes. The index (index.json) keeps the position of the
+    next batch to replay; segments replayed entirely are deleted. When the spool exceeds max_size bytes, the
+    oldest segments are dropped.
+
+    Usage:
+        spool = Spool(folder)
+        spool.append(entities, 'APPEND')
+        records, position = spool.read(limit)
+        ...
+        spool.commit(position)
+"""
+
+from json import dumps, loads
+from os import listdir, makedirs, path as os_path, remove, replace
+import logging
+
+SPOOL_VERSION = 1
+
+default_max_size = 256 * 1024 * 1024     # bytes of the spool, the oldest segments are dropped above it
+default_segment_size = 4 * 1024 * 1024   # bytes of a segment
+
+segment_suffix = '.ndjson'
+
+logger = logging.getLogger('root')
+
+
+class Spool:
+    def __init__(self, folder, max_size=default_max_size, segment_size=default_segment_size):
+        self.folder = folder
+        self.max_size = max_size
+        self.segment_size = min(segment_size, max_size)
+        self.index_file = os_path.join(folder, 'index.json')
+
+        makedirs(folder, exist_ok=True)
+
+        self.segments = self.list_segments()
+        self.read_position = self.read_index()
+        self.repair()
+
+    def segment_file(self, segment):
+        return os_path.join(self.folder, '{:08d}{}'.format(segment, segment_suffix))
+
+    def segment_size_of(self, segment):
+        try:
+            return os_path.getsize(self.segment_file(segment))
+        except OSError:
+            return 0
+
+    def list_segments(self):
+        result = list()
+
+        for name in listdir(self.folder):
+            if name.endswith(segment_suffix) and name[:-len(segment_suffix)].isdigit():
+                result.append(int(name[:-len(segment_suffix)]))
+
+        return sorted(result)
+
+    # [segment, offset] of the next batch to replay
+    def read_index(self):
+        try:
+            with open(self.index_file, 'r', encoding='utf8') as f:
+                index = loads(f.read())
+        except (OSError, ValueError):
+            index = None
+
+        if isinstance(index, dict) and index.get('version') == SPOOL_VERSION:
+            segment, offset = index['read']
+            if segment in self.segments:
+                return [segment, offset]
+
+        if len(self.segments) > 0:
+            return [self.segments[0], 0]
+
+        return [0, 0]
+
+    def write_index(self):
+        tmp_file = self.index_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf8') as f:
+            f.write(dumps({'version': SPOOL_VERSION, 'read': self.read_position}))
+        replace(tmp_file, self.index_file)
+
+    # Drops the last line of the last segment if it was not completely written
+    def repair(self):
+        if len(self.segments) == 0:
+            return
+
+        segment_file = self.segment_file(self.segments[-1])
+        with open(segment_file, 'rb+') as f:
+            content = f.read()
+            if len(content) > 0 and not content.endswith(b'\n'):
+                f.truncate(content.rfind(b'\n') + 1)
+                logger.error('Spool: incomplete batch dropped from %s', segment_file)
+
+    def size(self):
+        return sum(self.segment_size_of(segment) for segment in self.segments)
+
+    # Bytes not replayed yet
+    def pending_size(self):
+        segment, offset = self.read_position
+        return sum(self.segment_size_of(item) for item in self.segments if item >= segment) - offset
+
+    def pending(self):
+        return self.pending_size() > 0
+
+    def append(self, entities, action):
+        line = (dumps({'action': action, 'entities': entities}) + '\n').encode('utf-8')
+
+        if len(self.segments) == 0 or self.segment_size_of(self.segments[-1]) + len(line) > self.segment_size:
+            if len(self.segments) > 0:
+                self.segments.append(self.segments[-1] + 1)
+            else:
+                self.segments.append(max(1, self.read_position[0]))
+                self.read_position = [self.segments[0], 0]
+
+        with open(self.segment_file(self.segments[-1]), 'ab') as f:
+            f.write(line)
+            f.flush()
+
+        self.evict()
+
+    # Drops the oldest segments while the spool is above max_size, the last one is always kept
+    def evict(self):
+        evicted = False
+
+        while len(self.segments) > 1 and self.size() > self.max_size:
+            segment = self.segments.pop(0)
+            logger.error('Spool: above %s bytes, batches of %s dropped', self.max_size, self.segment_file(segment))
+            remove(self.segment_file(segment))
+            if self.read_position[0] <= segment:
+                self.read_position = [self.segments[0], 0]
+            evicted = True
+
+        if evicted:
+            self.write_index()
+
+    # Returns the batches ([{"action", "entities"}]) from the read position, up to limit entities (at least one
+    # batch), and the position after them, to be committed once they are replayed
+    def read(self, limit):
+        records = list()
+        entities = 0
+        segment, offset = self.read_position
+
+        while segment in self.segments and entities < limit:
+            with open(self.segment_file(segment), 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    offset += len(line)
+                    try:
+                        record = loads(line.decode('utf-8'))
+                    except ValueError:
+                        logger.error('Spool: invalid batch skipped in %s', self.segment_file(segment))
+                        continue
+                    records.append(record)
+                    entities += len(record['entities'])
+                    if entities >= limit:
+                        break
+
+            if entities >= limit:
+                break
+
+            following = [item for item in self.segments if item > segment]
+            if len(following) == 0:
+                break
+            segment, offset = following[0], 0
+
+        return records, [segment, offset]
+
+    # Marks the batches up to position as replayed, deleting the segments left behind. A position in a segment
+    # evicted meanwhile (while its batches were replayed) is ignored, the read position was already moved
+    def commit(self, position):
+        if position[0] not in self.segments:
+            logger.error('Spool: position %s not committed, its segment was dropped', list(position))
+            return
+
+        self.read_position = list(position)
+
+        while len(self.segments) > 1 and self.segments[0] < self.read_position[0]:
+            remove(self.segment_file(self.segments.pop(0)))
+
+        if len(self.segments) == 1 and self.read_position[1] >= self.segment_size_of(self.segments[0]):
+            remove(self.segment_file(self.segments.pop(0)))
+            self.read_position = [self.read_position[0] + 1, 0]
+
+        self.write_index()
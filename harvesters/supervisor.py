@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    This program runs several harvesters in one process and one event loop, instead of one container (and one
+    interpreter) per harvester. The harvesters share one connection pool to the Orion Context Broker and a
+    budget of parallel requests to it, and the start of their cycles is staggered, so that their batches do not
+    reach Orion at the same time.
+
+    The harvesters to run, and their arguments, are listed in a YAML file:
+        harvesters:
+          weather-observed-spain: ['--key', '...', '--latest', '--timeout', '600', '--stations', '/opt/stations.yml']
+          weather-forecast-portugal: ['--timeout', '3600']
+
+    The Orion arguments of the supervisor (--orion, --service, --path) are passed to the harvesters that do not
+    set them. File arguments (e.g. --stations) should be absolute paths, all the harvesters share the working
+    directory.
+
+    Only the async harvesters of this repository can be loaded (see the list in harvesters), as they are written
+    to be run in one event loop: they provide setup_parser(), setup(arguments) and main(connector, budget, offset).
+"""
+
+from argparse import ArgumentTypeError, ArgumentParser
+from asyncio import Semaphore, ensure_future, gather, run, set_event_loop_policy
+from importlib.util import module_from_spec, spec_from_file_location
+from orion_client import create_connector
+from os import path as os_path
+from sys import modules, stdout
+from uvloop import EventLoopPolicy
+from yaml import safe_load as load
+import logging
+
+default_config = 'supervisor.yml'
+default_limit_targets = 50            # amount of parallel request to Orion, all the harvesters together
+default_log_level = 'INFO'
+default_orion = 'http://orion:1026'   # Orion Contest Broker endpoint
+default_root = os_path.dirname(os_path.dirname(os_path.abspath(__file__)))
+default_stagger = -1                  # seconds between the first cycles of the harvesters, if -1 computed
+
+harvesters = {
+    'weather-forecast-portugal': 'specs/Weather/WeatherForecast/harvesters/portugal/portugal_weather_forecast.py',
+    'weather-forecast-spain': 'specs/Weather/WeatherForecast/harvesters/spain/spain_weather_forecast.py',
+    'weather-observed-portugal': 'specs/Weather/WeatherObserved/harvesters/portugal/portugal_weather_observed.py',
+    'weather-observed-spain': 'specs/Weather/WeatherObserved/harvesters/spain/spain_weather_observed.py'
+}
+
+log_levels = ['ERROR', 'INFO', 'DEBUG']
+logger = None
+
+
+def load_harvester(name):
+    file = os_path.join(args.root, harvesters[name])
+    module_name = os_path.splitext(os_path.basename(file))[0]
+
+    spec = spec_from_file_location(module_name, file)
+    module = module_from_spec(spec)
+    modules[module_name] = module
+    spec.loader.exec_module(module)
+
+    return module
+
+
+def log_level_to_int(log_level_string):
+    if log_level_string not in log_levels:
+        message = 'invalid choice: {0} (choose from {1})'.format(log_level_string, log_levels)
+        raise ArgumentTypeError(message)
+
+    return getattr(logging, log_level_string, logging.ERROR)
+
+
+async def main(plugins):
+    connector = create_connector(args.limit_targets)
+    budget = Semaphore(args.limit_targets)
+
+    stagger = args.stagger
+    if stagger < 0:
+        intervals = [module.timeout for module in plugins.values() if module.timeout != -1]
+        stagger = min(intervals) / len(plugins) if len(intervals) > 0 else 0
+
+    tasks = list()
+    for number, name in enumerate(plugins):
+        logger.info('Harvester %s starts in %s seconds', name, number * stagger)
+        tasks.append(ensure_future(plugins[name].main(connector, budget, number * stagger)))
+
+    try:
+        result = await gather(*tasks, return_exceptions=True)
+    finally:
+        await connector.close()
+
+    for name, item in zip(plugins, result):
+        if isinstance(item, BaseException):
+            logger.error('Harvester %s failed due to the %s', name, repr(item))
+
+
+def reply_status(plugins):
+    logger.info('Orion: %s', args.orion)
+    logger.info('Harvesters: %s', ', '.join(plugins))
+    logger.info('limit_targets: %s', str(args.limit_targets))
+    logger.info('Log level: %s', args.log_level)
+
+
+def setup_harvesters(config):
+    result = dict()
+
+    try:
+        with open(config, 'r', encoding='utf8') as f:
+            source = load(f)
+    except FileNotFoundError:
+        logger.error('Config file not found')
+        exit(1)
+
+    if not isinstance(source, dict) or not isinstance(source.get('harvesters'), dict):
+        logger.error('Config file is empty or wrong')
+        exit(1)
+
+    for name, arguments in source['harvesters'].items():
+        if name not in harvesters:
+            logger.error('Unknown harvester %s (choose from %s)', name, sorted(harvesters))
+            exit(1)
+
+        arguments = [str(item) for item in arguments or list()]
+        for option in ['orion', 'service', 'path']:
+            value = getattr(args, option)
+            if value and '--' + option not in arguments:
+                arguments += ['--' + option, value]
+
+        module = load_harvester(name)
+        module.logger = logger
+        try:
+            module.setup(module.setup_parser().parse_args(arguments))
+        except SystemExit:
+            logger.error('Harvester %s not started, its setup failed', name)
+            continue
+
+        result[name] = module
+
+    return result
+
+
+def setup_logger():
+    local_logger = logging.getLogger('root')
+    local_logger.setLevel(log_level_to_int(args.log_level))
+
+    handler = logging.StreamHandler(stdout)
+    handler.setLevel(log_level_to_int(args.log_level))
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%dT%H:%M:%SZ')
+    handler.setFormatter(formatter)
+    local_logger.addHandler(handler)
+
+    logging.getLogger('requests').setLevel(logging.WARNING)
+
+    return local_logger
+
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser()
+    parser.add_argument('--config',
+                        action='store',
+                        default=default_config,
+                        dest='config',
+                        help='YAML file with the harvesters to run and their arguments')
+    parser.add_argument('--limit-targets',
+                        default=default_limit_targets,
+                        dest='limit_targets',
+                        type=int,
+                        help='Limit amount of parallel requests to Orion, all the harvesters together')
+    parser.add_argument('--log-level',
+                        default=default_log_level,
+                        dest='log_level',
+                        help='Set the logging output level. {0}'.format(log_levels),
+                        nargs='?')
+    parser.add_argument('--orion',
+                        action='store',
+                        default=default_orion,
+                        dest='orion',
+                        help='Orion Context Broker endpoint')
+    parser.add_argument('--path',
+                        action='store',
+                        dest='path',
+                        help='FIWARE Service Path')
+    parser.add_argument('--root',
+                        action='store',
+                        default=default_root,
+                        dest='root',
+                        help='Folder the harvesters are found in (root of the repository)')
+    parser.add_argument('--service',
+                        action='store',
+                        dest='service',
+                        help='FIWARE Service')
+    parser.add_argument('--stagger',
+                        default=default_stagger,
+                        dest='stagger',
+                        type=float,
+                        help='Seconds between the first cycles of the harvesters, default: shortest timeout / amount')
+
+    args = parser.parse_args()
+
+    logger = setup_logger()
+
+    plugins = setup_harvesters(args.config)
+    if len(plugins) == 0:
+        logger.error('No harvester to run')
+        exit(1)
+
+    reply_status(plugins)
+
+    set_event_loop_policy(EventLoopPolicy())
+
+    run(main(plugins))
+
+    logger.info('Ended')
+    exit(0)
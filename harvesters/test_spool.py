@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Tests of the spool and of its replay by the Orion client, run from this folder:
+        python3 -m unittest test_spool
+"""
+
+from asyncio import CancelledError, Lock, ensure_future, run, sleep, wait_for
+from orion_client import BatchResult, OrionClient
+from spool import Spool
+from tempfile import TemporaryDirectory
+import unittest
+
+
+def entities(first, amount):
+    return [{'id': 'urn:ngsi-ld:Test:{}'.format(item), 'type': 'Test', 'value': 'x' * 64}
+            for item in range(first, first + amount)]
+
+
+class TestSpool(unittest.TestCase):
+    def test_replay_in_order(self):
+        with TemporaryDirectory() as folder:
+            spool = Spool(folder, segment_size=1024)
+            for item in range(10):
+                spool.append(entities(item * 2, 2), 'APPEND')
+
+            replayed = list()
+            while spool.pending():
+                records, position = spool.read(3)
+                replayed += [entity['id'] for record in records for entity in record['entities']]
+                spool.commit(position)
+
+            self.assertEqual(replayed, [entity['id'] for entity in entities(0, 20)])
+            self.assertEqual(spool.size(), 0)
+
+    def test_evict_while_replaying(self):
+        with TemporaryDirectory() as folder:
+            spool = Spool(folder, max_size=2048, segment_size=512)
+            for item in range(4):
+                spool.append(entities(item * 2, 2), 'APPEND')
+
+            records, position = spool.read(2)
+            self.assertGreater(len(records), 0)
+
+            # new batches evict the segment being replayed
+            for item in range(4, 16):
+                spool.append(entities(item * 2, 2), 'APPEND')
+            self.assertNotIn(position[0], spool.segments)
+
+            spool.commit(position)
+            self.assertIn(spool.read_position[0], spool.segments)
+
+            while spool.pending():
+                records, position = spool.read(4)
+                self.assertGreater(len(records), 0)
+                spool.commit(position)
+
+
+class TestReplay(unittest.TestCase):
+    def test_evict_while_replaying(self):
+        with TemporaryDirectory() as folder:
+            spool = Spool(folder, max_size=2048, segment_size=512)
+            for item in range(4):
+                spool.append(entities(item * 2, 2), 'APPEND')
+
+            client = OrionClient('http://localhost:1026', spool=spool, limit_entities=2, limit_targets=1)
+            appended = [4]
+
+            # Orion accepts the batches, meanwhile a new cycle appends to the spool (evicting)
+            async def post_entities(batch, action, spool=True):
+                if appended[0] < 16:
+                    for item in range(appended[0], appended[0] + 4):
+                        client.spool.append(entities(item * 2, 2), 'APPEND')
+                    appended[0] += 4
+                return [BatchResult(batch, 204)]
+
+            async def replay():
+                client.replay_lock = Lock()
+                client.post_entities = post_entities
+                return await wait_for(client.replay(), 5)
+
+            results = run(replay())
+
+            self.assertGreater(len(results), 0)
+            self.assertFalse(spool.pending())
+
+    def test_replay_forever_survives_errors(self):
+        with TemporaryDirectory() as folder:
+            spool = Spool(folder)
+            spool.append(entities(0, 2), 'APPEND')
+
+            client = OrionClient('http://localhost:1026', spool=spool, replay_interval=0.01)
+            calls = [0]
+
+            async def replay():
+                calls[0] += 1
+                if calls[0] == 1:
+                    raise TypeError('unexpected')
+                return list()
+
+            async def replay_forever():
+                client.replay = replay
+                task = ensure_future(client.replay_forever())
+                await sleep(0.2)
+                task.cancel()
+                with self.assertRaises(CancelledError):
+                    await task
+
+            run(replay_forever())
+
+            self.assertGreater(calls[0], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
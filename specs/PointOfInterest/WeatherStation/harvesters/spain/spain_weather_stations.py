@@ -33,19 +33,20 @@
     async def name_one - worker process
 """
 
-from aiohttp import ClientSession, ClientConnectorError
-from asyncio import Semaphore, ensure_future, gather, run, TimeoutError as ToE, set_event_loop_policy
+from asyncio import ensure_future, gather, run, set_event_loop_policy
 from argparse import ArgumentTypeError, ArgumentParser
 from copy import deepcopy
 from csv import DictWriter
 from datetime import datetime
 from io import BytesIO
+from orion_client import OrionClient, report
 from re import sub
 from requests import get, exceptions
+from spool import Spool
 from sys import stdout
 from uvloop import EventLoopPolicy
 from xlrd import open_workbook
-from yajl import loads, dumps
+from yajl import loads
 from yaml import safe_load as load, dump
 from zipfile import ZipFile
 import logging
@@ -54,6 +55,7 @@ default_limit_entities = 50           # amount of entities per 1 request to Orio
 default_limit_targets = 50            # amount of parallel request to Orion
 default_log_level = 'INFO'
 default_orion = 'http://orion:1026'
+default_spool_size = 256              # MB of the spool of batches not posted to Orion
 
 http_ok = [200, 201, 204]
 
@@ -229,82 +231,19 @@ def log_level_to_int(log_level_string):
 async def post(body):
     logger.debug('Posting data to Orion started')
 
-    tasks = list()
+    async with OrionClient(orion, service, path, limit_entities, limit_targets,
+                           adaptive=not fixed_limits,
+                           dead_letter=dead_letter,
+                           spool=spool) as client:
+        response = await client.post(body)
 
-    headers = {
-        'Content-Type': 'application/json'
-    }
-    if service:
-        headers['FIWARE-SERVICE'] = service
-
-    if path:
-        headers['FIWARE-SERVICEPATH'] = path
-
-    sem = Semaphore(limit_targets)
-
-    # splitting list to list of lists to fit into limits
-    block = 0
-    items = 0
-    body_divided = dict()
-    body_divided[0] = list()
-    while True:
-        if len(body) > 0:
-            if items < limit_entities:
-                body_divided[block].append(body.pop())
-                items += 1
-            else:
-                items = 0
-                block += 1
-                body_divided[block] = list()
-        else:
-            break
-
-    async with ClientSession() as session:
-        for item in body_divided:
-            task = ensure_future(post_bounded(body_divided[item], headers, sem, session))
-            tasks.append(task)
-
-        response = await gather(*tasks)
-
-    response = list(set(response))
-    if True in response:
-        response.remove(True)
-
-    for item in response:
-        logger.error('Posting data to Orion failed due to the %s', item)
+    report(response)
+    client.log_metrics()
 
     logger.debug('Posting data to Orion ended')
     return True
 
 
-async def post_bounded(el, headers, sem, session):
-    async with sem:
-        return await post_one(el, headers, session)
-
-
-async def post_one(el, headers, session):
-    payload = {
-        'actionType': 'APPEND',
-        'entities': el
-    }
-
-    payload = dumps(payload)
-
-    url = orion + '/v2/op/update'
-    try:
-        async with session.post(url, headers=headers, data=payload) as response:
-            status = response.status
-    except ClientConnectorError:
-        return 'connection problem'
-    except ToE:
-        return 'timeout problem'
-
-    if status not in http_ok:
-        return 'response code ' + str(status)
-
-    return True
-
-
 async def prepare_data(aemet_data, ine_data):
     logger.debug('Data preparation started')
 
@@ -454,6 +393,9 @@ def reply_status(stations):
     logger.info('Stations: %s', str(len(stations['stations'])))
     logger.info('limit_entities: %s', str(limit_entities))
     logger.info('limit_targets: %s', str(limit_targets))
+    logger.info('Fixed limits: %s', str(fixed_limits))
+    logger.info('Dead letter file: %s', dead_letter)
+    logger.info('Spool: %s', args.spool)
     logger.info('Log level: %s', args.log_level)
 
 
@@ -503,7 +445,15 @@ if __name__ == '__main__':
     parser.add_argument('--limit-targets',
                         default=default_limit_targets,
                         dest='limit_targets',
-                        help='Limit amount of parallel requests to Orion')
+                        help='Limit amount of parallel requests to Orion (adapted at runtime up to it)')
+    parser.add_argument('--dead-letter',
+                        action='store',
+                        dest='dead_letter',
+                        help='File to append the entities rejected by Orion to')
+    parser.add_argument('--fixed-limits',
+                        action='store_true',
+                        dest='fixed_limits',
+                        help='Do not adapt the limits of requests to Orion to its latency and errors')
     parser.add_argument('--log-level',
                         default=default_log_level,
                         dest='log_level',
@@ -522,11 +472,22 @@ if __name__ == '__main__':
                         action='store',
                         dest="service",
                         help='FIWARE Service')
+    parser.add_argument('--spool',
+                        action='store',
+                        dest='spool',
+                        help='Folder to keep the entities that could not be posted to Orion, until it is available')
+    parser.add_argument('--spool-size',
+                        default=default_spool_size,
+                        dest='spool_size',
+                        help='Limit size of the spool in MB, the oldest entities are dropped above it')
 
     args = parser.parse_args()
 
     limit_entities = int(args.limit_entities)
     limit_targets = int(args.limit_targets)
+    dead_letter = args.dead_letter
+    fixed_limits = args.fixed_limits
+    spool = Spool(args.spool, int(args.spool_size) * 1024 * 1024) if args.spool else None
     orion = args.orion
 
     if 'path' in args:
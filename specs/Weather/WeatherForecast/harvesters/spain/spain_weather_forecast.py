@@ -22,36 +22,56 @@
     async def name_bounded - intermediate step to limit amount of parallel workers
     async def name_one - worker process
 
-    Warning! AEMET open data portal has a requests limit. So you can't make more then 149 requests from one try.
-    This limit will be removed in the next version.
+    AEMET open data portal has a quota of requests per key: the requests are paced (--rate) and paused when the
+    quota is about to be exhausted (see aemet_client.py).
+
+    Working as a service, the municipalities can be split in shards, one harvested per cycle, so that all of them
+    are harvested within --window seconds at a steady rate (see rotation.py). The config file may give tiers of
+    municipalities harvested more often, within their own window in seconds:
+        tiers:
+          3600:
+          - 28079
+          - 08019
 """
 
-from aiohttp import ClientSession, ClientConnectorError
+from aemet_client import AEMETClient, AEMETError
 from argparse import ArgumentTypeError, ArgumentParser
-from asyncio import Semaphore, ensure_future, gather, run, TimeoutError as ToE, set_event_loop_policy
+from asyncio import Semaphore, ensure_future, gather, run, set_event_loop_policy
+from cadence import run_periodically
 from copy import deepcopy
 from datetime import datetime, timedelta
+from http_cache import HTTPCache
+from orion_client import OrionClient, delivered, report
 from pytz import timezone
 from re import sub
-from requests import get, exceptions
+from rotation import Rotation, shards_for
+from spool import Spool
 from sys import stdout
-from time import sleep
 from uvloop import EventLoopPolicy
-from yajl import dumps, loads
+from yajl import loads
 from yaml import safe_load as load
 import logging
 
+default_deadline = -1                  # seconds a cycle may last (service), if -1 just under timeout
 default_latest = False                 # preserve only latest values
 default_limit_entities = 50            # amount of entities per 1 request to Orion
 default_limit_source = 10              # amount of parallel request to AEMET
 default_limit_target = 50              # amount of parallel request to Orion
 default_log_level = 'INFO'
 default_orion = 'http://orion:1026'    # Orion Contest Broker endpoint
+default_rate = 0.8                     # requests per second to AEMET
+default_spool_size = 256               # MB of the spool of batches not posted to Orion
 default_station_file = 'stations.yml'  # source file with list of municipalities
 default_timeout = -1                   # if value != -1, then work as a service
+default_window = -1                    # seconds to harvest all the municipalities in (service), if -1 every cycle
 
 http_ok = [200, 201, 204]
 
+aemet = None                           # AEMET client, open while the harvester runs
+cache = None                           # cache of the responses of the source
+client = None                          # Orion client, open while the harvester runs
+rotation = None                        # municipalities harvested in the current cycle
+
 log_levels = ['ERROR', 'INFO', 'DEBUG']
 logger = None
 logger_req = None
@@ -148,61 +168,48 @@ template = {
 }
 
 
-async def collect(key):
+async def collect():
     logger.debug('Collecting data from AEMET started')
 
     tasks = list()
 
     sem = Semaphore(limit_source)
 
-    async with ClientSession() as session:
-        for station in stations:
-            task = ensure_future(collect_bounded(station, sem, session, key))
-            tasks.append(task)
+    current = rotation.current()
+    for station in current:
+        task = ensure_future(collect_bounded(station, sem))
+        tasks.append(task)
+
+    result = await gather(*tasks)
 
-        result = await gather(*tasks)
+    # municipalities that could not be fetched
+    failed = [station for station, item in zip(current, result) if item is None]
 
-    while False in result:
-        result.remove(False)
+    result = [item for item in result if item]
 
     logger.debug("Collection data from AEMET ended")
-    return result
+    return result, failed
 
 
-async def collect_bounded(station, sem, session, key):
+async def collect_bounded(station, sem):
     async with sem:
-        return await collect_one(station, session, key)
-
+        return await collect_one(station)
 
-async def collect_one(station, session, key):
 
-    try:
-        async with session.get(stations[station]['url'], headers={'api_key': key}, ssl=False) as response:
-            result = await response.read()
-            status = response.status
-    except ClientConnectorError:
-        logger.error('Collecting link from AEMET station %s failed due to the connection problem', station)
-        return False
-    except ToE:
-        logger.error('Collecting link from AEMET station %s failed due to the timeout problem', station)
-        return False
+async def collect_one(station):
+    url = stations[station]['url']
 
-    if status not in http_ok:
-        logger.error('Collecting link from AEMET station %s failed due to the return code %s', station, str(status))
+    if cache.fresh(url, latest):
         return False
 
-    logger.debug('Remaining requests %s', response.headers.get('Remaining-request-count'))
-    result = loads(result.decode('UTF-8'))
-
     try:
-        content = get(result['datos'])
-    except exceptions.ConnectionError:
-        logger.error('Collecting data from AEMET station %s failed due to the connection problem', station)
-        return False
+        content = await aemet.get(url)
+    except AEMETError as e:
+        logger.error('Collecting data from AEMET station %s failed due to the %s', station, e)
+        return None
 
-    if content.status_code not in http_ok:
-        logger.error('Collecting data from AEMET station %s failed due to the return code %s', station,
-                     str(response.status))
+    # the link to the data is different on every request, the content tells whether it changed
+    if not cache.modified(url, latest, content.headers, content.content):
         return False
 
     content = loads(content.text)
@@ -365,82 +372,61 @@ def log_level_to_int(log_level_string):
     return getattr(logging, log_level_string, logging.ERROR)
 
 
-async def post(body):
-    logger.debug('Posting data to Orion started')
-
-    tasks = list()
+async def harvest():
+    logger.debug('Harvesting cycle started')
 
-    headers = {
-        'Content-Type': 'application/json'
-    }
-    if service:
-        headers['FIWARE-SERVICE'] = service
-
-    if path:
-        headers['FIWARE-SERVICEPATH'] = path
-
-    sem = Semaphore(limit_target)
-
-    # splitting list to list of lists to fit into limits
-    block = 0
-    items = 0
-    body_divided = dict()
-    body_divided[0] = list()
-    while True:
-        if len(body) > 0:
-            if items < limit_entities:
-                body_divided[block].append(body.pop())
-                items += 1
-            else:
-                items = 0
-                block += 1
-                body_divided[block] = list()
-        else:
-            break
+    rotation.log_status()
 
-    async with ClientSession() as session:
-        for item in body_divided:
-            task = ensure_future(post_bounded(body_divided[item], headers, sem, session))
-            tasks.append(task)
+    res, failed = await collect()
+    aemet.log_metrics()
+    posted = True
+    if res:
+        changed = [item['station'] for item in res]
+        res = await prepare_schema(res)
+        posted = await post(res)
+        if not posted:
+            failed += changed
 
-        response = await gather(*tasks)
+    # the forecasts are only marked as processed once they reached Orion
+    cache.commit(posted)
+    cache.log_metrics()
 
-    response = list(set(response))
-    if True in response:
-        response.remove(True)
+    # the municipalities not fetched or not posted are harvested again in the next cycle, also after a restart
+    rotation.advance(failed)
 
-    for item in response:
-        logger.error('Posting data to Orion failed due to the %s', item)
+    logger.debug('Harvesting cycle ended')
 
-    logger.debug('Posting data to Orion ended')
 
+# Runs once or, as a service, every timeout seconds, keeping the event loop and the HTTP sessions.
+# connector, budget: connection pool and limit of requests to Orion shared with other harvesters (supervisor)
+# offset: seconds before the first cycle
+async def main(connector=None, budget=None, offset=0.0):
+    global client, aemet
 
-async def post_bounded(item, headers, sem, session):
-    async with sem:
-        return await post_one(item, headers, session)
+    async with OrionClient(orion, service, path, limit_entities, limit_target,
+                           adaptive=not fixed_limits,
+                           dead_letter=dead_letter,
+                           spool=spool,
+                           connector=connector,
+                           budget=budget) as client, \
+            AEMETClient(args.key, limit_source, rate=float(args.rate)) as aemet:
+        if timeout == -1:
+            await harvest()
+        else:
+            await run_periodically(harvest, timeout, deadline, 'Harvesting cycle', offset)
 
 
-async def post_one(item, headers, session):
-    payload = {
-        'actionType': 'APPEND',
-        'entities': item
-    }
+async def post(body):
+    logger.debug('Posting data to Orion started')
 
-    payload = dumps(payload)
+    response = await client.post(body)
 
-    url = orion + '/v2/op/update'
-    try:
-        async with session.post(url, headers=headers, data=payload) as response:
-            status = response.status
-    except ClientConnectorError:
-        return 'connection problem'
-    except ToE:
-        return 'timeout problem'
+    report(response)
+    client.log_metrics()
 
-    if status not in http_ok:
-        return 'response code ' + str(status)
+    logger.debug('Posting data to Orion ended')
 
-    return True
+    return delivered(response)
 
 
 async def prepare_schema(source):
@@ -593,15 +579,58 @@ def reply_status():
     logger.info('FIWARE Service: %s', service)
     logger.info('FIWARE Service-Path: %s', path)
     logger.info('Timeout: %s', str(timeout))
+    logger.info('Deadline: %s', str(deadline))
     logger.info('Stations: %s', str(len(stations)))
     logger.info('Latest: %s', str(latest))
     logger.info('limit_entities: %s', str(limit_entities))
     logger.info('Limit_source: %s', str(limit_source))
     logger.info('limit_target: %s', str(limit_target))
+    logger.info('Fixed limits: %s', str(fixed_limits))
+    logger.info('Dead letter file: %s', dead_letter)
+    logger.info('Spool: %s', args.spool)
+    logger.info('Cache: %s', args.cache)
+    logger.info('Rate: %s', args.rate)
+    logger.info('Window: %s', str(window))
+    logger.info('Progress file: %s', args.progress)
     logger.info('Log level: %s', args.log_level)
     logger.info('Started')
 
 
+# Configures the harvester from the arguments (see setup_parser)
+def setup(arguments):
+    global args, cache, latest, limit_entities, limit_source, limit_target, dead_letter, fixed_limits, spool, orion, \
+        timeout, deadline, path, service, logger, logger_req, stations, window, rotation
+
+    args = arguments
+
+    cache = HTTPCache(args.cache)
+    latest = args.latest
+    limit_entities = int(args.limit_entities)
+    limit_source = int(args.limit_source)
+    limit_target = int(args.limit_target)
+    dead_letter = args.dead_letter
+    fixed_limits = args.fixed_limits
+    spool = Spool(args.spool, int(args.spool_size) * 1024 * 1024) if args.spool else None
+    orion = args.orion
+    timeout = int(args.timeout)
+    deadline = int(args.deadline)
+    window = int(args.window)
+
+    if 'path' in args:
+        path = args.path
+    if 'service' in args:
+        service = args.service
+
+    if logger is None:
+        logger, logger_req = setup_logger()
+
+    res = setup_stations_config(args.config)
+    stations = setup_stations(res, args.station_file)
+    rotation = setup_rotation(res.get('tiers', dict()))
+
+    reply_status()
+
+
 def setup_logger():
     local_logger = logging.getLogger('root')
     local_logger.setLevel(log_level_to_int(args.log_level))
@@ -618,6 +647,128 @@ def setup_logger():
     return local_logger, local_logger_req
 
 
+def setup_parser():
+    parser = ArgumentParser()
+    parser.add_argument('--cache',
+                        action='store',
+                        dest='cache',
+                        help='Folder to keep the validators of the responses of the source, so that the payloads that '
+                             'did not change are not processed again after a restart')
+    parser.add_argument('--config',
+                        dest='config',
+                        help='YAML file with list of municipalities to be collected or excluded from collecting')
+    parser.add_argument('--deadline',
+                        action='store',
+                        default=default_deadline,
+                        dest='deadline',
+                        help='Cancel a harvesting cycle still running after these seconds (service), '
+                             'default: just under timeout')
+    parser.add_argument('--key',
+                        action='store',
+                        dest='key',
+                        help='API Key to access to AEMET Open Data Portal',
+                        required=True)
+    parser.add_argument('--latest',
+                        action='store_true',
+                        default=default_latest,
+                        dest='latest',
+                        help='Collect only latest forecast')
+    parser.add_argument('--limit-entities',
+                        default=default_limit_entities,
+                        dest='limit_entities',
+                        help='Limit amount of entities per 1 request to Orion (adapted at runtime up to it)')
+    parser.add_argument('--limit-source',
+                        default=default_limit_source,
+                        dest='limit_source',
+                        help='Limit amount of parallel requests to AEMET')
+    parser.add_argument('--limit-target',
+                        default=default_limit_target,
+                        dest='limit_target',
+                        help='Limit amount of parallel requests to Orion (adapted at runtime up to it)')
+    parser.add_argument('--dead-letter',
+                        action='store',
+                        dest='dead_letter',
+                        help='File to append the entities rejected by Orion to')
+    parser.add_argument('--fixed-limits',
+                        action='store_true',
+                        dest='fixed_limits',
+                        help='Do not adapt the limits of requests to Orion to its latency and errors')
+    parser.add_argument('--log-level',
+                        default=default_log_level,
+                        dest='log_level',
+                        help='Set the logging output level. {0}'.format(log_levels),
+                        nargs='?')
+    parser.add_argument('--orion',
+                        action='store',
+                        default=default_orion,
+                        dest='orion',
+                        help='Orion Context Broker endpoint')
+    parser.add_argument('--path',
+                        action='store',
+                        dest='path',
+                        help='FIWARE Service Path')
+    parser.add_argument('--progress',
+                        action='store',
+                        dest='progress',
+                        help='File to keep the position of the rotation of the municipalities, resumed after a restart')
+    parser.add_argument('--rate',
+                        default=default_rate,
+                        dest='rate',
+                        help='Requests per second to AEMET, paused when its quota is about to be exhausted')
+    parser.add_argument('--service',
+                        action='store',
+                        dest="service",
+                        help='FIWARE Service')
+    parser.add_argument('--spool',
+                        action='store',
+                        dest='spool',
+                        help='Folder to keep the entities that could not be posted to Orion, until it is available')
+    parser.add_argument('--spool-size',
+                        default=default_spool_size,
+                        dest='spool_size',
+                        help='Limit size of the spool in MB, the oldest entities are dropped above it')
+    parser.add_argument('--stations',
+                        action='store',
+                        default=default_station_file,
+                        dest="station_file",
+                        help='Station file')
+    parser.add_argument('--timeout',
+                        action='store',
+                        default=default_timeout,
+                        dest='timeout',
+                        help='Run as a service')
+    parser.add_argument('--window',
+                        action='store',
+                        default=default_window,
+                        dest='window',
+                        help='Harvest all the municipalities within these seconds, one shard per cycle (service)')
+
+    return parser
+
+
+# Splits the municipalities in the tiers of the config, then the rest, each one rotating within its window
+def setup_rotation(tiers):
+    result = Rotation(args.progress)
+
+    if timeout == -1 or window <= 0:
+        result.add('municipalities', list(stations), 1)
+        return result
+
+    rest = set(stations)
+
+    for tier in sorted(tiers):
+        items = [item for item in tiers[tier] if item in rest]
+        if len(items) != len(tiers[tier]):
+            logger.error('Municipalities of the tier %s not harvested or in other tier: %s', tier,
+                         ', '.join(item for item in tiers[tier] if item not in items))
+        rest -= set(items)
+        result.add('{} seconds'.format(tier), items, shards_for(tier, timeout))
+
+    result.add('municipalities', list(rest), shards_for(window, timeout))
+
+    return result
+
+
 def setup_stations(stations_limit, station_file):
     result = dict()
     source = None
@@ -686,7 +837,12 @@ def setup_stations_config(f):
                 for item in source['include']:
                     local_stations['include'].append(item)
 
-        except TypeError:
+            if 'tiers' in source:
+                local_stations['tiers'] = dict()
+                for item in source['tiers']:
+                    local_stations['tiers'][int(item)] = list(source['tiers'][item])
+
+        except (TypeError, ValueError):
             logging.error('Config file is empty or wrong')
             exit(1)
         except FileNotFoundError:
@@ -702,94 +858,11 @@ def setup_config_re(station):
 
 
 if __name__ == '__main__':
-    parser = ArgumentParser()
-    parser.add_argument('--config',
-                        dest='config',
-                        help='YAML file with list of municipalities to be collected or excluded from collecting')
-    parser.add_argument('--key',
-                        action='store',
-                        dest='key',
-                        help='API Key to access to AEMET Open Data Portal',
-                        required=True)
-    parser.add_argument('--latest',
-                        action='store_true',
-                        default=default_latest,
-                        dest='latest',
-                        help='Collect only latest forecast')
-    parser.add_argument('--limit-entities',
-                        default=default_limit_entities,
-                        dest='limit_entities',
-                        help='Limit amount of entities per 1 request to Orion')
-    parser.add_argument('--limit-source',
-                        default=default_limit_source,
-                        dest='limit_source',
-                        help='Limit amount of parallel requests to AEMET')
-    parser.add_argument('--limit-target',
-                        default=default_limit_target,
-                        dest='limit_target',
-                        help='Limit amount of parallel requests to Orion')
-    parser.add_argument('--log-level',
-                        default=default_log_level,
-                        dest='log_level',
-                        help='Set the logging output level. {0}'.format(log_levels),
-                        nargs='?')
-    parser.add_argument('--orion',
-                        action='store',
-                        default=default_orion,
-                        dest='orion',
-                        help='Orion Context Broker endpoint')
-    parser.add_argument('--path',
-                        action='store',
-                        dest='path',
-                        help='FIWARE Service Path')
-    parser.add_argument('--service',
-                        action='store',
-                        dest="service",
-                        help='FIWARE Service')
-    parser.add_argument('--stations',
-                        action='store',
-                        default=default_station_file,
-                        dest="station_file",
-                        help='Station file')
-    parser.add_argument('--timeout',
-                        action='store',
-                        default=default_timeout,
-                        dest='timeout',
-                        help='Run as a service')
-
-    args = parser.parse_args()
-
-    latest = args.latest
-    limit_entities = int(args.limit_entities)
-    limit_source = int(args.limit_source)
-    limit_target = int(args.limit_target)
-    orion = args.orion
-    timeout = int(args.timeout)
-
-    if 'path' in args:
-        path = args.path
-    if 'service' in args:
-        service = args.service
-
-    logger, logger_req = setup_logger()
+    setup(setup_parser().parse_args())
 
     set_event_loop_policy(EventLoopPolicy())
 
-    res = setup_stations_config(args.config)
-    stations = setup_stations(res, args.station_file)
-
-    reply_status()
-
-    while True:
-        res = run(collect(args.key))
-        if res:
-            res = run(prepare_schema(res))
-            run(post(res))
-        if timeout == -1:
-            break
-        else:
-            logger.debug('Sleeping for the %s seconds', timeout)
-            sleep(timeout)
+    run(main())
 
     logger.info('Ended')
     exit(0)
@@ -22,33 +22,42 @@
     async def name_bounded - intermediate step to limit amount of parallel workers
     async def name_one - worker process
 
-    Warning! AEMET open data portal has a requests limit. So you can't make more then 149 requests from one try.
-    This limit will be removed in the next version.
+    AEMET open data portal has a quota of requests per key: the requests are paced (--rate) and paused when the
+    quota is about to be exhausted (see aemet_client.py).
 """
 
-from aiohttp import ClientSession, ClientConnectorError
+from aemet_client import AEMETClient, AEMETError
 from argparse import ArgumentTypeError, ArgumentParser
-from asyncio import Semaphore, ensure_future, gather, run, TimeoutError as ToE, set_event_loop_policy
+from asyncio import ensure_future, gather, run, set_event_loop_policy
+from cadence import run_periodically
 from copy import deepcopy
+from http_cache import HTTPCache
+from orion_client import OrionClient, delivered, report
 from re import sub
-from requests import get, exceptions
+from spool import Spool
 from sys import stdout
-from time import sleep
 from uvloop import EventLoopPolicy
-from yajl import dumps, loads
+from yajl import loads
 from yaml import safe_load as load
 import logging
 
+default_deadline = -1                  # seconds a cycle may last (service), if -1 just under timeout
 default_latest = False                 # preserve only latest values
 default_limit_entities = 50            # amount of entities per 1 request to Orion
 default_limit_targets = 50             # amount of parallel request to Orion
 default_log_level = 'INFO'
 default_orion = 'http://orion:1026'    # Orion Contest Broker endpoint
+default_rate = 0.8                     # requests per second to AEMET
+default_spool_size = 256               # MB of the spool of batches not posted to Orion
 default_station_file = 'stations.yml'  # source file with list of municipalities
 default_timeout = -1                   # if value != -1, then work as a service
 
 http_ok = [200, 201, 204]
 
+aemet = None                           # AEMET client, open while the harvester runs
+cache = None                           # cache of the responses of the source
+client = None                          # Orion client, open while the harvester runs
+
 log_levels = ['ERROR', 'INFO', 'DEBUG']
 logger = None
 logger_req = None
@@ -120,30 +129,25 @@ template = {
 }
 
 
-def collect(key):
+async def collect():
     logger.debug('Collecting data from AEMET started')
 
-    try:
-        result = get(url_aemet, headers={'api_key': key})
-    except exceptions.ConnectionError:
-        logger.error('Collecting link from AEMET failed due to the connection problem')
-        return False
+    # the observations are processed again if the stations harvested change
+    scope = [latest, sorted(stations)]
 
-    if result.status_code not in http_ok:
-        logger.error('Collecting link from AEMET failed due to the return code %s', result.status_code)
+    if cache.fresh(url_aemet, scope):
+        logger.debug('Collecting data from AEMET skipped, the observations are fresh')
         return False
 
-    logger.debug('Remaining requests %s', result.headers.get('Remaining-request-count'))
-    result = loads(result.text)
-
     try:
-        result = get(result['datos'])
-    except exceptions.ConnectionError:
-        logger.error('Collecting data from AEMET failed due to the connection problem')
+        result = await aemet.get(url_aemet)
+    except AEMETError as e:
+        logger.error('Collecting data from AEMET failed due to the %s', e)
         return False
 
-    if result.status_code not in http_ok:
-        logger.error('Collecting data from AEMET failed due to the return code %s', result.status_code)
+    # the link to the data is different on every request, the content tells whether it changed
+    if not cache.modified(url_aemet, scope, result.headers, result.content):
+        logger.debug('Collecting data from AEMET skipped, the observations did not change')
         return False
 
     result = loads(result.text)
@@ -174,83 +178,53 @@ def log_level_to_int(log_level_string):
     return getattr(logging, log_level_string, logging.ERROR)
 
 
-async def post(body):
-    logger.debug('Posting data to Orion started')
+async def harvest():
+    logger.debug('Harvesting cycle started')
 
-    tasks = list()
+    res = await collect()
+    aemet.log_metrics()
+    posted = False
+    if res:
+        res = await prepare_schema(res)
+        posted = await post(res)
 
-    headers = {
-        'Content-Type': 'application/json'
-    }
-    if service:
-        headers['FIWARE-SERVICE'] = service
-
-    if path:
-        headers['FIWARE-SERVICEPATH'] = path
-
-    sem = Semaphore(limit_targets)
-
-    # splitting list to list of lists to fit into limits
-    block = 0
-    items = 0
-    body_divided = dict()
-    body_divided[0] = list()
-    while True:
-        if len(body) > 0:
-            if items < limit_entities:
-                body_divided[block].append(body.pop())
-                items += 1
-            else:
-                items = 0
-                block += 1
-                body_divided[block] = list()
-        else:
-            break
+    # the observations are only marked as processed once they reached Orion
+    cache.commit(posted)
+    cache.log_metrics()
 
-    async with ClientSession() as session:
-        for item in body_divided:
-            task = ensure_future(post_bounded(body_divided[item], headers, sem, session))
-            tasks.append(task)
-
-        response = await gather(*tasks)
-
-    response = list(set(response))
-    if True in response:
-        response.remove(True)
+    logger.debug('Harvesting cycle ended')
 
-    for item in response:
-        logger.error('Posting data to Orion failed due to the %s', item)
-
-    logger.debug('Posting data to Orion ended')
-    return True
 
+# Runs once or, as a service, every timeout seconds, keeping the event loop and the HTTP sessions.
+# connector, budget: connection pool and limit of requests to Orion shared with other harvesters (supervisor)
+# offset: seconds before the first cycle
+async def main(connector=None, budget=None, offset=0.0):
+    global client, aemet
 
-async def post_bounded(item, headers, sem, session):
-    async with sem:
-        return await post_one(item, headers, session)
+    async with OrionClient(orion, service, path, limit_entities, limit_targets,
+                           adaptive=not fixed_limits,
+                           dead_letter=dead_letter,
+                           spool=spool,
+                           connector=connector,
+                           budget=budget) as client, \
+            AEMETClient(args.key, rate=float(args.rate)) as aemet:
+        if timeout == -1:
+            await harvest()
+        else:
+            await run_periodically(harvest, timeout, deadline, 'Harvesting cycle', offset)
 
 
-async def post_one(item, headers, session):
-    payload = {
-        'actionType': 'APPEND',
-        'entities': item
-    }
+async def post(body):
+    logger.debug('Posting data to Orion started')
 
-    payload = dumps(payload)
+    response = await client.post(body)
 
-    url = orion + '/v2/op/update'
-    try:
-        async with session.post(url, headers=headers, data=payload) as response:
-            status = response.status
-    except ClientConnectorError:
-        return 'connection problem'
-    except ToE:
-        return 'timeout problem'
+    report(response)
+    client.log_metrics()
 
-    if status not in http_ok:
-        return 'response code ' + str(status)
+    logger.debug('Posting data to Orion ended')
 
-    return True
+    return delivered(response)
 
 
 async def prepare_schema(source):
@@ -335,8 +309,46 @@ def reply_status():
     logger.info('Latest: %s', str(latest))
     logger.info('limit_entities: %s', str(limit_entities))
     logger.info('limit_targets: %s', str(limit_targets))
+    logger.info('Fixed limits: %s', str(fixed_limits))
+    logger.info('Dead letter file: %s', dead_letter)
+    logger.info('Spool: %s', args.spool)
+    logger.info('Cache: %s', args.cache)
+    logger.info('Rate: %s', args.rate)
     logger.info('Log level: %s', args.log_level)
     logger.info('Timeout: %s', str(timeout))
+    logger.info('Deadline: %s', str(deadline))
+
+
+# Configures the harvester from the arguments (see setup_parser)
+def setup(arguments):
+    global args, cache, latest, limit_entities, limit_targets, dead_letter, fixed_limits, spool, orion, timeout, \
+        deadline, path, service, logger, logger_req, stations
+
+    args = arguments
+
+    cache = HTTPCache(args.cache)
+    latest = args.latest
+    limit_entities = int(args.limit_entities)
+    limit_targets = int(args.limit_targets)
+    dead_letter = args.dead_letter
+    fixed_limits = args.fixed_limits
+    spool = Spool(args.spool, int(args.spool_size) * 1024 * 1024) if args.spool else None
+    orion = args.orion
+    timeout = int(args.timeout)
+    deadline = int(args.deadline)
+
+    if 'path' in args:
+        path = args.path
+    if 'service' in args:
+        service = args.service
+
+    if logger is None:
+        logger, logger_req = setup_logger()
+
+    res = setup_stations_config(args.config)
+    stations = setup_stations(res, args.station_file)
+
+    reply_status()
 
 
 def setup_logger():
@@ -355,6 +367,92 @@ def setup_logger():
     return local_logger, local_logger_req
 
 
+def setup_parser():
+    parser = ArgumentParser()
+    parser.add_argument('--cache',
+                        action='store',
+                        dest='cache',
+                        help='Folder to keep the validators of the responses of the source, so that the payloads that '
+                             'did not change are not processed again after a restart')
+    parser.add_argument('--config',
+                        dest='config',
+                        help='YAML file with list of stations to be collected or excluded from collecting')
+    parser.add_argument('--deadline',
+                        action='store',
+                        default=default_deadline,
+                        dest='deadline',
+                        help='Cancel a harvesting cycle still running after these seconds (service), '
+                             'default: just under timeout')
+    parser.add_argument('--key',
+                        action='store',
+                        dest='key',
+                        help='API Key to access to AEMET Open Data Portal',
+                        required=True)
+    parser.add_argument('--latest',
+                        action='store_true',
+                        default=default_latest,
+                        dest='latest',
+                        help='Collect only latest observation')
+    parser.add_argument('--limit-entities',
+                        default=default_limit_entities,
+                        dest='limit_entities',
+                        help='Limit amount of entities per 1 request to Orion (adapted at runtime up to it)')
+    parser.add_argument('--limit-targets',
+                        default=default_limit_targets,
+                        dest='limit_targets',
+                        help='Limit amount of parallel requests to Orion (adapted at runtime up to it)')
+    parser.add_argument('--dead-letter',
+                        action='store',
+                        dest='dead_letter',
+                        help='File to append the entities rejected by Orion to')
+    parser.add_argument('--fixed-limits',
+                        action='store_true',
+                        dest='fixed_limits',
+                        help='Do not adapt the limits of requests to Orion to its latency and errors')
+    parser.add_argument('--log-level',
+                        default=default_log_level,
+                        dest='log_level',
+                        help='Set the logging output level. {0}'.format(log_levels),
+                        nargs='?')
+    parser.add_argument('--orion',
+                        action='store',
+                        default=default_orion,
+                        dest='orion',
+                        help='Orion Context Broker endpoint')
+    parser.add_argument('--path',
+                        action='store',
+                        dest='path',
+                        help='FIWARE Service Path')
+    parser.add_argument('--rate',
+                        default=default_rate,
+                        dest='rate',
+                        help='Requests per second to AEMET, paused when its quota is about to be exhausted')
+    parser.add_argument('--service',
+                        action='store',
+                        dest="service",
+                        help='FIWARE Service')
+    parser.add_argument('--spool',
+                        action='store',
+                        dest='spool',
+                        help='Folder to keep the entities that could not be posted to Orion, until it is available')
+    parser.add_argument('--spool-size',
+                        default=default_spool_size,
+                        dest='spool_size',
+                        help='Limit size of the spool in MB, the oldest entities are dropped above it')
+    parser.add_argument('--stations',
+                        action='store',
+                        default=default_station_file,
+                        dest="station_file",
+                        help='Station file')
+    parser.add_argument('--timeout',
+                        action='store',
+                        default=default_timeout,
+                        dest='timeout',
+                        help='Run as a service')
+
+    return parser
+
+
 def setup_stations(stations_limit, station_file):
     result = dict()
     source = None
@@ -441,90 +539,11 @@ def setup_config_re(station):
 
 
 if __name__ == '__main__':
-
-    parser = ArgumentParser()
-    parser.add_argument('--config',
-                        dest='config',
-                        help='YAML file with list of stations to be collected or excluded from collecting')
-    parser.add_argument('--key',
-                        action='store',
-                        dest='key',
-                        help='API Key to access to AEMET Open Data Portal',
-                        required=True)
-    parser.add_argument('--latest',
-                        action='store_true',
-                        default=default_latest,
-                        dest='latest',
-                        help='Collect only latest observation')
-    parser.add_argument('--limit-entities',
-                        default=default_limit_entities,
-                        dest='limit_entities',
-                        help='Limit amount of entities per 1 request to Orion')
-    parser.add_argument('--limit-targets',
-                        default=default_limit_targets,
-                        dest='limit_targets',
-                        help='Limit amount of parallel requests to Orion')
-    parser.add_argument('--log-level',
-                        default=default_log_level,
-                        dest='log_level',
-                        help='Set the logging output level. {0}'.format(log_levels),
-                        nargs='?')
-    parser.add_argument('--orion',
-                        action='store',
-                        default=default_orion,
-                        dest='orion',
-                        help='Orion Context Broker endpoint')
-    parser.add_argument('--path',
-                        action='store',
-                        dest='path',
-                        help='FIWARE Service Path')
-    parser.add_argument('--service',
-                        action='store',
-                        dest="service",
-                        help='FIWARE Service')
-    parser.add_argument('--stations',
-                        action='store',
-                        default=default_station_file,
-                        dest="station_file",
-                        help='Station file')
-    parser.add_argument('--timeout',
-                        action='store',
-                        default=default_timeout,
-                        dest='timeout',
-                        help='Run as a service')
-
-    args = parser.parse_args()
-
-    latest = args.latest
-    limit_entities = int(args.limit_entities)
-    limit_targets = int(args.limit_targets)
-    orion = args.orion
-    timeout = int(args.timeout)
-
-    if 'path' in args:
-        path = args.path
-    if 'service' in args:
-        service = args.service
-
-    logger, logger_req = setup_logger()
+    setup(setup_parser().parse_args())
 
     set_event_loop_policy(EventLoopPolicy())
 
-    res = setup_stations_config(args.config)
-    stations = setup_stations(res, args.station_file)
-
-    reply_status()
-
-    while True:
-        res = collect(args.key)
-        if res:
-            res = run(prepare_schema(res))
-            run(post(res))
-        if timeout == -1:
-            break
-        else:
-            logger.debug('Sleeping for the %s seconds', timeout)
-            sleep(timeout)
+    run(main())
 
     logger.info('Ended')
     exit(0)
@@ -0,0 +1,220 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+
+Converts an NGSI-LD Representation into an NGSI v2 Normalized
+Representation (or keyValues). It is the inverse of normalized2LD.
+Identifiers are kept as they are. Optionally (strip_uris) the urn:ngsi-ld:
+prefix that normalized2LD adds to identifiers is removed, which is lossy:
+identifiers that were already such URNs in NGSI v2 (or entities created in
+NGSI-LD) lose it too. Attributes only get the NGSI v2 types the NGSI-LD
+representation tells (Relationship, geo:json, DateTime, PostalAddress)
+
+Copyright (c) 2026 FIWARE Foundation e.V.
+
+"""
+
+import json
+import time
+from argparse import ArgumentParser
+
+from entity_print import write_entity
+from entity_stream import read_batches, write_entities, open_stream, close_stream, \
+    report_throughput
+from normalized2LD import ngsild_uri
+from normalized2keyValues import normalized_2_keyValues
+
+# Entities converted at once in stream mode
+BATCH_SIZE = 1000
+
+# NGSI-LD Entity members and the NGSI v2 attributes they come from
+ld_entity_dates = {
+    'createdAt': 'dateCreated',
+    'modifiedAt': 'dateModified'
+}
+
+# Members of an NGSI-LD attribute which are not sub-attributes
+ld_attribute_members = frozenset([
+    'type', 'value', 'object', 'observedAt', 'unitCode', 'datasetId',
+    'createdAt', 'modifiedAt', 'instanceId'
+])
+
+# Inverse of ld_id / ld_object: a urn:ngsi-ld:<type>: URN gives back the
+# identifier that follows the prefix. Other URIs are kept
+def v2_id(uri, type_part):
+    prefix = ngsild_uri(type_part, '')
+
+    if isinstance(uri, str) and uri.startswith(prefix) and len(uri) > len(prefix):
+        return uri[len(prefix):]
+
+    return uri
+
+
+def v2_object(attribute_name, uri):
+    type_part = ''
+    if attribute_name.startswith('ref'):
+        type_part = attribute_name[3:]
+
+    return v2_id(uri, type_part)
+
+
+# An NGSI-LD Property / Relationship / GeoProperty as an NGSI v2 attribute
+# (type and value)
+def LD_2_attribute(key, ld_attr, strip_uris=False):
+    attr_type = ld_attr.get('type')
+
+    if attr_type == 'Relationship':
+        value = ld_attr.get('object')
+        if strip_uris:
+            if isinstance(value, list):
+                value = [v2_object(key, v) for v in value]
+            else:
+                value = v2_object(key, value)
+        return {'value': value, 'type': 'Relationship'}
+
+    value = ld_attr.get('value')
+
+    if attr_type == 'GeoProperty':
+        return {'value': value, 'type': 'geo:json'}
+
+    if isinstance(value, dict):
+        if value.get('@type') == 'DateTime':
+            return {'value': value.get('@value'), 'type': 'DateTime'}
+        if value.get('type') == 'PostalAddress':
+            return {'value': {k: v for k, v in value.items() if k != 'type'},
+                    'type': 'PostalAddress'}
+
+    return {'value': value}
+
+
+# Do all the transformation work
+def LD_2_normalized(entity, strip_uris=False):
+    out = {}
+
+    for key in entity:
+        if key == '@context':
+            continue
+
+        if key == 'id':
+            out[key] = v2_id(entity[key], entity.get('type', '')) if strip_uris else entity[key]
+            continue
+
+        if key == 'type':
+            out[key] = entity[key]
+            continue
+
+        if key in ld_entity_dates:
+            out[ld_entity_dates[key]] = {
+                'value': entity[key],
+                'type': 'DateTime'
+            }
+            continue
+
+        ld_attr = entity[key]
+
+        # Multi-attributes (several datasetIds) cannot be represented in NGSI v2,
+        # the default instance (or else the first one) is taken
+        if isinstance(ld_attr, list):
+            defaults = [a for a in ld_attr if isinstance(a, dict) and 'datasetId' not in a]
+            ld_attr = defaults[0] if len(defaults) > 0 else ld_attr[0]
+
+        if not isinstance(ld_attr, dict):
+            out[key] = {'value': ld_attr}
+            continue
+
+        attr = LD_2_attribute(key, ld_attr, strip_uris)
+
+        metadata = {}
+        for mkey in ld_attr:
+            if mkey == 'observedAt':
+                metadata['timestamp'] = {
+                    'value': ld_attr[mkey],
+                    'type': 'DateTime'
+                }
+            elif mkey == 'unitCode':
+                metadata['unitCode'] = {
+                    'value': ld_attr[mkey]
+                }
+            elif mkey not in ld_attribute_members and isinstance(ld_attr[mkey], dict):
+                metadata[mkey] = LD_2_attribute(mkey, ld_attr[mkey], strip_uris)
+
+        if len(metadata) > 0:
+            attr['metadata'] = metadata
+
+        out[key] = attr
+
+    return out
+
+
+def LD_2_keyValues(entity, strip_uris=False):
+    return normalized_2_keyValues(LD_2_normalized(entity, strip_uris))
+
+
+def LD_2_normalized_batch(entities, strip_uris=False):
+    return [LD_2_normalized(e, strip_uris) for e in entities]
+
+
+def LD_2_keyValues_batch(entities, strip_uris=False):
+    return [LD_2_keyValues(e, strip_uris) for e in entities]
+
+
+def read_json(infile):
+    with open(infile) as data_file:
+        data = json.loads(data_file.read())
+
+    return data
+
+
+def write_json(data, outfile):
+    with open(outfile, 'w') as data_file:
+        write_entity(data, data_file)
+        data_file.write("\n")
+
+
+# Converts a stream of NGSI-LD entities (NDJSON or JSON array) into
+# normalized (or keyValues) entities written as NDJSON
+def convert_stream(infile, outfile, key_values=False, strip_uris=False, batch_size=BATCH_SIZE):
+    start = time.perf_counter()
+    convert_batch = LD_2_keyValues_batch if key_values else LD_2_normalized_batch
+
+    in_stream = open_stream(infile)
+    out_stream = open_stream(outfile, 'w')
+    count = 0
+
+    try:
+        for batch in read_batches(in_stream, batch_size):
+            count += write_entities(convert_batch(batch, strip_uris), out_stream)
+    finally:
+        close_stream(in_stream)
+        close_stream(out_stream)
+
+    report_throughput(count, start)
+
+
+def main(args):
+    if args.stream:
+        convert_stream(args.file, args.output or '-', args.key_values, args.strip_uris, args.batch_size)
+    elif args.key_values:
+        result = LD_2_keyValues(read_json(args.file), args.strip_uris)
+        write_json(result, args.output or 'example.json')
+    else:
+        result = LD_2_normalized(read_json(args.file), args.strip_uris)
+        write_json(result, args.output or 'example-normalized.json')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(prog='LD2normalized')
+    parser.add_argument('file', help='input file (\'-\' for stdin in stream mode)')
+    parser.add_argument('-o', '--output',
+                        help='output file (default: example-normalized.json, example.json '
+                             'with --key-values, or stdout in stream mode)')
+    parser.add_argument('-s', '--stream', action='store_true',
+                        help='read NDJSON or a JSON array incrementally and write NDJSON')
+    parser.add_argument('-k', '--key-values', action='store_true',
+                        help='generate keyValues instead of the normalized representation')
+    parser.add_argument('--strip-uris', action='store_true',
+                        help='remove the urn:ngsi-ld:<type>: prefix of the identifiers (lossy)')
+    parser.add_argument('-b', '--batch-size', type=int, default=BATCH_SIZE,
+                        help='entities converted at once in stream mode')
+
+    main(parser.parse_args())
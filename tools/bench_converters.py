@@ -0,0 +1,90 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+
+Benchmark of the generated per Entity Type converters keyValues -> NGSI-LD
+(converter_codegen) against the generic keyValues_2_normalized +
+normalized_2_LD over homogeneous streams, built from the example of an
+Entity Type. Plain dict construction and the generic keyValues ->
+normalized are given as a reference. It also checks both give the same
+results
+
+Copyright (c) 2026 FIWARE Foundation e.V.
+
+"""
+
+import os
+import json
+import time
+from argparse import ArgumentParser
+
+from keyValues2Normalized import keyValues_2_normalized
+from normalized2LD import normalized_2_LD, default_ld_context
+import converter_codegen
+
+bench_types = {
+    'WeatherObserved': 'Weather/WeatherObserved/example.json',
+    'AirQualityObserved': 'Environment/AirQualityObserved/example.json'
+}
+
+
+# A stream of distinct entities sharing the layout of the example
+def build_stream(example, size):
+    out = []
+
+    for i in range(size):
+        entity = dict(example)
+        entity['id'] = '{}-{}'.format(example['id'], i)
+        out.append(entity)
+
+    return out
+
+
+def run(function, entities):
+    start = time.perf_counter()
+    out = [function(e) for e in entities]
+
+    return time.perf_counter() - start, out
+
+
+def report(label, elapsed, size):
+    print('  {:<28} {:.3f}s ({:.0f} entities/s)'.format(label, elapsed, size / elapsed))
+
+
+def main(args):
+    registry, generated = converter_codegen.load_converters(args.f, args.output, args.types_cache)
+    tables = registry.type_tables
+    ld_context = default_ld_context
+
+    for entity_type in sorted(bench_types):
+        with open(os.path.join(args.f, bench_types[entity_type])) as data_file:
+            entities = build_stream(json.loads(data_file.read()), args.size)
+
+        print('{} ({} entities)'.format(entity_type, args.size))
+
+        baseline, _ = run(lambda e: {k: {'value': v} for k, v in e.items()}, entities)
+        report('dict construction', baseline, args.size)
+
+        ref_time, _ = run(lambda e: keyValues_2_normalized(e, tables), entities)
+        report('generic -> normalized', ref_time, args.size)
+
+        ref_time, ref_out = run(lambda e: normalized_2_LD(keyValues_2_normalized(e, tables), ld_context),
+                                entities)
+        new_time, new_out = run(lambda e: registry.keyValues_2_LD(e, ld_context), entities)
+        if ref_out != new_out:
+            print('NGSI-LD results differ from the generic converters')
+            exit(1)
+        report('generic -> NGSI-LD', ref_time, args.size)
+        report('generated -> NGSI-LD', new_time, args.size)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-f', default='../specs', help='specs folder')
+    parser.add_argument('-n', '--size', type=int, default=100000, help='entities per stream')
+    parser.add_argument('-o', '--output', default='generated_converters',
+                        help='folder of the generated modules')
+    parser.add_argument('--types-cache', default='attribute_types.json',
+                        help='file caching the attribute types taken from the schemas')
+
+    main(parser.parse_args())
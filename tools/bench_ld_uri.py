@@ -0,0 +1,115 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+
+Micro-benchmark of the URI classification done by normalized2LD
+(ld_id / ld_object) over all the example-normalized.json files of the specs.
+It compares the memoized fast path against a plain RFC 3987 parse per call,
+checking both give the same results
+
+Copyright (c) 2026 FIWARE Foundation e.V.
+
+"""
+
+import os
+import json
+import time
+from argparse import ArgumentParser
+
+from rfc3987 import parse
+
+import normalized2LD
+
+
+# The previous implementation, parsing every value
+def reference_ld_id(entity_id, entity_type):
+    out = entity_id
+    try:
+        d = parse(entity_id, rule='URI')
+        scheme = d['scheme']
+        if scheme != 'urn' and scheme != 'http' and scheme != 'https':
+            raise ValueError
+    except ValueError:
+        out = normalized2LD.ngsild_uri(entity_type, entity_id)
+
+    return out
+
+
+def reference_ld_object(attribute_name, entity_id):
+    out = entity_id
+    try:
+        d = parse(entity_id, rule='URI')
+        scheme = d['scheme']
+        if scheme != 'urn' and scheme != 'http' and scheme != 'https':
+            raise ValueError
+    except ValueError:
+        entity_type = ''
+        if attribute_name.startswith('ref'):
+            entity_type = attribute_name[3:]
+
+        out = normalized2LD.ngsild_uri(entity_type, entity_id)
+
+    return out
+
+
+# Collects the (kind, arguments) of every classification done for the corpus
+def collect_calls(specs_folder):
+    calls = []
+
+    for dir_path, dir_names, file_names in os.walk(specs_folder):
+        dir_names.sort()
+        if 'example-normalized.json' not in file_names:
+            continue
+
+        with open(os.path.join(dir_path, 'example-normalized.json')) as data_file:
+            entity = json.loads(data_file.read())
+
+        calls.append(('id', entity['id'], entity['type']))
+
+        for key in entity:
+            attr = entity[key]
+            if isinstance(attr, dict) and attr.get('type') == 'Relationship':
+                values = attr['value'] if isinstance(attr['value'], list) else [str(attr['value'])]
+                for value in values:
+                    calls.append(('object', key, value))
+
+    return calls
+
+
+def run(calls, rounds, classify_id, classify_object):
+    out = None
+    start = time.perf_counter()
+
+    for _ in range(rounds):
+        out = [classify_id(a, b) if kind == 'id' else classify_object(a, b)
+               for kind, a, b in calls]
+
+    return time.perf_counter() - start, out
+
+
+def main(args):
+    calls = collect_calls(args.f)
+
+    ref_time, ref_out = run(calls, args.rounds, reference_ld_id, reference_ld_object)
+
+    normalized2LD.ld_id.cache_clear()
+    normalized2LD.ld_object.cache_clear()
+    new_time, new_out = run(calls, args.rounds, normalized2LD.ld_id, normalized2LD.ld_object)
+
+    if ref_out != new_out:
+        print('Results differ from the reference implementation')
+        exit(1)
+
+    total = len(calls) * args.rounds
+    print('{} classifications ({} distinct calls x {} rounds)'.format(total, len(calls), args.rounds))
+    print('rfc3987 parse:  {:.3f}s ({:.0f} calls/s)'.format(ref_time, total / ref_time))
+    print('fast path:      {:.3f}s ({:.0f} calls/s)'.format(new_time, total / new_time))
+    print('speedup:        {:.1f}x'.format(ref_time / new_time))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-f', default='../specs', help='specs folder')
+    parser.add_argument('-r', '--rounds', type=int, default=100, help='passes over the corpus')
+
+    main(parser.parse_args())
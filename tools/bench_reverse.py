@@ -0,0 +1,82 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+
+Throughput benchmark of the inverse converters (LD2normalized,
+normalized2keyValues) in stream mode: NDJSON in, NDJSON out, in batches.
+The input is built repeating the example-normalized-ld.jsonld files of the
+specs
+
+Copyright (c) 2026 FIWARE Foundation e.V.
+
+"""
+
+import io
+import os
+import json
+import time
+from argparse import ArgumentParser
+
+from entity_stream import read_batches, write_entities
+from LD2normalized import LD_2_normalized_batch, LD_2_keyValues_batch
+from normalized2keyValues import normalized_2_keyValues_batch
+
+
+def load_corpus(specs_folder):
+    out = []
+
+    for dir_path, dir_names, file_names in os.walk(specs_folder):
+        dir_names.sort()
+        if 'example-normalized-ld.jsonld' not in file_names:
+            continue
+
+        try:
+            with open(os.path.join(dir_path, 'example-normalized-ld.jsonld')) as data_file:
+                out.append(json.loads(data_file.read()))
+        except ValueError:
+            continue
+
+    return out
+
+
+def to_ndjson(entities, rounds):
+    lines = [json.dumps(e, ensure_ascii=False, separators=(',', ':')) for e in entities]
+
+    return '\n'.join(lines * rounds) + '\n'
+
+
+def run(convert_batch, ndjson, batch_size):
+    out_stream = io.StringIO()
+    count = 0
+    start = time.perf_counter()
+
+    for batch in read_batches(io.StringIO(ndjson), batch_size):
+        count += write_entities(convert_batch(batch), out_stream)
+
+    return time.perf_counter() - start, count, out_stream.getvalue()
+
+
+def main(args):
+    ld_ndjson = to_ndjson(load_corpus(args.f), args.rounds)
+
+    steps = [
+        ('NGSI-LD -> normalized', LD_2_normalized_batch, ld_ndjson),
+        ('NGSI-LD -> keyValues', LD_2_keyValues_batch, ld_ndjson)
+    ]
+
+    _, _, normalized_ndjson = run(LD_2_normalized_batch, ld_ndjson, args.batch_size)
+    steps.append(('normalized -> keyValues', normalized_2_keyValues_batch, normalized_ndjson))
+
+    for label, convert_batch, ndjson in steps:
+        elapsed, count, _ = run(convert_batch, ndjson, args.batch_size)
+        print('{:<24} {} entities in {:.3f}s ({:.0f} entities/s, {:.1f} MB/s)'.format(
+            label, count, elapsed, count / elapsed, len(ndjson) / elapsed / 1e6))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-f', default='../specs', help='specs folder')
+    parser.add_argument('-r', '--rounds', type=int, default=500, help='copies of the corpus in the stream')
+    parser.add_argument('-b', '--batch-size', type=int, default=1000, help='entities converted at once')
+
+    main(parser.parse_args())
@@ -0,0 +1,258 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+
+Local store of JSON-LD @context documents, so that the LD tools never
+need the network to resolve a @context. The @contexts of this repository
+are served for their published URLs and other @contexts (e.g. the ETSI
+NGSI-LD core @context) are pinned as files under contexts/, recorded with
+their SHA-256 in contexts/contexts.json. Parsed documents are kept in
+memory (LRU) and dropped as soon as the pinned version changes. check fails
+when a pinned copy is missing or modified, or when a required @context (the
+ETSI core one) was not pinned yet.
+
+    python context_store.py list
+    python context_store.py pin <url> [--file <local copy>]
+    python context_store.py check
+
+Copyright (c) 2026 FIWARE Foundation e.V.
+
+"""
+
+import os
+import sys
+import json
+import hashlib
+import urllib.request
+from argparse import ArgumentParser
+from collections import OrderedDict
+
+STORE_VERSION = 1
+
+etsi_core_context = 'https://uri.etsi.org/ngsi-ld/v1/ngsi-ld-core-context.jsonld'
+
+# @contexts which must be pinned for the LD tools to work offline
+required_contexts = [etsi_core_context]
+
+root_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+default_store_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'contexts')
+
+# @contexts of this repository and the URLs they are published at
+repository_contexts = {
+    'https://fiware.github.io/data-models/context.jsonld': os.path.join(root_folder, 'context.jsonld'),
+    'https://fiware.github.io/data-models/full-context.jsonld': os.path.join(root_folder, 'full-context.jsonld'),
+    'https://schema.lab.fiware.org/ld/context': os.path.join(root_folder, 'context.jsonld'),
+    'https://schema.lab.fiware.org/ld/context.jsonld': os.path.join(root_folder, 'context.jsonld')
+}
+
+# Parsed documents kept in memory
+MAX_ENTRIES = 64
+
+# Only used when fetching is explicitly enabled (pin)
+FETCH_TIMEOUT = 30
+
+
+class ContextNotFound(Exception):
+    pass
+
+
+def file_hash(path):
+    with open(path, 'rb') as data_file:
+        return hashlib.sha256(data_file.read()).hexdigest()
+
+
+def pinned_file_name(url):
+    name = url.split('://', 1)[-1].rstrip('/')
+    name = ''.join(c if c.isalnum() or c in '.-_' else '_' for c in name)
+
+    if not name.endswith('.jsonld') and not name.endswith('.json'):
+        name += '.jsonld'
+
+    return name
+
+
+class ContextStore:
+    def __init__(self, folder=default_store_folder, max_entries=MAX_ENTRIES):
+        self.folder = folder
+        self.max_entries = max_entries
+        self.manifest_file = os.path.join(folder, 'contexts.json')
+        # url -> (version, document)
+        self.memory = OrderedDict()
+        self.pinned = self.read_manifest()
+
+    def read_manifest(self):
+        try:
+            with open(self.manifest_file) as data_file:
+                manifest = json.loads(data_file.read())
+        except (IOError, ValueError):
+            return {}
+
+        if manifest.get('version') != STORE_VERSION:
+            return {}
+
+        return manifest.get('contexts', {})
+
+    def write_manifest(self):
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+
+        tmp_file = self.manifest_file + '.tmp'
+        with open(tmp_file, 'w') as data_file:
+            data_file.write(json.dumps({'version': STORE_VERSION, 'contexts': self.pinned},
+                                       indent=4, sort_keys=True))
+            data_file.write("\n")
+        os.replace(tmp_file, self.manifest_file)
+
+    # Returns (file, version) of a @context, (None, None) if not in the store.
+    # Pinned files are versioned by their SHA-256, repository ones by mtime and size
+    def locate(self, url):
+        entry = self.pinned.get(url)
+        if entry is not None:
+            return os.path.join(self.folder, entry['file']), entry['sha256']
+
+        path = repository_contexts.get(url)
+        if path is not None and os.path.isfile(path):
+            st = os.stat(path)
+            return path, (st.st_mtime_ns, st.st_size)
+
+        return None, None
+
+    def urls(self):
+        return sorted(set(repository_contexts) | set(self.pinned))
+
+    # Version of every document of the store, changes when any of them changes
+    def fingerprint(self):
+        return [[url, self.locate(url)[1]] for url in self.urls()]
+
+    # Returns the parsed @context document, without any network access
+    def get(self, url):
+        path, version = self.locate(url)
+        if path is None:
+            raise ContextNotFound('@context not available offline: {}'.format(url))
+
+        cached = self.memory.get(url)
+        if cached is not None and cached[0] == version:
+            self.memory.move_to_end(url)
+            return cached[1]
+
+        try:
+            with open(path) as data_file:
+                document = json.loads(data_file.read())
+        except (IOError, ValueError) as e:
+            raise ContextNotFound('@context {} cannot be read from {}: {}'.format(url, path, e))
+
+        self.memory[url] = (version, document)
+        self.memory.move_to_end(url)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+        return document
+
+    # Loader for ld_terms: the document, or None if not in the store
+    def loader(self, url):
+        try:
+            return self.get(url)
+        except ContextNotFound:
+            return None
+
+    def evict(self, url=None):
+        if url is None:
+            self.memory.clear()
+        else:
+            self.memory.pop(url, None)
+
+    # Stores a copy of a @context (its content as bytes) for the given URL
+    def pin(self, url, content):
+        json.loads(content.decode('utf-8'))
+
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+
+        file_name = pinned_file_name(url)
+        path = os.path.join(self.folder, file_name)
+        tmp_file = path + '.tmp'
+        with open(tmp_file, 'wb') as data_file:
+            data_file.write(content)
+        os.replace(tmp_file, path)
+
+        self.pinned[url] = {'file': file_name, 'sha256': hashlib.sha256(content).hexdigest()}
+        self.write_manifest()
+        self.evict(url)
+
+    # Returns the required documents that are not pinned
+    def missing(self):
+        return [url for url in required_contexts if self.locate(url)[0] is None]
+
+    # Returns the pinned documents whose file is missing or was modified
+    def check(self):
+        out = []
+
+        for url in sorted(self.pinned):
+            path = os.path.join(self.folder, self.pinned[url]['file'])
+            if not os.path.isfile(path) or file_hash(path) != self.pinned[url]['sha256']:
+                out.append(url)
+
+        return out
+
+
+def fetch(url, timeout=FETCH_TIMEOUT):
+    request = urllib.request.Request(url, headers={'Accept': 'application/ld+json, application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.read()
+
+
+_default_store = None
+
+
+# Store shared by the tools of this folder
+def default_store():
+    global _default_store
+
+    if _default_store is None:
+        _default_store = ContextStore()
+
+    return _default_store
+
+
+def main(args):
+    store = ContextStore(args.folder)
+
+    if args.command == 'list':
+        for url in store.urls():
+            path, version = store.locate(url)
+            print('{} -> {}'.format(url, os.path.relpath(path)))
+        for url in store.missing():
+            print('{} -> not pinned'.format(url))
+
+    elif args.command == 'pin':
+        if args.url is None:
+            print('Usage: context_store pin <url> [--file <local copy>]')
+            exit(-1)
+        if args.file:
+            with open(args.file, 'rb') as data_file:
+                content = data_file.read()
+        else:
+            content = fetch(args.url)
+        store.pin(args.url, content)
+        print('Pinned {} ({})'.format(args.url, store.pinned[args.url]['sha256']))
+
+    elif args.command == 'check':
+        missing = store.missing()
+        for url in missing:
+            sys.stderr.write('Required @context not pinned: {} (context_store.py pin <url> [--file <copy>])\n'
+                             .format(url))
+        modified = store.check()
+        for url in modified:
+            sys.stderr.write('Pinned @context missing or modified: {}\n'.format(url))
+        exit(1 if len(missing) + len(modified) > 0 else 0)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(prog='context_store')
+    parser.add_argument('command', choices=['list', 'pin', 'check'])
+    parser.add_argument('url', nargs='?', help='@context URL (pin)')
+    parser.add_argument('--file', help='local copy of the @context to pin, instead of fetching it')
+    parser.add_argument('--folder', default=default_store_folder, help='folder of the pinned @contexts')
+
+    main(parser.parse_args())
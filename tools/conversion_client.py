@@ -0,0 +1,191 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+
+Client of conversion_service, plus a load test: several concurrent
+clients post batches of entities (taken from the examples of the specs) and
+the throughput and latencies are reported. With --spawn the service is
+started locally for the duration of the test
+
+Copyright (c) 2026 FIWARE Foundation e.V.
+
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import subprocess
+from argparse import ArgumentParser
+
+import aiohttp
+
+# Input representation of each conversion, used to pick the load test examples
+conversion_inputs = {
+    'keyValues2normalized': 'example.json',
+    'keyValues2LD': 'example.json',
+    'normalized2LD': 'example-normalized.json',
+    'normalized2keyValues': 'example-normalized.json',
+    'print': 'example-normalized.json',
+    'LD2normalized': 'example-normalized-ld.jsonld',
+    'LD2keyValues': 'example-normalized-ld.jsonld',
+    'expand': 'example-normalized-ld.jsonld',
+    'compact': 'example-normalized-ld.jsonld'
+}
+
+
+class ConversionClient:
+    def __init__(self, base_url, session):
+        self.base_url = base_url.rstrip('/')
+        self.session = session
+
+    # Converts a batch (list) of entities
+    async def convert(self, conversion, entities, ld_context=None):
+        params = {'context': ld_context} if ld_context else None
+        async with self.session.post('{}/v1/convert/{}'.format(self.base_url, conversion),
+                                     data=json.dumps(entities), params=params,
+                                     headers={'Content-Type': 'application/json'}) as response:
+            body = await response.text()
+            if response.status != 200:
+                raise RuntimeError('{}: {}'.format(response.status, body))
+            return json.loads(body)
+
+    # Converts NDJSON (bytes), returning the converted NDJSON
+    async def stream(self, conversion, ndjson, ld_context=None):
+        params = {'context': ld_context} if ld_context else None
+        async with self.session.post('{}/v1/stream/{}'.format(self.base_url, conversion),
+                                     data=ndjson, params=params,
+                                     headers={'Content-Type': 'application/x-ndjson'}) as response:
+            body = await response.read()
+            if response.status != 200:
+                raise RuntimeError('{}: {}'.format(response.status, body))
+            return body
+
+    # Returns [{"id", "error"}] for a batch of keyValues entities
+    async def validate(self, entities):
+        async with self.session.post('{}/v1/validate'.format(self.base_url),
+                                     data=json.dumps(entities),
+                                     headers={'Content-Type': 'application/json'}) as response:
+            body = await response.text()
+            if response.status != 200:
+                raise RuntimeError('{}: {}'.format(response.status, body))
+            return json.loads(body)
+
+    async def health(self):
+        async with self.session.get('{}/v1/health'.format(self.base_url)) as response:
+            return await response.json()
+
+
+def load_examples(specs_folder, file_name):
+    out = []
+
+    for dir_path, dir_names, file_names in os.walk(specs_folder):
+        dir_names.sort()
+        if file_name not in file_names:
+            continue
+
+        try:
+            with open(os.path.join(dir_path, file_name)) as data_file:
+                data = json.loads(data_file.read())
+        except ValueError:
+            continue
+
+        if isinstance(data, dict):
+            out.append(data)
+
+    return out
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+async def wait_service(client, timeout=60):
+    deadline = time.monotonic() + timeout
+
+    while True:
+        try:
+            return await client.health()
+        except aiohttp.ClientError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+async def load_test(args):
+    examples = load_examples(args.specs, conversion_inputs[args.conversion])
+    batch = [examples[i % len(examples)] for i in range(args.batch_size)]
+    payload = json.dumps(batch)
+    latencies = []
+    errors = 0
+
+    async with aiohttp.ClientSession() as session:
+        client = ConversionClient(args.url, session)
+        print('Service: {}'.format(await wait_service(client)))
+
+        async def worker(requests):
+            nonlocal errors
+            for _ in range(requests):
+                start = time.perf_counter()
+                async with session.post('{}/v1/convert/{}'.format(client.base_url, args.conversion),
+                                        data=payload,
+                                        headers={'Content-Type': 'application/json'}) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(args.requests) for _ in range(args.concurrency)])
+        elapsed = time.perf_counter() - start
+
+    total = args.concurrency * args.requests
+    print('{} requests of {} entities ({} concurrent clients), {} failed'.format(
+        total, args.batch_size, args.concurrency, errors))
+    print('{:.0f} entities/s, {:.1f} requests/s'.format(total * args.batch_size / elapsed, total / elapsed))
+    print('latency p50 {:.1f}ms p95 {:.1f}ms max {:.1f}ms'.format(
+        percentile(latencies, 0.5) * 1000, percentile(latencies, 0.95) * 1000, max(latencies) * 1000))
+
+    return errors == 0
+
+
+def spawn_service(port, specs_folder):
+    tools_folder = os.path.dirname(os.path.abspath(__file__))
+
+    return subprocess.Popen([sys.executable, os.path.join(tools_folder, 'conversion_service.py'),
+                             '--port', str(port), '--specs', os.path.abspath(specs_folder)],
+                            cwd=tools_folder)
+
+
+def main(args):
+    service = None
+    if args.spawn:
+        service = spawn_service(args.port, args.specs)
+        args.url = 'http://127.0.0.1:{}'.format(args.port)
+
+    try:
+        ok = asyncio.run(load_test(args))
+    finally:
+        if service is not None:
+            service.terminate()
+            service.wait()
+
+    exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(prog='conversion_client')
+    parser.add_argument('--url', default='http://127.0.0.1:8090', help='base URL of the service')
+    parser.add_argument('--spawn', action='store_true', help='start the service locally for the test')
+    parser.add_argument('--port', type=int, default=8090, help='port of the spawned service')
+    parser.add_argument('--specs', default='../specs', help='specs folder (examples used as load)')
+    parser.add_argument('-c', '--conversion', default='keyValues2normalized',
+                        choices=sorted(conversion_inputs), help='conversion under test')
+    parser.add_argument('-n', '--requests', type=int, default=50, help='requests per client')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients')
+    parser.add_argument('-b', '--batch-size', type=int, default=1000, help='entities per request')
+
+    main(parser.parse_args())
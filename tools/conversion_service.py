@@ -0,0 +1,233 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+
+HTTP service exposing the conversion tools, so that pipelines do not pay
+the process startup and the loading of schemas and @contexts for every
+conversion. The type tables, generated converters, compiled validators and
+the @context term index are loaded once, when the service starts.
+
+    POST /v1/convert/{conversion}   JSON array of entities in, JSON array out
+    POST /v1/stream/{conversion}    NDJSON in, NDJSON out
+    POST /v1/validate               JSON array in, [{"id", "error"}] out
+    GET  /v1/health
+
+Conversions: keyValues2normalized, normalized2LD, keyValues2LD,
+LD2normalized, LD2keyValues, normalized2keyValues, print (canonical member
+order), expand, compact. The target @context of the LD conversions is given
+by the 'context' query parameter
+
+Copyright (c) 2026 FIWARE Foundation e.V.
+
+"""
+
+import os
+import json
+import asyncio
+from argparse import ArgumentParser
+
+from aiohttp import web
+
+from entity_print import print_json_string
+from normalized2LD import normalized_2_LD, default_ld_context, etsi_core_context
+from LD2normalized import LD_2_normalized, LD_2_keyValues
+from normalized2keyValues import normalized_2_keyValues
+from converter_codegen import load_converters
+from schema_validator import load_validator
+from ld_terms import load_index
+
+# Entities converted before yielding to the event loop
+SLICE_SIZE = 500
+
+# Bytes read at once from NDJSON request bodies
+CHUNK_SIZE = 1 << 16
+
+# Largest accepted request body (batch endpoints)
+MAX_BODY_SIZE = 256 * 1024 * 1024
+
+
+class ConversionState:
+    def __init__(self, specs_folder, cache_folder):
+        self.converters, _ = load_converters(specs_folder,
+                                             os.path.join(cache_folder, 'generated_converters'),
+                                             os.path.join(cache_folder, 'attribute_types.json'))
+        self.type_tables = self.converters.type_tables
+        self.validator = load_validator(specs_folder, os.path.join(cache_folder, 'validators.cache'))
+        self.terms = load_index(cache_file=os.path.join(cache_folder, 'ld_terms.idx'))
+
+    # Returns a function entity -> converted entity, None if unknown
+    def conversion(self, name, ld_context_uri):
+        converters = self.converters
+
+        if name == 'keyValues2normalized':
+            return converters.keyValues_2_normalized
+        if name == 'keyValues2LD':
+            return lambda e: converters.keyValues_2_LD(e, ld_context_uri)
+        if name == 'normalized2LD':
+            return lambda e: normalized_2_LD(e, ld_context_uri)
+        if name == 'LD2normalized':
+            return LD_2_normalized
+        if name == 'LD2keyValues':
+            return LD_2_keyValues
+        if name == 'normalized2keyValues':
+            return normalized_2_keyValues
+        if name == 'print':
+            return lambda e: e
+        if name == 'expand':
+            return self.terms.expand_entity
+        if name == 'compact':
+            return lambda e: self.terms.compact_entity(e, [ld_context_uri, etsi_core_context])
+
+        return None
+
+
+# Application key of the ConversionState
+STATE = web.AppKey('state', ConversionState)
+
+
+# Applies function to the entities, yielding to the event loop between slices
+async def convert_entities(function, entities):
+    out = []
+
+    for i in range(0, len(entities), SLICE_SIZE):
+        out.extend(function(e) for e in entities[i:i + SLICE_SIZE])
+        await asyncio.sleep(0)
+
+    return out
+
+
+# JSON array with the entities' members in the canonical order
+def dump_entities(entities):
+    return '[' + ','.join(print_json_string(e, compact=True) for e in entities) + ']'
+
+
+def error_response(status, message):
+    return web.json_response({'error': message}, status=status)
+
+
+def request_conversion(request):
+    state = request.app[STATE]
+    ld_context_uri = request.query.get('context', default_ld_context)
+
+    return state.conversion(request.match_info['conversion'], ld_context_uri)
+
+
+async def read_entity_array(request):
+    try:
+        entities = json.loads(await request.text())
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=json.dumps({'error': 'Invalid JSON: {}'.format(e)}),
+                                 content_type='application/json')
+
+    if not isinstance(entities, list):
+        raise web.HTTPBadRequest(text=json.dumps({'error': 'A JSON array of entities is expected'}),
+                                 content_type='application/json')
+
+    return entities
+
+
+async def handle_convert(request):
+    function = request_conversion(request)
+    if function is None:
+        return error_response(404, 'Unknown conversion: {}'.format(request.match_info['conversion']))
+
+    entities = await read_entity_array(request)
+
+    try:
+        result = await convert_entities(function, entities)
+        text = dump_entities(result)
+    except Exception as e:
+        return error_response(422, '{}: {}'.format(type(e).__name__, e))
+
+    return web.Response(text=text, content_type='application/json')
+
+
+async def handle_stream(request):
+    function = request_conversion(request)
+    if function is None:
+        return error_response(404, 'Unknown conversion: {}'.format(request.match_info['conversion']))
+
+    response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+    await response.prepare(request)
+
+    pending = b''
+    async for chunk in request.content.iter_chunked(CHUNK_SIZE):
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        out = []
+        for line in lines:
+            if line.strip():
+                out.append(convert_line(function, line))
+        if len(out) > 0:
+            await response.write(''.join(out).encode('utf-8'))
+
+    if pending.strip():
+        await response.write(convert_line(function, pending).encode('utf-8'))
+
+    await response.write_eof()
+
+    return response
+
+
+# Converts one NDJSON line. Errors are reported in place, as {"error": ...}
+def convert_line(function, line):
+    try:
+        return print_json_string(function(json.loads(line)), compact=True) + '\n'
+    except Exception as e:
+        return json.dumps({'error': '{}: {}'.format(type(e).__name__, e)}) + '\n'
+
+
+async def handle_validate(request):
+    validator = request.app[STATE].validator
+    entities = await read_entity_array(request)
+
+    def validate(entity):
+        return {
+            'id': entity.get('id') if isinstance(entity, dict) else None,
+            'error': validator.validate_entity(entity)
+        }
+
+    result = await convert_entities(validate, entities)
+
+    return web.json_response(result)
+
+
+async def handle_health(request):
+    state = request.app[STATE]
+
+    return web.json_response({
+        'entityTypes': len(state.type_tables),
+        'validators': len(state.validator.functions),
+        'terms': len(state.terms.terms)
+    })
+
+
+def create_app(specs_folder, cache_folder):
+    app = web.Application(client_max_size=MAX_BODY_SIZE)
+    app[STATE] = ConversionState(specs_folder, cache_folder)
+
+    app.router.add_post('/v1/convert/{conversion}', handle_convert)
+    app.router.add_post('/v1/stream/{conversion}', handle_stream)
+    app.router.add_post('/v1/validate', handle_validate)
+    app.router.add_get('/v1/health', handle_health)
+
+    return app
+
+
+def main(args):
+    if not os.path.isdir(args.cache):
+        os.makedirs(args.cache)
+
+    app = create_app(args.specs, args.cache)
+
+    web.run_app(app, host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(prog='conversion_service')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8090, help='port to listen on')
+    parser.add_argument('--specs', default='../specs', help='specs folder')
+    parser.add_argument('--cache', default='.', help='folder of the caches (types, validators, @context)')
+
+    main(parser.parse_args())
@@ -0,0 +1,293 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+
+Generates, for each Entity Type described by the JSON Schemas, specialized
+converters keyValues -> NGSI-LD. The handling of each attribute (NGSI type,
+Relationship, GeoProperty, DateTime...) is decided when the code is
+generated, so that converting an entity is just building a dict. The code is
+written as one importable module per Entity Type and only regenerated when
+the attribute types or the converters change. keyValues -> normalized is
+left to the generic converter: it is little more than building a dict
+already, generating it did not pay off
+
+Copyright (c) 2026 FIWARE Foundation e.V.
+
+"""
+
+import os
+import json
+import hashlib
+import importlib.util
+from argparse import ArgumentParser
+
+from schema_types import load_type_tables, guess_attribute_type, find_schemas
+from keyValues2Normalized import keyValues_2_normalized
+from normalized2LD import normalized_2_LD
+
+GENERATOR_VERSION = 2
+
+# Different attribute layouts (key order) compiled at most per Entity Type.
+# Entities with other layouts go through the generic converters
+MAX_SHAPES = 64
+
+module_header = '''# -*- coding: utf-8 -*-
+# Generated by converter_codegen.py from the schema of {entity_type}. Do not edit
+
+from normalized2LD import ld_id, ld_object, normalize_date, etsi_core_context
+
+ENTITY_TYPE = {entity_type!r}
+
+FINGERPRINT = {fingerprint!r}
+
+# attribute -> NGSI type, None if untyped
+ATTRIBUTE_TYPES = {attribute_types!r}
+
+'''
+
+
+def module_name(entity_type):
+    return 'converters_' + ''.join(c if c.isalnum() else '_' for c in entity_type).lower()
+
+
+# NGSI type of an attribute, as keyValues_2_normalized would choose it
+def attribute_type(key, attribute_types):
+    attr_type = attribute_types.get(key)
+    if attr_type is None:
+        attr_type = guess_attribute_type(key)
+
+    return attr_type
+
+
+# (member, expression) building the NGSI-LD member from the keyValues one.
+# It mirrors normalized_2_LD applied to the output of keyValues_2_normalized
+def ld_member(key, attr_type):
+    value = 'e[{!r}]'.format(key)
+
+    if key == 'id':
+        return key, "ld_id(e['id'], e['type'])"
+
+    if key == 'type':
+        return key, value
+
+    if key == 'dateCreated':
+        return 'createdAt', 'normalize_date({})'.format(value)
+
+    if key == 'dateModified':
+        return 'modifiedAt', 'normalize_date({})'.format(value)
+
+    if attr_type == 'Relationship':
+        ld_type = 'Relationship'
+        member = 'object'
+        ld_value = '[ld_object({k!r}, o) for o in {v}] if isinstance({v}, list) else ' \
+                   'ld_object({k!r}, str({v}))'.format(k=key, v=value)
+    else:
+        ld_type = 'Property'
+        member = 'value'
+        ld_value = value
+
+    if key == 'location':
+        ld_type = 'GeoProperty'
+
+    if attr_type == 'DateTime':
+        ld_value = "{{'@type': 'DateTime', '@value': normalize_date({})}}".format(value)
+    elif attr_type == 'PostalAddress':
+        ld_value = "dict({}, type='PostalAddress')".format(value)
+
+    return key, "{{'type': {!r}, {!r}: {}}}".format(ld_type, member, ld_value)
+
+
+# Source code of the converter of one attribute layout (shape)
+def shape_source(index, shape, attribute_types):
+    ld = ["'@context': [ld_context_uri, etsi_core_context]"]
+
+    for key in shape:
+        ld.append('{!r}: {}'.format(*ld_member(key, attribute_type(key, attribute_types))))
+
+    separator = ',\n        '
+
+    return '''
+def keyValues_2_LD_{index}(e, ld_context_uri):
+    return {{
+        {ld}
+    }}
+
+'''.format(index=index, ld=separator.join(ld))
+
+
+def shapes_source(shapes):
+    lines = ['SHAPES = {']
+    for index, shape in enumerate(shapes):
+        lines.append('    {!r}: keyValues_2_LD_{i},'.format(shape, i=index))
+    lines.append('}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def generate_module(entity_type, attribute_types, shapes, fingerprint):
+    out = [module_header.format(entity_type=entity_type, fingerprint=fingerprint,
+                                attribute_types=attribute_types)]
+
+    for index, shape in enumerate(shapes):
+        out.append(shape_source(index, shape, attribute_types))
+
+    out.append(shapes_source(shapes))
+
+    return '\n'.join(out)
+
+
+# Key order of the examples of each Entity Type, which are compiled ahead
+# of time as they are the layouts most likely to be found
+def example_shapes(specs_folder):
+    out = {}
+
+    for schema_path in find_schemas(specs_folder):
+        example = os.path.join(os.path.dirname(schema_path), 'example.json')
+        try:
+            with open(example) as data_file:
+                entity = json.loads(data_file.read())
+        except (IOError, ValueError):
+            continue
+
+        if isinstance(entity, dict) and 'id' in entity and 'type' in entity:
+            shapes = out.setdefault(entity['type'], [])
+            shape = tuple(entity)
+            if shape not in shapes:
+                shapes.append(shape)
+
+    return out
+
+
+# Changes in the converters this code mirrors invalidate all the modules
+def generator_hash():
+    h = hashlib.sha256(str(GENERATOR_VERSION).encode('utf-8'))
+    tools_folder = os.path.dirname(os.path.abspath(__file__))
+
+    for f in ('converter_codegen.py', 'keyValues2Normalized.py', 'normalized2LD.py', 'schema_types.py'):
+        with open(os.path.join(tools_folder, f), 'rb') as data_file:
+            h.update(data_file.read())
+
+    return h.hexdigest()
+
+
+def module_fingerprint(generator, attribute_types, shapes):
+    h = hashlib.sha256(generator.encode('utf-8'))
+    h.update(json.dumps([attribute_types, shapes], sort_keys=True).encode('utf-8'))
+
+    return h.hexdigest()
+
+
+def import_module(path, name):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+class ConverterRegistry:
+    def __init__(self, modules, type_tables):
+        # entity type -> generated module
+        self.modules = modules
+        self.type_tables = type_tables
+        # entity type -> {shape -> LD converter}
+        self.shapes = {}
+
+        for entity_type in modules:
+            self.shapes[entity_type] = dict(modules[entity_type].SHAPES)
+
+    # Compiles the converter of a layout not seen before
+    def _compile_shape(self, entity_type, shape):
+        shapes = self.shapes[entity_type]
+        if len(shapes) >= MAX_SHAPES:
+            return None
+
+        index = len(shapes)
+        namespace = dict(vars(self.modules[entity_type]))
+        exec(compile(shape_source(index, shape, self.modules[entity_type].ATTRIBUTE_TYPES),
+                     '<{} shape {}>'.format(entity_type, index), 'exec'), namespace)
+
+        converter = namespace['keyValues_2_LD_{}'.format(index)]
+        shapes[shape] = converter
+
+        return converter
+
+    def _converter(self, entity):
+        shapes = self.shapes.get(entity.get('type'))
+        if shapes is None:
+            return None
+
+        shape = tuple(entity)
+        converter = shapes.get(shape)
+        if converter is None:
+            converter = self._compile_shape(entity['type'], shape)
+
+        return converter
+
+    # Not generated, the generic converter with the type tables loaded
+    def keyValues_2_normalized(self, entity):
+        return keyValues_2_normalized(entity, self.type_tables)
+
+    def keyValues_2_LD(self, entity, ld_context_uri):
+        converter = self._converter(entity)
+        if converter is None:
+            return normalized_2_LD(keyValues_2_normalized(entity, self.type_tables), ld_context_uri)
+
+        return converter(entity, ld_context_uri)
+
+
+# Generates (when needed) and imports the converters of every Entity Type.
+# Returns a ConverterRegistry which selects them by the 'type' of entities
+def load_converters(specs_folder, output_folder, types_cache=None):
+    type_tables = load_type_tables(specs_folder, types_cache)
+    shapes = example_shapes(specs_folder)
+    generator = generator_hash()
+
+    if not os.path.isdir(output_folder):
+        os.makedirs(output_folder)
+
+    modules = {}
+    generated = 0
+
+    for entity_type in sorted(type_tables):
+        attribute_types = type_tables[entity_type]
+        type_shapes = shapes.get(entity_type, [])
+        fingerprint = module_fingerprint(generator, attribute_types, type_shapes)
+        name = module_name(entity_type)
+        path = os.path.join(output_folder, name + '.py')
+
+        module = None
+        if os.path.isfile(path):
+            module = import_module(path, name)
+            if getattr(module, 'FINGERPRINT', None) != fingerprint:
+                module = None
+
+        if module is None:
+            tmp_file = path + '.tmp'
+            with open(tmp_file, 'w') as data_file:
+                data_file.write(generate_module(entity_type, attribute_types, type_shapes, fingerprint))
+            os.replace(tmp_file, path)
+            module = import_module(path, name)
+            generated += 1
+
+        modules[entity_type] = module
+
+    return ConverterRegistry(modules, type_tables), generated
+
+
+def main(args):
+    registry, generated = load_converters(args.schemas, args.output, args.types_cache)
+
+    print('Entity Types: {} generated: {} up to date: {}'.format(
+        len(registry.modules), generated, len(registry.modules) - generated))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(prog='converter_codegen')
+    parser.add_argument('--schemas', default='../specs', help='specs folder')
+    parser.add_argument('-o', '--output', default='generated_converters',
+                        help='folder of the generated modules')
+    parser.add_argument('--types-cache', default='attribute_types.json',
+                        help='file caching the attribute types taken from the schemas')
+
+    main(parser.parse_args())
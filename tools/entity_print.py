@@ -10,60 +10,46 @@ Author: José Manuel Cantera
 """
 
 import json
-from copy import deepcopy
 
-# Prints the JSON string but with the proper member order
-
-
-def print_json_string(entity):
-    entity_only_id = {
-        'id': entity['id'],
-    }
+# Members going first, in this order. The '@context' goes last
+head_members = ('id', 'type', 'modifiedAt', 'createdAt')
+special_members = frozenset(head_members + ('@context',))
 
-    out = json.dumps(entity_only_id, indent=4)[:-2]
+indented_encoder = json.JSONEncoder(indent=4)
+# Used by machine pipelines, e.g. NDJSON
+compact_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
 
-    entity_only_type = {
-        'type': entity['type'],
-    }
 
-    # with -2 it is removed the new line char as well
-    out += "," + json.dumps(entity_only_type, indent=4)[1:-2]
+# Returns a shallow view of the entity with its members in the canonical
+# order: id, type, modifiedAt, createdAt, the rest, @context
+def canonical_order(entity):
+    out = {}
 
-    entity_cloned = deepcopy(entity)
+    for key in head_members:
+        if key in entity:
+            out[key] = entity[key]
 
-    if 'modifiedAt' in entity:
-        entity_only_modified_at = {
-            'modifiedAt': entity['modifiedAt'],
-        }
-        out += "," + json.dumps(entity_only_modified_at, indent=4)[1:-2]
+    for key in entity:
+        if key not in special_members:
+            out[key] = entity[key]
 
-        del entity_cloned['modifiedAt']
-
-    if 'createdAt' in entity:
-        entity_only_created_at = {
-            'createdAt': entity['createdAt'],
-        }
-        out += "," + json.dumps(entity_only_created_at, indent=4)[1:-2]
+    if '@context' in entity:
+        out['@context'] = entity['@context']
 
-        del entity_cloned['createdAt']
+    return out
 
-    del entity_cloned['id']
-    del entity_cloned['type']
 
-    if '@context' in entity_cloned:
-        del entity_cloned['@context']
+# Prints the JSON string but with the proper member order
+def print_json_string(entity, compact=False):
+    encoder = compact_encoder if compact else indented_encoder
 
-    # Now the rest of the entity without the '@context
-    out += "," + json.dumps(entity_cloned, indent=4)[1:-2]
+    return encoder.encode(canonical_order(entity))
 
-    # Last go the '@context'
-    if '@context' in entity:
-        only_ld_context = {
-            '@context': entity['@context']
-        }
 
-        out += "," + json.dumps(only_ld_context, indent=4)[1:]
-    else:
-        out += "\n}"
+# Writes the entity, with the proper member order, to a file or stream.
+# The JSON is written as it is encoded, never built in memory as a whole
+def write_entity(entity, stream, compact=False):
+    encoder = compact_encoder if compact else indented_encoder
 
-    return out
+    for chunk in encoder.iterencode(canonical_order(entity)):
+        stream.write(chunk)
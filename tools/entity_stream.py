@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+
+Incremental reading and writing of NGSI Entities encoded either as
+NDJSON (one entity per line) or as a JSON array, so that arbitrarily large
+dumps can be converted with constant memory
+
+Copyright (c) 2026 FIWARE Foundation e.V.
+
+"""
+
+import sys
+import json
+import time
+
+from entity_print import print_json_string
+
+# Amount of characters read from the input stream at once
+CHUNK_SIZE = 1 << 16
+
+_decoder = json.JSONDecoder()
+
+_WHITESPACE = ' \t\n\r'
+
+
+# Yields the entities contained by a text stream one by one.
+# Both NDJSON and a (single) JSON array of entities are accepted. Anything
+# else (items which are not JSON objects, empty array elements, an array
+# left open at the end of the stream) raises a JSONDecodeError
+def read_entities(stream, chunk_size=CHUNK_SIZE):
+    buf = ''
+    pos = 0
+    eof = False
+    in_array = None
+    # In an array: whether an entity is expected (after '[' or ',')
+    expecting = True
+    empty = True
+
+    while True:
+        # Skipping whitespace
+        while True:
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            buf = stream.read(chunk_size)
+            pos = 0
+            eof = len(buf) == 0
+
+        if pos >= len(buf):
+            if in_array:
+                raise json.JSONDecodeError("Unterminated array, expecting ']'", buf, pos)
+            return
+
+        if in_array is None:
+            in_array = buf[pos] == '['
+            if in_array:
+                pos += 1
+                continue
+
+        if in_array:
+            if buf[pos] == ']':
+                if expecting and not empty:
+                    raise json.JSONDecodeError('Expecting an entity after the comma', buf, pos)
+                check_end(stream, buf, pos + 1, chunk_size)
+                return
+            if buf[pos] == ',':
+                if expecting:
+                    raise json.JSONDecodeError('Empty array element', buf, pos)
+                expecting = True
+                pos += 1
+                continue
+            if not expecting:
+                raise json.JSONDecodeError("Expecting ',' delimiter", buf, pos)
+
+        if buf[pos] != '{':
+            raise json.JSONDecodeError('Expecting an entity (JSON object)', buf, pos)
+
+        try:
+            entity, end = _decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # The entity is split across chunks. Reading at least as much as
+            # it is already buffered keeps big entities linear in their size
+            more = stream.read(max(chunk_size, len(buf) - pos))
+            eof = len(more) == 0
+            buf = buf[pos:] + more
+            pos = 0
+            continue
+
+        pos = end
+        expecting = False
+        empty = False
+        yield entity
+
+        if pos > chunk_size:
+            buf = buf[pos:]
+            pos = 0
+
+
+# Raises if anything but whitespace follows the closing bracket of the array
+def check_end(stream, buf, pos, chunk_size):
+    while True:
+        while pos < len(buf) and buf[pos] in _WHITESPACE:
+            pos += 1
+        if pos < len(buf):
+            raise json.JSONDecodeError('Extra data', buf, pos)
+        buf = stream.read(chunk_size)
+        pos = 0
+        if len(buf) == 0:
+            return
+
+
+# Groups the entities of a stream (see read_entities) in lists of batch_size
+def read_batches(stream, batch_size, chunk_size=CHUNK_SIZE):
+    batch = []
+
+    for entity in read_entities(stream, chunk_size):
+        batch.append(entity)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if len(batch) > 0:
+        yield batch
+
+
+# Writes entities to a text stream as NDJSON (members in the canonical order).
+# Returns the number of entities
+def write_entities(entities, stream):
+    count = 0
+
+    for entity in entities:
+        # one line per entity: the C encoder (print_json_string) writes it at
+        # once, twice as fast as streaming the chunks of write_entity
+        stream.write(print_json_string(entity, compact=True))
+        stream.write('\n')
+        count += 1
+
+    return count
+
+
+# Opens a file for streaming, '-' stands for stdin / stdout
+def open_stream(name, mode='r'):
+    if name == '-':
+        return sys.stdin if 'r' in mode else sys.stdout
+
+    return open(name, mode, encoding='utf-8')
+
+
+# Closes a stream opened with open_stream, only flushing stdin / stdout
+def close_stream(stream):
+    if stream is sys.stdin:
+        return
+
+    if stream is sys.stdout:
+        stream.flush()
+    else:
+        stream.close()
+
+
+# Reports how many entities were processed and at which rate
+def report_throughput(count, start, out=sys.stderr):
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed if elapsed > 0 else float('inf')
+
+    out.write('{} entities in {:.3f}s ({:.0f} entities/s)\n'.format(
+        count, elapsed, rate))
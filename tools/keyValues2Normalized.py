@@ -11,15 +11,26 @@ Author: José Manuel Cantera
 
 """
 
-import sys
 import json
+import time
+from argparse import ArgumentParser
 
-from entity_print import print_json_string
+from entity_print import write_entity
+from schema_types import load_type_tables, guess_attribute_type
+from entity_stream import read_entities, write_entities, open_stream, close_stream, \
+    report_throughput
 
 
-def keyValues_2_normalized(entity):
+# type_tables (entity type -> {attribute -> NGSI type}) can be obtained
+# from the JSON Schemas through schema_types.load_type_tables.
+# Attributes not described by them fall back to the name based guess
+def keyValues_2_normalized(entity, type_tables=None):
     out = {}
 
+    attribute_types = None
+    if type_tables is not None:
+        attribute_types = type_tables.get(entity.get('type'))
+
     for key in entity:
         if key == 'id' or key == 'type':
             out[key] = entity[key]
@@ -29,20 +40,14 @@ def keyValues_2_normalized(entity):
             'value': entity[key]
         }
 
-        if key == 'location':
-            out[key]['type'] = 'geo:json'
-
-        if key.startswith('date'):
-            out[key]['type'] = 'DateTime'
-
-        if key == 'address':
-            out[key]['type'] = 'PostalAddress'
+        attr_type = None
+        if attribute_types is not None:
+            attr_type = attribute_types.get(key)
+        if attr_type is None:
+            attr_type = guess_attribute_type(key)
 
-        if key.startswith('ref'):
-            out[key]['type'] = 'Relationship'
-
-        if key.startswith('has'):
-            out[key]['type'] = 'Relationship'
+        if attr_type is not None:
+            out[key]['type'] = attr_type
 
     return out
 
@@ -56,19 +61,52 @@ def read_json(infile):
 
 def write_json(data, outfile):
     with open(outfile, 'w') as data_file:
-        data_file.write(print_json_string(data))
+        write_entity(data, data_file)
         data_file.write("\n")
 
 
+# Converts a stream of keyValues entities (NDJSON or JSON array)
+# into normalized entities written as NDJSON
+def convert_stream(infile, outfile, type_tables=None):
+    start = time.perf_counter()
+
+    in_stream = open_stream(infile)
+    out_stream = open_stream(outfile, 'w')
+
+    try:
+        count = write_entities(
+            (keyValues_2_normalized(e, type_tables) for e in read_entities(in_stream)), out_stream)
+    finally:
+        close_stream(in_stream)
+        close_stream(out_stream)
+
+    report_throughput(count, start)
+
+
 def main(args):
-    data = read_json(args[1])
-    result = keyValues_2_normalized(data)
-    write_json(result, 'example-normalized.json')
+    type_tables = None
+    if args.schemas:
+        type_tables = load_type_tables(args.schemas, args.types_cache)
 
+    if args.stream:
+        convert_stream(args.file, args.output or '-', type_tables)
+    else:
+        data = read_json(args.file)
+        result = keyValues_2_normalized(data, type_tables)
+        write_json(result, args.output or 'example-normalized.json')
 
-if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print("Usage: keyvalues2Normalized [file]")
-        exit(-1)
 
-    main(sys.argv)
+if __name__ == '__main__':
+    parser = ArgumentParser(prog='keyValues2Normalized')
+    parser.add_argument('file', help='input file (\'-\' for stdin in stream mode)')
+    parser.add_argument('-o', '--output',
+                        help='output file (default: example-normalized.json, '
+                             'or stdout in stream mode)')
+    parser.add_argument('-s', '--stream', action='store_true',
+                        help='read NDJSON or a JSON array incrementally and write NDJSON')
+    parser.add_argument('--schemas',
+                        help='specs folder whose JSON Schemas give the attribute types')
+    parser.add_argument('--types-cache', default='attribute_types.json',
+                        help='file caching the attribute types taken from the schemas')
+
+    main(parser.parse_args())
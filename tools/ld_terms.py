@@ -0,0 +1,285 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+
+Term lookup index for NGSI-LD Entities: loads the LD @context once
+(context.jsonld, full-context.jsonld), builds the term -> IRI and
+IRI -> term tables and keeps them in a binary cache which is much faster to
+load than the @context itself. Entities can then be expanded (terms replaced
+by IRIs) or compacted (IRIs replaced by terms) in bulk.
+
+Only term mapping is done: the member names, the entity types and the
+values of the terms with "@type": "@vocab" (enumerations) are mapped. The
+other @type coercions (@id, DateTime...) are not applied, values are left
+as they are. This is not a JSON-LD processor.
+
+Copyright (c) 2026 FIWARE Foundation e.V.
+
+"""
+
+import os
+import json
+import pickle
+import time
+from argparse import ArgumentParser
+
+from entity_stream import read_entities, write_entities, open_stream, close_stream, \
+    report_throughput
+from context_store import default_store
+
+INDEX_VERSION = 2
+
+root_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+default_context_files = [
+    os.path.join(root_folder, 'context.jsonld'),
+    os.path.join(root_folder, 'full-context.jsonld')
+]
+
+# Members defined by the NGSI-LD core @context, which are never expanded
+ngsi_ld_members = frozenset([
+    '@context', 'id', 'type', 'value', 'object', 'observedAt', 'unitCode',
+    'datasetId', 'createdAt', 'modifiedAt', 'instanceId', '@type', '@value'
+])
+
+
+def read_json(infile):
+    with open(infile) as data_file:
+        data = json.loads(data_file.read())
+
+    return data
+
+
+class TermIndex:
+    def __init__(self):
+        # term -> (IRI, '@vocab' if its values are terms too, else None)
+        self.terms = {}
+        # IRI -> term
+        self.iris = {}
+        # @context documents that could not be resolved locally
+        self.unresolved = []
+
+    def add_context(self, context, loader):
+        if isinstance(context, list):
+            for item in context:
+                self.add_context(item, loader)
+        elif isinstance(context, str):
+            document = loader(context)
+            if document is None:
+                self.unresolved.append(context)
+            else:
+                self.add_context(document.get('@context', {}), loader)
+        elif isinstance(context, dict):
+            for term in context:
+                if term.startswith('@'):
+                    continue
+                definition = context[term]
+                if isinstance(definition, str):
+                    self.terms[term] = (definition, None)
+                elif isinstance(definition, dict) and '@id' in definition:
+                    vocab = '@vocab' if definition.get('@type') == '@vocab' else None
+                    self.terms[term] = (definition['@id'], vocab)
+
+    # Builds the reverse table, preferring the term which is the IRI's fragment
+    def build_reverse(self):
+        self.iris = {}
+
+        for term in sorted(self.terms):
+            iri = self.terms[term][0]
+            if iri not in self.iris or iri.endswith('#' + term) or iri.endswith('/' + term):
+                self.iris[iri] = term
+
+    def expand_term(self, term):
+        definition = self.terms.get(term)
+
+        return term if definition is None else definition[0]
+
+    def compact_iri(self, iri):
+        return self.iris.get(iri, iri)
+
+    # Expands the members of an attribute (Property / Relationship)
+    def _expand_attribute(self, name, attr):
+        if not isinstance(attr, dict):
+            return attr
+
+        definition = self.terms.get(name)
+        out = {}
+
+        for key in attr:
+            value = attr[key]
+            if key == 'value' and definition is not None and definition[1] == '@vocab':
+                value = self._map_values(value, self.expand_term)
+                out[key] = value
+            elif key in ngsi_ld_members:
+                out[key] = value
+            else:
+                # A property of a property
+                out[self.expand_term(key)] = self._expand_attribute(key, value)
+
+        return out
+
+    def _compact_attribute(self, name, attr):
+        if not isinstance(attr, dict):
+            return attr
+
+        definition = self.terms.get(name)
+        out = {}
+
+        for key in attr:
+            value = attr[key]
+            if key == 'value' and definition is not None and definition[1] == '@vocab':
+                out[key] = self._map_values(value, self.compact_iri)
+            elif key in ngsi_ld_members:
+                out[key] = value
+            else:
+                term = self.compact_iri(key)
+                out[term] = self._compact_attribute(term, value)
+
+        return out
+
+    @staticmethod
+    def _map_values(value, function):
+        if isinstance(value, str):
+            return function(value)
+        if isinstance(value, list):
+            return [function(v) if isinstance(v, str) else v for v in value]
+
+        return value
+
+    def expand_entity(self, entity):
+        out = {}
+
+        for key in entity:
+            if key == '@context':
+                continue
+            if key == 'type':
+                out[key] = self._map_values(entity[key], self.expand_term)
+            elif key in ngsi_ld_members:
+                out[key] = entity[key]
+            else:
+                out[self.expand_term(key)] = self._expand_attribute(key, entity[key])
+
+        return out
+
+    def compact_entity(self, entity, ld_context=None):
+        out = {}
+
+        for key in entity:
+            if key == '@context':
+                continue
+            if key == 'type':
+                out[key] = self._map_values(entity[key], self.compact_iri)
+            elif key in ngsi_ld_members:
+                out[key] = entity[key]
+            else:
+                term = self.compact_iri(key)
+                out[term] = self._compact_attribute(term, entity[key])
+
+        if ld_context is not None:
+            out['@context'] = ld_context
+
+        return out
+
+    # Bulk operations, they accept any iterable of entities
+    def expand(self, entities):
+        return [self.expand_entity(e) for e in entities]
+
+    def compact(self, entities, ld_context=None):
+        return [self.compact_entity(e, ld_context) for e in entities]
+
+
+# Remote @context documents are resolved by the (offline) context store
+def build_index(context_files, loader=None):
+    if loader is None:
+        loader = default_store().loader
+
+    index = TermIndex()
+
+    for f in context_files:
+        index.add_context(read_json(f).get('@context', {}), loader)
+
+    index.build_reverse()
+
+    return index
+
+
+def sources_fingerprint(context_files):
+    out = []
+
+    for f in context_files:
+        if os.path.isfile(f):
+            st = os.stat(f)
+            out.append((os.path.abspath(f), st.st_mtime_ns, st.st_size))
+
+    out.append(default_store().fingerprint())
+
+    return out
+
+
+# Returns the index, loading it from the binary cache file while the
+# @context files it was built from don't change
+def load_index(context_files=None, cache_file=None, loader=None):
+    if context_files is None:
+        context_files = default_context_files
+
+    fingerprint = sources_fingerprint(context_files)
+
+    if cache_file and os.path.isfile(cache_file):
+        try:
+            with open(cache_file, 'rb') as data_file:
+                cached = pickle.load(data_file)
+            if cached['version'] == INDEX_VERSION and cached['fingerprint'] == fingerprint:
+                index = TermIndex()
+                index.terms, index.iris, index.unresolved = cached['tables']
+                return index
+        except (pickle.UnpicklingError, EOFError, KeyError, ValueError, TypeError):
+            pass
+
+    index = build_index(context_files, loader)
+
+    if cache_file:
+        tmp_file = cache_file + '.tmp'
+        with open(tmp_file, 'wb') as data_file:
+            pickle.dump({
+                'version': INDEX_VERSION,
+                'fingerprint': fingerprint,
+                'tables': (index.terms, index.iris, index.unresolved)
+            }, data_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+
+    return index
+
+
+def main(args):
+    start = time.perf_counter()
+    index = load_index(args.context or None, args.cache)
+
+    in_stream = open_stream(args.file)
+    out_stream = open_stream(args.output, 'w')
+
+    try:
+        entities = read_entities(in_stream)
+        if args.operation == 'expand':
+            converted = (index.expand_entity(e) for e in entities)
+        else:
+            ld_context = args.ld_context.split(',') if args.ld_context else None
+            converted = (index.compact_entity(e, ld_context) for e in entities)
+        count = write_entities(converted, out_stream)
+    finally:
+        close_stream(in_stream)
+        close_stream(out_stream)
+
+    report_throughput(count, start)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(prog='ld_terms')
+    parser.add_argument('operation', choices=['expand', 'compact'])
+    parser.add_argument('file', help='NDJSON or JSON array of NGSI-LD entities (\'-\' for stdin)')
+    parser.add_argument('-o', '--output', default='-', help='output NDJSON file (default: stdout)')
+    parser.add_argument('--context', action='append',
+                        help='@context file to index (default: context.jsonld and full-context.jsonld)')
+    parser.add_argument('--cache', default='ld_terms.idx', help='binary cache of the index')
+    parser.add_argument('--ld-context', help='@context (comma separated) added to compacted entities')
+
+    main(parser.parse_args())
@@ -9,6 +9,9 @@ context.jsonld is combined by extracting the properties, types and  enumerations
 converting them into terms of a JSON-LD @Context. mapping_list.yml uses the result of extracting
 to prepare a list of terms with schemas and specifications.
 
+The generation can also be embedded: generate_ld_context() returns the @context, the terms list
+and the alerts as values, without any global state, parsing the schemas in a pool of processes.
+
 Copyright (c) 2019 FIWARE Foundation e.V.
 
 Authors: José M. Cantera, Dmitrii Demin
@@ -17,22 +20,16 @@ Authors: José M. Cantera, Dmitrii Demin
 import json
 import yaml
 import os
+import hashlib
 from datetime import datetime, timezone
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
 
-# The aggregated @context will be stored here
-aggregated_context = {
-}
-
-# The list of mappings (term->schema/specification) will be stored here
-terms_list = {
-    "terms": {}
-}
+# Bumped whenever the extraction logic changes, invalidating the extraction cache
+EXTRACTION_VERSION = 1
 
-# The list of terms alerts will be stored here (if the specification file
-# associated with the term doesn't exist)
-alert_list = [
-]
+# libyaml makes dumping the terms list much faster, same output
+yaml_dumper = getattr(yaml, 'CDumper', yaml.Dumper)
 
 # Template to prepare a valid URL of a schema for a term mapping
 schema_url = 'https://fiware.github.io/data-models/{}'
@@ -60,7 +57,7 @@ def write_json(data, outfile):
 
 def write_yaml(data, outfile):
     with open(outfile, 'w') as data_file:
-        data_file.write(yaml.dump(data))
+        data_file.write(yaml.dump(data, Dumper=yaml_dumper))
 
 
 # Finds a node in a JSON Schema
@@ -68,32 +65,51 @@ def write_yaml(data, outfile):
 
 
 def find_node(schema, node_name):
-    result = None
+    return index_nodes(schema, (node_name,)).get(node_name)
+
+
+# Finds, in a single traversal, the first node of each of the names given,
+# in the same order find_node would find them. Returns a dictionary
+# name -> node which only contains the names found
+def index_nodes(schema, node_names, out=None):
+    if out is None:
+        out = {}
 
     if isinstance(schema, list):
         for instance in schema:
-            res = find_node(instance, node_name)
-            if res is not None:
-                result = res
+            index_nodes(instance, node_names, out)
+            if len(out) == len(node_names):
                 break
     elif isinstance(schema, dict):
         for member in schema:
-            if member == node_name:
-                result = schema[member]
+            if member in node_names and member not in out and schema[member] is not None:
+                out[member] = schema[member]
+            index_nodes(schema[member], node_names, out)
+            if len(out) == len(node_names):
                 break
-            else:
-                res = find_node(schema[member], node_name)
-                if res is not None:
-                    result = res
-                    break
 
-    return result
+    return out
+
+
+# Indexes once all what is needed from a schema to generate its @context:
+# the properties dictionary and, for each property, its '$ref', 'enum' and 'format'
+def index_schema(schema):
+    index = {
+        'properties': find_node(schema, 'properties'),
+        'members': {}
+    }
+
+    if index['properties'] is not None:
+        for p in index['properties']:
+            index['members'][p] = index_nodes(index['properties'][p], ('$ref', 'enum', 'format'))
+
+    return index
 
 
 # extracts the properties dictionary
 # A list of dictionaries is returned
-def extract_properties(schema):
-    properties = find_node(schema, 'properties')
+def extract_properties(index):
+    properties = index['properties']
 
     out = []
 
@@ -102,19 +118,20 @@ def extract_properties(schema):
 
     for p in properties:
         if p != "type" and p != "id":
+            members = index['members'][p]
             prop = dict()
             prop['type'] = 'Property'
             prop['name'] = p
 
-            ref = find_node(properties[p], '$ref')
+            ref = members.get('$ref')
             if ref is not None and ref == ENTITY_ID:
                 prop['type'] = 'Relationship'
 
-            enum = find_node(properties[p], 'enum')
+            enum = members.get('enum')
             if enum is not None:
                 prop['isEnumerated'] = True
 
-            pformat = find_node(properties[p], 'format')
+            pformat = members.get('format')
             if pformat is not None and pformat == 'date-time':
                 prop['isDate'] = True
 
@@ -124,10 +141,10 @@ def extract_properties(schema):
 
 
 # extracts the entity type
-def extract_entity_type(schema):
+def extract_entity_type(index):
     out = None
 
-    properties = find_node(schema, 'properties')
+    properties = index['properties']
 
     if properties is not None and 'type' in properties:
         type_node = properties['type']
@@ -139,18 +156,17 @@ def extract_entity_type(schema):
 
 
 # extracts the enumerations
-def extract_enumerations(schema):
+def extract_enumerations(index):
     out = []
 
-    properties = find_node(schema, 'properties')
+    properties = index['properties']
 
     if properties is None:
         return out
 
     for p in properties:
         if p != 'type':
-            prop = properties[p]
-            enum = find_node(prop, 'enum')
+            enum = index['members'][p].get('enum')
             if enum is not None:
                 if isinstance(enum, list):
                     for item in enum:
@@ -215,9 +231,11 @@ def generate_ld_context_enums(properties, uri_prefix, predefined_mappings):
 
 # Extracts from the schema the relevant JSON-LD @context
 def schema_2_ld_context(schema, uri_prefix, predefined_mappings):
-    properties = extract_properties(schema)
-    entity_type = extract_entity_type(schema)
-    enumerations = extract_enumerations(schema)
+    index = index_schema(schema)
+
+    properties = extract_properties(index)
+    entity_type = extract_entity_type(index)
+    enumerations = extract_enumerations(index)
 
     ld_context = dict()
 
@@ -235,46 +253,205 @@ def schema_2_ld_context(schema, uri_prefix, predefined_mappings):
     return ld_context
 
 
-def process_file(input_file, uri_prefix, predefined_mappings, terms_mappings):
+# Lists the schema files of a folder, in a deterministic order
+def find_schemas(input_file):
+    out = []
+
     if os.path.isfile(input_file) and input_file.endswith('schema.json'):
-        print(input_file)
-        aggregate_ld_context(
-            input_file,
-            uri_prefix,
-            predefined_mappings,
-            terms_mappings)
+        out.append(input_file)
     elif os.path.isdir(input_file):
-        for f in (os.listdir(input_file)):
-            process_file(os.path.join(input_file, f),
-                         uri_prefix, predefined_mappings, terms_mappings)
+        for f in sorted(os.listdir(input_file)):
+            out.extend(find_schemas(os.path.join(input_file, f)))
 
+    return out
 
-def aggregate_ld_context(f, uri_prefix, predefined_mappings, terms_mappings):
-    global aggregated_context
-    global terms_list
-    global alert_list
 
-    schema = read_json(f)
-    ld_context = schema_2_ld_context(schema, uri_prefix, predefined_mappings)
+def file_hash(f):
+    with open(f, 'rb') as data_file:
+        return hashlib.sha256(data_file.read()).hexdigest()
 
-    for t in ld_context:
-        for p in ld_context[t]:
-            aggregated_context[p] = ld_context[t][p]
 
-            # adding related specifications and schemas
-            if p not in terms_list['terms']:
-                terms_list['terms'][p] = {'specifications': list(),
-                                          'schemas': list(),
-                                          'type': t}
+# Parses a schema and extracts its @context (runs in the worker processes)
+def extract_schema(f, uri_prefix, predefined_mappings):
+    with open(f, 'rb') as data_file:
+        content = data_file.read()
 
-            terms_list['terms'][p]['schemas'].append(
-                schema_url.format(f.split('../')[1]))
+    schema = json.loads(content.decode('utf-8'))
 
-            file_to_add = find_file(f, terms_mappings)
-            if file_to_add:
-                terms_list['terms'][p]['specifications'].append(file_to_add)
-            else:
-                alert_list.append(f)
+    return {
+        'hash': hashlib.sha256(content).hexdigest(),
+        'ld_context': schema_2_ld_context(schema, uri_prefix, predefined_mappings)
+    }
+
+
+# Merges the @context extracted from each schema, in the order given
+# (the schemas found later win, except for the typed terms).
+# Returns the aggregated @context, the terms list and the alerts
+# (schemas whose specification file doesn't exist)
+def merge_ld_contexts(extractions, terms_mappings):
+    aggregated_context = {}
+    terms_list = {
+        'terms': {}
+    }
+    alert_list = []
+
+    for f, ld_context in extractions:
+        # The same schema and specification apply to all the terms of the file
+        schema_to_add = schema_url.format(f.split('../')[1])
+        file_to_add = find_file(f, terms_mappings)
+
+        for t in ld_context:
+            for p in ld_context[t]:
+                # A term typed by some schema (e.g. as a date or a relationship)
+                # keeps that definition whatever the order of the schemas is
+                if not isinstance(aggregated_context.get(p), dict) or isinstance(ld_context[t][p], dict):
+                    aggregated_context[p] = ld_context[t][p]
+
+                # adding related specifications and schemas
+                if p not in terms_list['terms']:
+                    terms_list['terms'][p] = {'specifications': list(),
+                                              'schemas': list(),
+                                              'type': t}
+
+                terms_list['terms'][p]['schemas'].append(schema_to_add)
+
+                if file_to_add:
+                    terms_list['terms'][p]['specifications'].append(file_to_add)
+                else:
+                    alert_list.append(f)
+
+    return aggregated_context, terms_list, alert_list
+
+
+# Generates the @context of all the schemas under a folder.
+# cache (see new_extraction_cache) keeps the extraction results between calls,
+# so only the schemas whose content changed are parsed again.
+# Schemas are parsed by a pool of 'workers' processes (1 means in-process).
+# schemas is the list of find_schemas(folder), if the caller already has it
+def extract_ld_contexts(folder, uri_prefix, predefined_mappings, cache=None, workers=None, schemas=None):
+    if cache is None or cache['settings'] != extraction_settings(uri_prefix, predefined_mappings):
+        cache = new_extraction_cache(uri_prefix, predefined_mappings)
+
+    if schemas is None:
+        schemas = find_schemas(folder)
+    cached = cache['files']
+    results = {}
+    pending = []
+
+    for f in schemas:
+        if f in cached and cached[f]['hash'] == file_hash(f):
+            results[f] = cached[f]
+        else:
+            pending.append(f)
+
+    if len(pending) > 1 and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            extracted = list(executor.map(extract_schema, pending,
+                                          [uri_prefix] * len(pending),
+                                          [predefined_mappings] * len(pending)))
+    else:
+        extracted = [extract_schema(f, uri_prefix, predefined_mappings) for f in pending]
+
+    for f, result in zip(pending, extracted):
+        results[f] = result
+
+    # Schemas no longer present are dropped from the cache
+    cache['files'] = results
+
+    return [(f, results[f]['ld_context']) for f in schemas]
+
+
+# Extracts (see extract_ld_contexts) and merges the @context of the schemas
+# under a folder. Returns the aggregated @context, the terms list and the alerts
+def generate_ld_context(folder, uri_prefix, predefined_mappings, terms_mappings,
+                        cache=None, workers=None):
+    extractions = extract_ld_contexts(folder, uri_prefix, predefined_mappings, cache, workers)
+
+    return merge_ld_contexts(extractions, terms_mappings)
+
+
+# The domain of a schema is the first folder of its path (e.g. Weather)
+def schema_domain(folder, f):
+    parts = os.path.relpath(f, folder).split(os.sep)
+
+    if len(parts) > 1:
+        return parts[0]
+
+    return os.path.basename(os.path.abspath(folder))
+
+
+# Splits the aggregated @context by domain. The terms used by more than one
+# domain go to a shared core. Returns the core, a dictionary domain -> terms
+# and a dictionary entity type -> domain
+def split_ld_context(folder, extractions, aggregated_context):
+    term_domains = {}
+    entity_types = {}
+
+    for f, ld_context in extractions:
+        domain = schema_domain(folder, f)
+
+        for t in ld_context:
+            for p in ld_context[t]:
+                term_domains.setdefault(p, set()).add(domain)
+
+        for entity_type in ld_context['Entity Type']:
+            entity_types[entity_type] = domain
+
+    core = {}
+    domains = {}
+
+    for p in aggregated_context:
+        if len(term_domains[p]) > 1:
+            core[p] = aggregated_context[p]
+        else:
+            domains.setdefault(next(iter(term_domains[p])), {})[p] = aggregated_context[p]
+
+    return core, domains, entity_types
+
+
+# Writes the core @context, one @context per domain importing the core and
+# a manifest entity type -> @context. base_url prefixes the file names
+def write_split_context_files(output_folder, core, domains, entity_types, base_url=''):
+    os.makedirs(output_folder, exist_ok=True)
+
+    generated_at = datetime.now(timezone.utc).replace(microsecond=0).isoformat()
+    core_file = 'core-context.jsonld'
+
+    write_json({
+        '@context': core,
+        'generatedAt': generated_at
+    }, os.path.join(output_folder, core_file))
+
+    manifest = {
+        'core': base_url + core_file,
+        'domains': {},
+        'entityTypes': {}
+    }
+
+    for domain in domains:
+        domain_file = domain + '-context.jsonld'
+        domain_context = {
+            '@version': 1.1,
+            '@import': base_url + core_file
+        }
+        domain_context.update(domains[domain])
+
+        write_json({
+            '@context': domain_context,
+            'generatedAt': generated_at
+        }, os.path.join(output_folder, domain_file))
+
+        manifest['domains'][domain] = base_url + domain_file
+
+    for entity_type in entity_types:
+        domain = entity_types[entity_type]
+        # A domain may only contribute shared terms
+        manifest['entityTypes'][entity_type] = manifest['domains'].get(domain, manifest['core'])
+
+    write_json(manifest, os.path.join(output_folder, 'context-manifest.json'))
+
+    print('writing split LD @context... core size: ' + str(len(core)) +
+          ' domains: ' + str(len(domains)))
 
 
 # Finds the specification file associated with the term
@@ -302,7 +479,52 @@ def find_file(f, terms_mappings):
         pass
 
 
-def write_context_file():
+def extraction_settings(uri_prefix, predefined_mappings):
+    return {
+        'version': EXTRACTION_VERSION,
+        'uri_prefix': uri_prefix,
+        'mappings': hashlib.sha256(json.dumps(predefined_mappings, sort_keys=True)
+                                   .encode('utf-8')).hexdigest()
+    }
+
+
+# Extraction results, keyed by schema file, which are reused as long as the
+# content hash of the schema doesn't change. Only valid for the same URI prefix,
+# predefined mappings and extraction logic
+def new_extraction_cache(uri_prefix, predefined_mappings):
+    return {
+        'settings': extraction_settings(uri_prefix, predefined_mappings),
+        'files': {}
+    }
+
+
+def load_extraction_cache(cache_file, uri_prefix, predefined_mappings):
+    cached = None
+    if cache_file and os.path.isfile(cache_file):
+        try:
+            cached = read_json(cache_file)
+        except ValueError:
+            cached = None
+
+    if cached is not None and cached.get('settings') == extraction_settings(uri_prefix, predefined_mappings):
+        return cached
+
+    return new_extraction_cache(uri_prefix, predefined_mappings)
+
+
+def save_extraction_cache(cache, cache_file):
+    tmp_file = cache_file + '.tmp'
+    with open(tmp_file, 'w') as data_file:
+        data_file.write(json.dumps(cache))
+    os.replace(tmp_file, cache_file)
+
+
+def output_hash(aggregated_context, terms_list):
+    return hashlib.sha256(json.dumps([aggregated_context, terms_list], sort_keys=True)
+                          .encode('utf-8')).hexdigest()
+
+
+def write_context_file(aggregated_context, terms_list):
     print('writing LD @context...' + ' size: ' + str(len(aggregated_context)))
 
     ld_context = {
@@ -320,9 +542,29 @@ def main(args):
     predefined_mappings = read_json('ldcontext_mappings.json')
     terms_mappings = read_json('ldcontext_terms_mappings.json')
 
-    process_file(args.f, uri_prefix, predefined_mappings, terms_mappings)
+    cache = load_extraction_cache(None if args.rebuild else args.cache, uri_prefix, predefined_mappings)
+    previous_output = cache.get('output')
+
+    schemas = find_schemas(args.f)
+    print("\n".join(schemas))
+
+    extractions = extract_ld_contexts(args.f, uri_prefix, predefined_mappings, cache, args.workers, schemas)
+    aggregated_context, terms_list, alert_list = merge_ld_contexts(extractions, terms_mappings)
+
+    current_output = output_hash(aggregated_context, terms_list)
+    if current_output == previous_output and os.path.isfile('context.jsonld') \
+            and os.path.isfile('terms_list.yml'):
+        print('LD @context is up to date' + ' size: ' + str(len(aggregated_context)))
+    else:
+        write_context_file(aggregated_context, terms_list)
+
+    if args.split:
+        core, domains, entity_types = split_ld_context(args.f, extractions, aggregated_context)
+        write_split_context_files(args.split, core, domains, entity_types, args.split_base)
 
-    write_context_file()
+    if args.cache:
+        cache['output'] = current_output
+        save_extraction_cache(cache, args.cache)
 
     print("specification file was  not found for this files")
     print("\n".join(sorted(set(alert_list))))
@@ -333,6 +575,16 @@ if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument('-f', required=True, help='folder')
     parser.add_argument('-u', required=True, help='URI prefix')
+    parser.add_argument('--cache', default='ldcontext_cache.json',
+                        help='file keeping the extraction results of each schema between runs')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='ignore the cache and extract every schema again')
+    parser.add_argument('--split',
+                        help='folder where a @context per domain, importing a shared core, is also written')
+    parser.add_argument('--split-base', default='',
+                        help='URL the split @context files are served from (used in @import and the manifest)')
+    parser.add_argument('--workers', type=int,
+                        help='amount of processes parsing the schemas (1 to parse in-process)')
 
     arguments = parser.parse_args()
 
@@ -11,13 +11,25 @@ Author: José Manuel Cantera
 
 """
 
-import sys
+import os
 import json
+import hashlib
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 
 from rfc3987 import parse
-from entity_print import print_json_string
+from entity_print import write_entity
+from context_store import etsi_core_context
 
-etsi_core_context = 'https://uri.etsi.org/ngsi-ld/v1/ngsi-ld-core-context.jsonld'
+# Target @context used for the examples of the specs
+default_ld_context = 'https://schema.lab.fiware.org/ld/context'
+
+# The converter and the modules of this folder it imports
+converter_files = ('normalized2LD.py', 'entity_print.py', 'context_store.py')
+
+corpus_input = 'example-normalized.json'
+corpus_output = 'example-normalized-ld.jsonld'
 
 
 def ngsild_uri(type_part, id_part):
@@ -26,36 +38,47 @@ def ngsild_uri(type_part, id_part):
     return template.format(type_part, id_part)
 
 
-# Generates an Entity Id as a URI
-def ld_id(entity_id, entity_type):
-    out = entity_id
+# Relationship targets and Entity Ids repeat a lot across a corpus,
+# so URI classification results are memoized (bounded LRU)
+URI_CACHE_SIZE = 1 << 16
+
+ld_uri_schemes = ('urn:', 'http:', 'https:')
+
+
+# Tells whether a string is a URI that can be kept as is
+def is_ld_uri(value):
+    # Cheap check first, the full RFC 3987 parse is expensive
+    if not value.startswith(ld_uri_schemes):
+        return False
+
     try:
-        d = parse(entity_id, rule='URI')
-        scheme = d['scheme']
-        if scheme != 'urn' and scheme != 'http' and scheme != 'https':
-            raise ValueError
+        parse(value, rule='URI')
     except ValueError:
-        out = ngsild_uri(entity_type, entity_id)
+        return False
+
+    return True
 
-    return out
+
+# Generates an Entity Id as a URI
+@lru_cache(maxsize=URI_CACHE_SIZE)
+def ld_id(entity_id, entity_type):
+    if is_ld_uri(entity_id):
+        return entity_id
+
+    return ngsild_uri(entity_type, entity_id)
 
 
 # Generates a Relationship's object as a URI
+@lru_cache(maxsize=URI_CACHE_SIZE)
 def ld_object(attribute_name, entity_id):
-    out = entity_id
-    try:
-        d = parse(entity_id, rule='URI')
-        scheme = d['scheme']
-        if scheme != 'urn' and scheme != 'http' and scheme != 'https':
-            raise ValueError
-    except ValueError:
-        entity_type = ''
-        if attribute_name.startswith('ref'):
-            entity_type = attribute_name[3:]
+    if is_ld_uri(entity_id):
+        return entity_id
 
-        out = ngsild_uri(entity_type, entity_id)
+    entity_type = ''
+    if attribute_name.startswith('ref'):
+        entity_type = attribute_name[3:]
 
-    return out
+    return ngsild_uri(entity_type, entity_id)
 
 
 # Do all the transformation work
@@ -146,19 +169,142 @@ def read_json(infile):
 
 def write_json(data, outfile):
     with open(outfile, 'w') as data_file:
-        data_file.write(print_json_string(data))
+        write_entity(data, data_file)
         data_file.write("\n")
 
 
-def main(args):
-    data = read_json(args[1])
-    result = normalized_2_LD(data, args[3])
-    write_json(result, args[2])
+# Converts one file, returns None on success or the error found
+def convert_file(infile, outfile, ld_context_uri):
+    try:
+        data = read_json(infile)
+        result = normalized_2_LD(data, ld_context_uri)
+        write_json(result, outfile)
+    except Exception as e:
+        return '{}: {}'.format(type(e).__name__, e)
 
+    return None
 
-if __name__ == '__main__':
-    if len(sys.argv) != 4:
+
+def file_hash(path):
+    with open(path, 'rb') as data_file:
+        return hashlib.sha256(data_file.read()).hexdigest()
+
+
+# Changes in the converter itself, or in the modules of this folder it
+# imports, invalidate the whole manifest
+def converter_hash():
+    h = hashlib.sha256()
+    tools_folder = os.path.dirname(os.path.abspath(__file__))
+
+    for f in converter_files:
+        with open(os.path.join(tools_folder, f), 'rb') as data_file:
+            h.update(data_file.read())
+
+    return h.hexdigest()
+
+
+def find_corpus(specs_folder):
+    out = []
+
+    for dir_path, dir_names, file_names in os.walk(specs_folder):
+        dir_names.sort()
+        if corpus_input in file_names:
+            out.append(dir_path)
+
+    return out
+
+
+def read_manifest(manifest_file):
+    try:
+        return read_json(manifest_file)
+    except (IOError, ValueError):
+        return {}
+
+
+def write_manifest(manifest, manifest_file):
+    tmp_file = manifest_file + '.tmp'
+    with open(tmp_file, 'w') as data_file:
+        data_file.write(json.dumps(manifest, indent=4, sort_keys=True))
+        data_file.write("\n")
+    os.replace(tmp_file, manifest_file)
+
+
+# Regenerates every example-normalized-ld.jsonld under the specs folder
+# whose input, target @context or converter changed since the last run
+def convert_corpus(specs_folder, ld_context_uri, manifest_file, workers=None, force=False):
+    manifest = read_manifest(manifest_file)
+    converter = converter_hash()
+
+    if manifest.get('converter') != converter:
+        manifest = {}
+
+    entries = manifest.get('files', {})
+    pending = []
+    skipped = 0
+
+    for folder in find_corpus(specs_folder):
+        infile = os.path.join(folder, corpus_input)
+        outfile = os.path.join(folder, corpus_output)
+        key = os.path.relpath(infile, specs_folder)
+        entry = {'hash': file_hash(infile), 'context': ld_context_uri}
+
+        if not force and entries.get(key) == entry and os.path.isfile(outfile):
+            skipped += 1
+            continue
+
+        pending.append((key, infile, outfile, entry))
+
+    errors = []
+    if len(pending) > 0:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(convert_file,
+                                   [p[1] for p in pending],
+                                   [p[2] for p in pending],
+                                   [ld_context_uri] * len(pending),
+                                   chunksize=max(1, len(pending) // (4 * (workers or os.cpu_count() or 1))))
+
+            for (key, infile, outfile, entry), error in zip(pending, results):
+                if error is None:
+                    entries[key] = entry
+                else:
+                    entries.pop(key, None)
+                    errors.append((infile, error))
+
+    write_manifest({'converter': converter, 'files': entries}, manifest_file)
+
+    print('converted: {} skipped: {} failed: {}'.format(
+        len(pending) - len(errors), skipped, len(errors)))
+    for infile, error in errors:
+        print('{} -> {}'.format(infile, error))
+
+    return len(errors) == 0
+
+
+def main(args):
+    if args.corpus:
+        ok = convert_corpus(args.corpus, args.context or default_ld_context,
+                            args.manifest, args.workers, args.force)
+        exit(0 if ok else 1)
+
+    if len(args.files) != 3:
         print("Usage: normalized2LD [input file] [output file] [target ld_context]")
+        print("       normalized2LD --corpus [specs folder] [--context target ld_context]")
         exit(-1)
 
-    main(sys.argv)
+    data = read_json(args.files[0])
+    result = normalized_2_LD(data, args.files[2])
+    write_json(result, args.files[1])
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(prog='normalized2LD')
+    parser.add_argument('files', nargs='*', help='[input file] [output file] [target ld_context]')
+    parser.add_argument('--corpus', help='specs folder whose examples are (re)generated')
+    parser.add_argument('--context', help='target ld_context in corpus mode (default: {})'.format(
+        default_ld_context))
+    parser.add_argument('--manifest', default='ld_manifest.json',
+                        help='file recording the examples already generated')
+    parser.add_argument('--workers', type=int, help='amount of worker processes')
+    parser.add_argument('--force', action='store_true', help='regenerate every example')
+
+    main(parser.parse_args())
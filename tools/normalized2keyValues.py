@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+
+Converts an NGSI v2 Normalized Representation into the Simplified
+Representation (a.k.a. keyValues)
+
+Copyright (c) 2026 FIWARE Foundation e.V.
+
+"""
+
+import json
+import time
+from argparse import ArgumentParser
+
+from entity_print import write_entity
+from entity_stream import read_batches, write_entities, open_stream, close_stream, \
+    report_throughput
+
+# Entities converted at once in stream mode
+BATCH_SIZE = 1000
+
+
+def normalized_2_keyValues(entity):
+    out = {}
+
+    for key in entity:
+        attr = entity[key]
+
+        if key == 'id' or key == 'type' or not isinstance(attr, dict) or 'value' not in attr:
+            out[key] = attr
+        else:
+            out[key] = attr['value']
+
+    return out
+
+
+def normalized_2_keyValues_batch(entities):
+    return [normalized_2_keyValues(e) for e in entities]
+
+
+def read_json(infile):
+    with open(infile) as data_file:
+        data = json.loads(data_file.read())
+
+    return data
+
+
+def write_json(data, outfile):
+    with open(outfile, 'w') as data_file:
+        write_entity(data, data_file)
+        data_file.write("\n")
+
+
+# Converts a stream of normalized entities (NDJSON or JSON array)
+# into keyValues entities written as NDJSON
+def convert_stream(infile, outfile, batch_size=BATCH_SIZE):
+    start = time.perf_counter()
+
+    in_stream = open_stream(infile)
+    out_stream = open_stream(outfile, 'w')
+    count = 0
+
+    try:
+        for batch in read_batches(in_stream, batch_size):
+            count += write_entities(normalized_2_keyValues_batch(batch), out_stream)
+    finally:
+        close_stream(in_stream)
+        close_stream(out_stream)
+
+    report_throughput(count, start)
+
+
+def main(args):
+    if args.stream:
+        convert_stream(args.file, args.output or '-', args.batch_size)
+    else:
+        data = read_json(args.file)
+        result = normalized_2_keyValues(data)
+        write_json(result, args.output or 'example.json')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(prog='normalized2keyValues')
+    parser.add_argument('file', help='input file (\'-\' for stdin in stream mode)')
+    parser.add_argument('-o', '--output',
+                        help='output file (default: example.json, or stdout in stream mode)')
+    parser.add_argument('-s', '--stream', action='store_true',
+                        help='read NDJSON or a JSON array incrementally and write NDJSON')
+    parser.add_argument('-b', '--batch-size', type=int, default=BATCH_SIZE,
+                        help='entities converted at once in stream mode')
+
+    main(parser.parse_args())
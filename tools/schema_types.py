@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+
+Derives, for each Entity Type, a table attribute -> NGSI attribute type
+(DateTime, Relationship, Number, StructuredValue, geo:json...) from the
+JSON Schemas of the Data Models. The tables are cached on disk and only
+rebuilt when a schema changes
+
+Copyright (c) 2026 FIWARE Foundation e.V.
+
+"""
+
+import os
+import json
+
+# Base URL of the schemas, which is mapped to the root folder of the repository
+schemas_base_urls = [
+    'https://fiware.github.io/data-models/',
+    'https://fiware.github.io/dataModels/'
+]
+
+ENTITY_ID = 'EntityIdentifierType'
+
+CACHE_VERSION = 1
+
+# JSON Schema primitive types and their NGSI counterparts
+primitive_types = {
+    'number': 'Number',
+    'integer': 'Number',
+    'string': 'Text',
+    'boolean': 'Boolean',
+    'object': 'StructuredValue',
+    'array': 'StructuredValue'
+}
+
+# Attributes whose NGSI type does not depend on the schema
+well_known_types = {
+    'location': 'geo:json',
+    'address': 'PostalAddress'
+}
+
+
+# Guesses the NGSI type of an attribute from its name
+def guess_attribute_type(key):
+    if key == 'location':
+        return 'geo:json'
+
+    if key.startswith('date'):
+        return 'DateTime'
+
+    if key == 'address':
+        return 'PostalAddress'
+
+    if key.startswith('ref') or key.startswith('has'):
+        return 'Relationship'
+
+    return None
+
+
+class SchemaResolver:
+    def __init__(self, root):
+        self.root = root
+        self.documents = {}
+
+    def load(self, path):
+        path = os.path.normpath(path)
+
+        if path not in self.documents:
+            try:
+                with open(path) as data_file:
+                    self.documents[path] = json.loads(data_file.read())
+            except (IOError, ValueError):
+                self.documents[path] = None
+
+        return self.documents[path]
+
+    # Returns the (node, document path) pointed by a $ref,
+    # or (None, None) if it cannot be resolved locally
+    def resolve(self, ref, doc_path):
+        location, _, fragment = ref.partition('#')
+
+        if location.startswith('/'):
+            # Some schemas use '/definitions/...' meaning a local pointer
+            fragment = location
+            location = ''
+
+        if location == '':
+            target_path = doc_path
+        else:
+            target_path = None
+            for base in schemas_base_urls:
+                if location.startswith(base):
+                    target_path = os.path.join(self.root, location[len(base):])
+                    break
+
+        if target_path is None:
+            return None, None
+
+        node = self.load(target_path)
+        for part in fragment.split('/'):
+            if part == '':
+                continue
+            if not isinstance(node, dict) or part not in node:
+                return None, None
+            node = node[part]
+
+        return node, target_path
+
+
+# Maps a JSON Schema (sub)node describing an attribute to an NGSI type
+def ngsi_type(node, doc_path, resolver, depth=0):
+    if not isinstance(node, dict) or depth > 16:
+        return None
+
+    if '$ref' in node:
+        ref = node['$ref']
+        if ref.endswith(ENTITY_ID):
+            return 'Relationship'
+        if 'geojson' in ref.lower():
+            return 'geo:json'
+
+        target, target_path = resolver.resolve(ref, doc_path)
+        return ngsi_type(target, target_path, resolver, depth + 1)
+
+    if node.get('format') == 'date-time':
+        return 'DateTime'
+
+    json_type = node.get('type')
+
+    if isinstance(json_type, list):
+        # e.g. ["number", "null"]
+        json_types = [t for t in json_type if t != 'null']
+        json_type = json_types[0] if len(json_types) == 1 else None
+
+    if json_type == 'array' and 'items' in node:
+        if ngsi_type(node['items'], doc_path, resolver, depth + 1) == 'Relationship':
+            return 'Relationship'
+
+    if isinstance(json_type, str) and json_type in primitive_types:
+        return primitive_types[json_type]
+
+    for keyword in ('oneOf', 'anyOf', 'allOf'):
+        if keyword in node and isinstance(node[keyword], list):
+            alternatives = set(ngsi_type(n, doc_path, resolver, depth + 1) for n in node[keyword])
+            # Only unambiguous alternatives give a type
+            if len(alternatives) == 1:
+                return alternatives.pop()
+            return None
+
+    return None
+
+
+# Collects the properties of a JSON Schema following allOf / anyOf / oneOf
+# and $ref. The result maps property name -> (node, document path)
+def collect_properties(node, doc_path, resolver, out, depth=0):
+    if not isinstance(node, dict) or depth > 16:
+        return out
+
+    if '$ref' in node:
+        target, target_path = resolver.resolve(node['$ref'], doc_path)
+        return collect_properties(target, target_path, resolver, out, depth + 1)
+
+    if isinstance(node.get('properties'), dict):
+        for p in node['properties']:
+            out[p] = (node['properties'][p], doc_path)
+
+    for keyword in ('allOf', 'anyOf', 'oneOf'):
+        if isinstance(node.get(keyword), list):
+            for sub_node in node[keyword]:
+                collect_properties(sub_node, doc_path, resolver, out, depth + 1)
+
+    return out
+
+
+# Builds the table attribute -> NGSI type of one schema.
+# Returns (entity type, table), entity type being None if not declared
+def schema_type_table(schema_path, resolver):
+    schema = resolver.load(schema_path)
+    properties = collect_properties(schema, os.path.normpath(schema_path), resolver, {})
+
+    entity_type = None
+    type_node = properties.get('type', (None, None))[0]
+    if isinstance(type_node, dict) and type_node.get('enum'):
+        entity_type = type_node['enum'][0]
+
+    table = {}
+    for p in properties:
+        if p == 'id' or p == 'type':
+            continue
+
+        if p in well_known_types:
+            table[p] = well_known_types[p]
+            continue
+
+        node, node_path = properties[p]
+        t = ngsi_type(node, node_path, resolver)
+
+        # A plain string in the schema says less than the naming conventions
+        if t is None or t == 'Text':
+            t = guess_attribute_type(p) or t
+
+        if t is not None:
+            table[p] = t
+
+    return entity_type, table
+
+
+def find_schemas(specs_folder):
+    out = []
+
+    for dir_path, dir_names, file_names in os.walk(specs_folder):
+        dir_names.sort()
+        if 'schema.json' in file_names:
+            out.append(os.path.join(dir_path, 'schema.json'))
+
+    return out
+
+
+# Fingerprint (path, mtime, size) of every JSON file that may be referenced
+def schemas_fingerprint(specs_folder):
+    root = os.path.dirname(os.path.abspath(specs_folder))
+    out = []
+
+    for folder in (root, os.path.abspath(specs_folder)):
+        for dir_path, dir_names, file_names in os.walk(folder):
+            dir_names.sort()
+            for f in sorted(file_names):
+                if f.endswith('schema.json'):
+                    st = os.stat(os.path.join(dir_path, f))
+                    out.append([os.path.relpath(os.path.join(dir_path, f), root),
+                                st.st_mtime_ns, st.st_size])
+            if folder == root:
+                break
+
+    return out
+
+
+# Builds the tables entity type -> {attribute -> NGSI type}
+def build_type_tables(specs_folder):
+    resolver = SchemaResolver(os.path.dirname(os.path.abspath(specs_folder)))
+    tables = {}
+
+    for schema_path in find_schemas(specs_folder):
+        entity_type, table = schema_type_table(os.path.abspath(schema_path), resolver)
+        if entity_type is not None:
+            tables[entity_type] = table
+
+    return tables
+
+
+# Returns the type tables, reusing the on-disk cache while no schema changed
+def load_type_tables(specs_folder, cache_file=None):
+    fingerprint = schemas_fingerprint(specs_folder)
+
+    if cache_file and os.path.isfile(cache_file):
+        try:
+            with open(cache_file) as data_file:
+                cached = json.loads(data_file.read())
+            if cached.get('version') == CACHE_VERSION and cached.get('fingerprint') == fingerprint:
+                return cached['types']
+        except ValueError:
+            pass
+
+    tables = build_type_tables(specs_folder)
+
+    if cache_file:
+        with open(cache_file, 'w') as data_file:
+            data_file.write(json.dumps({
+                'version': CACHE_VERSION,
+                'fingerprint': fingerprint,
+                'types': tables
+            }))
+
+    return tables
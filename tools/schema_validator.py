@@ -0,0 +1,544 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+
+Validates NGSI Entities (key-values) against the JSON Schemas of the Data
+Models without leaving Python. The schema of every Entity Type under specs
+is compiled once into Python code (fastjsonschema), resolving the $refs to
+common-schema.json, geometry-schema.json and the domain schemas from the
+local copies. The compiled code is cached on disk and only regenerated
+when a schema changes
+
+Copyright (c) 2026 FIWARE Foundation e.V.
+
+"""
+
+import os
+import sys
+import json
+import time
+import pickle
+import marshal
+import hashlib
+from argparse import ArgumentParser
+from urllib.parse import urljoin, urldefrag
+from concurrent.futures import ProcessPoolExecutor
+
+import fastjsonschema
+from fastjsonschema.ref_resolver import RefResolver
+
+from schema_types import schemas_base_urls, SchemaResolver, collect_properties, \
+    find_schemas, schemas_fingerprint
+from entity_stream import read_entities, open_stream, close_stream, report_throughput
+
+CACHE_VERSION = 2
+
+# Schemas referenced by the Data Models which are not under the base URLs
+external_schemas = {
+    'http://geojson.org/schema/Geometry.json': 'geometry-schema.json'
+}
+
+
+# Loads the schemas referenced by URL from the repository, once. The $refs
+# are normalized so that they can be resolved by fastjsonschema
+class SchemaLibrary:
+    def __init__(self, root):
+        self.root = root
+        self.documents = {}
+        # URL -> {anchor name -> JSON pointer}
+        self.anchors = {}
+
+    def url_to_path(self, url):
+        if url in external_schemas:
+            return os.path.join(self.root, external_schemas[url])
+
+        for base in schemas_base_urls:
+            if url.startswith(base):
+                return os.path.join(self.root, url[len(base):])
+
+        return None
+
+    def load(self, url):
+        url = urldefrag(url)[0]
+
+        if url not in self.documents:
+            path = self.url_to_path(url)
+            if path is None or not os.path.isfile(path):
+                raise fastjsonschema.JsonSchemaDefinitionException(
+                    'Schema not available locally: ' + url)
+
+            with open(path) as data_file:
+                document = json.loads(data_file.read())
+
+            # Registered before normalizing so that cyclic $refs terminate
+            self.documents[url] = document
+            self.prepare(document, url)
+
+        return self.documents[url]
+
+    # Normalizes in place a schema document retrieved from url
+    def prepare(self, document, url):
+        self.anchors.setdefault(url, {})
+        self._collect_anchors(document, url, '')
+        self._normalize(document, url)
+
+    # Records the location independent identifiers ("$id": "#Point")
+    def _collect_anchors(self, node, url, pointer):
+        if isinstance(node, dict):
+            node_id = node.get('$id')
+            if pointer and isinstance(node_id, str) and node_id.startswith('#'):
+                self.anchors[url][node_id[1:]] = pointer
+                del node['$id']
+            for key in node:
+                self._collect_anchors(node[key], url, pointer + '/' + key)
+        elif isinstance(node, list):
+            for i, item in enumerate(node):
+                self._collect_anchors(item, url, pointer + '/' + str(i))
+
+    # Makes every $ref an absolute URL with a JSON pointer as fragment
+    def _normalize(self, node, url):
+        if isinstance(node, dict):
+            ref = node.get('$ref')
+            if isinstance(ref, str):
+                if ref.startswith('/'):
+                    # Some schemas use '/definitions/...' meaning a local pointer
+                    ref = '#' + ref
+                location, fragment = urldefrag(urljoin(url, ref))
+                if fragment and not fragment.startswith('/'):
+                    self.load(location)
+                    fragment = self.anchors[location].get(fragment, fragment)
+                node['$ref'] = location + '#' + fragment if fragment else location
+            for key in node:
+                self._normalize(node[key], url)
+        elif isinstance(node, list):
+            for item in node:
+                self._normalize(item, url)
+
+    def handlers(self):
+        return {'http': self.load, 'https': self.load}
+
+
+# Returns the Entity Type declared by a schema (enum of its 'type' property)
+def schema_entity_type(schema_path, resolver):
+    schema = resolver.load(schema_path)
+    properties = collect_properties(schema, os.path.normpath(schema_path), resolver, {})
+
+    type_node = properties.get('type', (None, None))[0]
+    if isinstance(type_node, dict) and type_node.get('enum'):
+        return type_node['enum'][0]
+
+    return None
+
+
+# Generates the code of the validator of one schema.
+# Returns (name of the validation function, code)
+def compile_schema(schema_path, library):
+    with open(schema_path) as data_file:
+        schema = json.loads(data_file.read())
+
+    library.prepare(schema, schema.get('$id', ''))
+
+    code = fastjsonschema.compile_to_code(schema, handlers=library.handlers(), use_default=False)
+    name = RefResolver.from_schema(schema, handlers=library.handlers()).get_scope_name()
+
+    return name, code
+
+
+# Generates the validators of all the schemas declaring an Entity Type, as
+# compiled (marshalled) Python code.
+# Returns ({schema path -> {'entity_type', 'name', 'code'}}, {schema path -> error})
+def build_validators(specs_folder):
+    root = os.path.dirname(os.path.abspath(specs_folder))
+    resolver = SchemaResolver(root)
+    library = SchemaLibrary(root)
+    validators = {}
+    errors = {}
+
+    for schema_path in find_schemas(specs_folder):
+        schema_path = os.path.abspath(schema_path)
+        rel_path = os.path.relpath(schema_path, root)
+
+        entity_type = schema_entity_type(schema_path, resolver)
+        if entity_type is None:
+            continue
+
+        try:
+            name, code = compile_schema(schema_path, library)
+        except (fastjsonschema.JsonSchemaDefinitionException, ValueError) as e:
+            errors[rel_path] = str(e)
+            continue
+
+        validators[rel_path] = {
+            'entity_type': entity_type,
+            'name': name,
+            'code': marshal.dumps(compile(code, rel_path, 'exec'))
+        }
+
+    return validators, errors
+
+
+# Returns the generated validators, reusing the on-disk cache while no
+# schema changed. Compiling the generated code is what takes most of the
+# time, hence the compiled form is cached (it depends on the Python version)
+def load_validator_code(specs_folder, cache_file=None):
+    fingerprint = schemas_fingerprint(specs_folder)
+    generator = [fastjsonschema.VERSION, sys.implementation.cache_tag]
+
+    if cache_file and os.path.isfile(cache_file):
+        try:
+            with open(cache_file, 'rb') as data_file:
+                cached = pickle.load(data_file)
+            if cached['version'] == CACHE_VERSION and cached['generator'] == generator and \
+                    cached['fingerprint'] == fingerprint:
+                return cached['validators'], cached['errors']
+        except (pickle.UnpicklingError, EOFError, KeyError, ValueError, TypeError):
+            pass
+
+    validators, errors = build_validators(specs_folder)
+
+    if cache_file:
+        tmp_file = cache_file + '.tmp'
+        with open(tmp_file, 'wb') as data_file:
+            pickle.dump({
+                'version': CACHE_VERSION,
+                'generator': generator,
+                'fingerprint': fingerprint,
+                'validators': validators,
+                'errors': errors
+            }, data_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+
+    return validators, errors
+
+
+class EntityValidator:
+    def __init__(self, validators, errors=None):
+        # schema (relative path) -> validation function
+        self.functions = {}
+        # entity type -> schema (relative path), the first one found wins
+        self.schemas = {}
+        # schema (relative path) -> reason why it could not be compiled
+        self.errors = errors or {}
+
+        for schema in validators:
+            spec = validators[schema]
+            namespace = {}
+            exec(marshal.loads(spec['code']), namespace)
+            self.functions[schema] = namespace[spec['name']]
+            self.schemas.setdefault(spec['entity_type'], schema)
+
+    # Returns None if the entity is valid or the reason why it is not.
+    # By default the schema is chosen by the Entity Type
+    def validate_entity(self, entity, schema=None):
+        if schema is None:
+            entity_type = entity.get('type') if isinstance(entity, dict) else None
+            schema = self.schemas.get(entity_type)
+            if schema is None:
+                return 'No schema for Entity Type: {}'.format(entity_type)
+
+        function = self.functions[schema]
+
+        try:
+            function(entity)
+        except fastjsonschema.JsonSchemaValueException as e:
+            return e.message
+
+        return None
+
+    # Validates a batch (any iterable) of entities, yielding (entity, error)
+    def validate(self, entities):
+        for entity in entities:
+            yield entity, self.validate_entity(entity)
+
+
+# Returns an EntityValidator for all the Entity Types under the specs folder
+def load_validator(specs_folder, cache_file=None):
+    validators, errors = load_validator_code(specs_folder, cache_file)
+
+    return EntityValidator(validators, errors)
+
+
+# Examples of the corpus, and whether they are encoded as key-values
+corpus_examples = [
+    ('example.json', True),
+    ('example-normalized.json', False),
+    ('example-normalized-ld.jsonld', False)
+]
+
+# NGSI-LD members which stand for NGSI v2 attributes
+ld_date_members = {
+    'createdAt': 'dateCreated',
+    'modifiedAt': 'dateModified'
+}
+
+
+# Obtains the key-values representation of a normalized (NGSI v2 or NGSI-LD)
+# entity, which is what the schemas describe
+def to_key_values(entity):
+    out = {}
+
+    for key in entity:
+        attr = entity[key]
+
+        if key == '@context':
+            continue
+
+        if key in ld_date_members:
+            out[ld_date_members[key]] = attr
+            continue
+
+        if not isinstance(attr, dict) or key == 'id' or key == 'type':
+            out[key] = attr
+            continue
+
+        if 'object' in attr:
+            value = attr['object']
+        else:
+            value = attr.get('value')
+
+        if isinstance(value, dict):
+            if '@value' in value:
+                value = value['@value']
+            elif value.get('type') == 'PostalAddress':
+                value = {k: v for k, v in value.items() if k != 'type'}
+
+        out[key] = value
+
+    return out
+
+
+def file_hash(path):
+    with open(path, 'rb') as data_file:
+        return hashlib.sha256(data_file.read()).hexdigest()
+
+
+# Changes in the validator or in the schemas shared by the Entity Types
+# (common-schema.json, geometry-schema.json, the domain schemas)
+# invalidate the whole manifest
+def shared_hash(specs_folder):
+    h = hashlib.sha256()
+    root = os.path.dirname(os.path.abspath(specs_folder))
+    tools_folder = os.path.dirname(os.path.abspath(__file__))
+
+    for f in ('schema_validator.py', 'schema_types.py'):
+        with open(os.path.join(tools_folder, f), 'rb') as data_file:
+            h.update(data_file.read())
+
+    h.update(fastjsonschema.VERSION.encode('utf-8'))
+
+    for path, mtime, size in schemas_fingerprint(specs_folder):
+        if os.path.basename(path) != 'schema.json':
+            h.update(path.encode('utf-8'))
+            h.update(file_hash(os.path.join(root, path)).encode('utf-8'))
+
+    return h.hexdigest()
+
+
+# Returns the (schema, example, key-values) to validate under the specs folder
+def find_corpus(specs_folder):
+    out = []
+
+    for schema_path in find_schemas(specs_folder):
+        folder = os.path.dirname(schema_path)
+        for example, key_values in corpus_examples:
+            example_path = os.path.join(folder, example)
+            if os.path.isfile(example_path):
+                out.append((schema_path, example_path, key_values))
+
+    return out
+
+
+def read_manifest(manifest_file):
+    try:
+        with open(manifest_file) as data_file:
+            return json.loads(data_file.read())
+    except (IOError, ValueError):
+        return {}
+
+
+def write_manifest(manifest, manifest_file):
+    tmp_file = manifest_file + '.tmp'
+    with open(tmp_file, 'w') as data_file:
+        data_file.write(json.dumps(manifest, indent=4, sort_keys=True))
+        data_file.write("\n")
+    os.replace(tmp_file, manifest_file)
+
+
+_worker_validator = None
+
+
+def init_worker(validators, errors):
+    global _worker_validator
+    _worker_validator = EntityValidator(validators, errors)
+
+
+# Validates one example file against the validator of its Entity Type.
+# Returns (error or None, number of entities, validation time)
+def validate_example(example_path, schema, entity_type, key_values):
+    try:
+        with open(example_path) as data_file:
+            data = json.loads(data_file.read())
+    except (IOError, ValueError) as e:
+        return '{}: {}'.format(type(e).__name__, e), 0, 0.0
+
+    entities = data if isinstance(data, list) else [data]
+    if not key_values:
+        entities = [to_key_values(e) if isinstance(e, dict) else e for e in entities]
+
+    start = time.perf_counter()
+    error = None
+    for entity in entities:
+        if isinstance(entity, dict) and entity.get('type') != entity_type:
+            error = 'Entity Type {} does not match the schema ({})'.format(entity.get('type'), entity_type)
+        else:
+            error = _worker_validator.validate_entity(entity, schema)
+        if error is not None:
+            break
+    elapsed = time.perf_counter() - start
+
+    return error, len(entities), elapsed
+
+
+# Prints the validation time per Entity Type and the slowest schemas
+def print_timing_report(timings, top, out=sys.stdout):
+    if len(timings) == 0:
+        return
+
+    out.write('\n{:<32} {:>9} {:>10} {:>16}\n'.format('Entity Type', 'entities', 'time (ms)', 'per entity (us)'))
+    for entity_type in sorted(timings, key=lambda t: timings[t][1], reverse=True):
+        count, elapsed = timings[entity_type]
+        out.write('{:<32} {:>9} {:>10.3f} {:>16.1f}\n'.format(
+            entity_type, count, elapsed * 1000, elapsed * 1e6 / max(count, 1)))
+
+    slowest = sorted(timings, key=lambda t: timings[t][1] / max(timings[t][0], 1), reverse=True)[:top]
+    out.write('\nSlowest schemas (per entity):\n')
+    for entity_type in slowest:
+        count, elapsed = timings[entity_type]
+        out.write('  {} ({:.1f} us)\n'.format(entity_type, elapsed * 1e6 / max(count, 1)))
+
+
+# Validates every example under the specs folder against its schema, except
+# the pairs whose schema and example did not change since they last passed
+def validate_corpus(specs_folder, cache_file, manifest_file, workers=None, force=False, top=10):
+    validators, schema_errors = load_validator_code(specs_folder, cache_file)
+    root = os.path.dirname(os.path.abspath(specs_folder))
+
+    manifest = read_manifest(manifest_file)
+    shared = shared_hash(specs_folder)
+
+    if manifest.get('shared') != shared:
+        manifest = {}
+
+    entries = manifest.get('files', {})
+    pending = []
+    errors = []
+    skipped = 0
+    schema_hashes = {}
+
+    for schema_path, example_path, key_values in find_corpus(specs_folder):
+        schema_key = os.path.relpath(os.path.abspath(schema_path), root)
+        key = os.path.relpath(os.path.abspath(example_path), root)
+
+        if schema_key not in validators:
+            entries.pop(key, None)
+            errors.append((key, schema_errors.get(schema_key, 'Schema does not declare an Entity Type')))
+            continue
+
+        if schema_key not in schema_hashes:
+            schema_hashes[schema_key] = file_hash(schema_path)
+        entry = {'schema': schema_hashes[schema_key], 'example': file_hash(example_path)}
+
+        if not force and entries.get(key) == entry:
+            skipped += 1
+            continue
+
+        pending.append((key, example_path, schema_key, validators[schema_key]['entity_type'], key_values, entry))
+
+    # entity type -> [entities, validation time]
+    timings = {}
+    validated = 0
+
+    if len(pending) > 0:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(validators, schema_errors)) as executor:
+            results = executor.map(validate_example,
+                                   [p[1] for p in pending],
+                                   [p[2] for p in pending],
+                                   [p[3] for p in pending],
+                                   [p[4] for p in pending],
+                                   chunksize=max(1, len(pending) // (4 * (workers or os.cpu_count() or 1))))
+
+            for (key, example_path, schema, entity_type, key_values, entry), result in zip(pending, results):
+                error, count, elapsed = result
+                if count > 0:
+                    timing = timings.setdefault(entity_type, [0, 0.0])
+                    timing[0] += count
+                    timing[1] += elapsed
+
+                if error is None:
+                    entries[key] = entry
+                    validated += 1
+                else:
+                    entries.pop(key, None)
+                    errors.append((key, error))
+
+    write_manifest({'shared': shared, 'files': entries}, manifest_file)
+
+    print('validated: {} skipped: {} failed: {}'.format(validated, skipped, len(errors)))
+    for key, error in errors:
+        print('{} -> {}'.format(key, error))
+
+    print_timing_report(timings, top)
+
+    return len(errors) == 0
+
+
+def main(args):
+    if args.corpus:
+        ok = validate_corpus(args.corpus, args.cache, args.manifest, args.workers, args.force, args.top)
+        exit(0 if ok else 1)
+
+    if args.file is None:
+        print('Usage: schema_validator [file]')
+        print('       schema_validator --corpus [specs folder]')
+        exit(-1)
+
+    start = time.perf_counter()
+    validator = load_validator(args.specs, args.cache)
+
+    for schema in sorted(validator.errors):
+        sys.stderr.write('Schema {} cannot be compiled: {}\n'.format(schema, validator.errors[schema]))
+
+    in_stream = open_stream(args.file)
+    count = 0
+    invalid = 0
+
+    try:
+        for entity, error in validator.validate(read_entities(in_stream)):
+            count += 1
+            if error is not None:
+                invalid += 1
+                print('{}: {}'.format(entity.get('id') if isinstance(entity, dict) else count, error))
+    finally:
+        close_stream(in_stream)
+
+    report_throughput(count, start)
+
+    if invalid > 0:
+        sys.stderr.write('{} invalid entities\n'.format(invalid))
+        exit(1)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(prog='schema_validator')
+    parser.add_argument('file', nargs='?', help='NDJSON or JSON array of key-values entities (\'-\' for stdin)')
+    parser.add_argument('--specs', default='../specs', help='specs folder')
+    parser.add_argument('--cache', default='validators.cache', help='cache of the generated validators')
+    parser.add_argument('--corpus', help='specs folder whose examples are validated')
+    parser.add_argument('--manifest', default='validation_manifest.json',
+                        help='file recording the examples already validated')
+    parser.add_argument('--workers', type=int, help='amount of worker processes')
+    parser.add_argument('--force', action='store_true', help='validate every example')
+    parser.add_argument('--top', type=int, default=10, help='amount of slowest schemas reported')
+
+    main(parser.parse_args())